@@ -0,0 +1,27 @@
+"""Gunicorn settings, read automatically when gunicorn is started from this directory.
+
+XCEPTION_LOAD_MODE chooses when the image classifier is loaded:
+    lazy    - on the first photo classified by each worker (the default)
+    warmup  - by each worker as it boots, so no upload has to wait for it
+    preload - keras and tensorflow are imported once by the master before forking, so the
+              workers share those pages, then each worker builds the model as it boots
+Run "python manage.py benchmark_model_loading" to compare the modes.
+"""
+import os
+
+load_mode = os.environ.get("XCEPTION_LOAD_MODE", "lazy")
+preload_app = load_mode == "preload"
+
+
+def when_ready(server):
+    """Import the classifier's libraries in the master before any workers are forked."""
+    if load_mode == "preload":
+        from polls.ml_ai_image_classification import preload  # pylint: disable=import-outside-toplevel
+        preload()
+
+
+def post_worker_init(worker):
+    """Load the model as soon as the worker has loaded the application."""
+    if load_mode in ("warmup", "preload"):
+        from polls.ml_ai_image_classification import warm_up  # pylint: disable=import-outside-toplevel
+        warm_up()
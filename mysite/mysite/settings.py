@@ -137,3 +137,69 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 #media root for media and for locating media
 MEDIA_ROOT =  os.path.join(BASE_DIR, 'media') 
 MEDIA_URL = '/media/'
+
+# Uploaded photos are checked by the AI on a pool of background threads.
+# Turn VERIFICATION_ASYNC off to check them inside the upload request instead.
+VERIFICATION_ASYNC = os.environ.get("VERIFICATION_ASYNC", "1") == "1"
+VERIFICATION_WORKERS = int(os.environ.get("VERIFICATION_WORKERS", "2"))
+
+# The weights for the Xception image classifier, 'imagenet' downloads them on first use
+# or a path to a local weights file can be given.
+XCEPTION_WEIGHTS = os.environ.get("XCEPTION_WEIGHTS", "imagenet")
+
+# Set INFERENCE_SERVER_ADDRESS ("host:port" or a unix socket path) to classify photos on a
+# shared server started with "python manage.py run_inference_server", which batches
+# photos from every worker together. Without it each worker loads its own model.
+INFERENCE_SERVER_ADDRESS = os.environ.get("INFERENCE_SERVER_ADDRESS")
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", "16"))
+INFERENCE_MAX_LATENCY_MS = int(os.environ.get("INFERENCE_MAX_LATENCY_MS", "20"))
+
+# The number of photos whose AI results are kept, the least recently used are removed first.
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+
+# Photos are shrunk so their longest side is at most this many pixels before looking for
+# faces, 0 looks for faces at full resolution.
+FACE_DETECTION_MAX_SIDE = int(os.environ.get("FACE_DETECTION_MAX_SIDE", "1280"))
+
+# Challenges are found from a photo's location with a grid of cells this many degrees wide,
+# rebuilt from the database at most this many seconds after a challenge changes elsewhere.
+CHALLENGE_INDEX_CELL_DEGREES = float(os.environ.get("CHALLENGE_INDEX_CELL_DEGREES", "0.1"))
+CHALLENGE_INDEX_TTL = int(os.environ.get("CHALLENGE_INDEX_TTL", "30"))
+
+# How media files are sent once Django has checked the user may see them:
+# 'x-accel-redirect' for nginx, with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX that
+# aliases MEDIA_ROOT, 'x-sendfile' for Apache or lighttpd, or '' to send them from Django.
+MEDIA_SENDFILE = os.environ.get("MEDIA_SENDFILE", "")
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get("MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+# How long browsers keep media files that are not named by their content.
+MEDIA_CACHE_MAX_AGE = int(os.environ.get("MEDIA_CACHE_MAX_AGE", "3600"))
+
+# The number of photos on each page of the feed.
+FEED_PAGE_SIZE = int(os.environ.get("FEED_PAGE_SIZE", "10"))
+
+# The rendered feed cards are cached here, in each process's memory unless
+# FEED_CARD_CACHE_DIR names a directory the processes can share.
+FEED_CARD_CACHE_TIMEOUT = int(os.environ.get("FEED_CARD_CACHE_TIMEOUT", "86400"))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'feed_cards': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'
+        if os.environ.get("FEED_CARD_CACHE_DIR")
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.environ.get("FEED_CARD_CACHE_DIR", "feed_cards"),
+        'TIMEOUT': FEED_CARD_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# With VOTE_WRITE_BEHIND set, votes are stored straight away but photo scores are written
+# every VOTE_FLUSH_INTERVAL seconds, so a burst of votes for one photo is one UPDATE.
+VOTE_WRITE_BEHIND = os.environ.get("VOTE_WRITE_BEHIND", "0") == "1"
+VOTE_FLUSH_INTERVAL = float(os.environ.get("VOTE_FLUSH_INTERVAL", "1.0"))
+
+# The number of users shown on each page of the leaderboards, and the number shown either
+# side of the user's own rank.
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", "100"))
+LEADERBOARD_NEIGHBOURS = int(os.environ.get("LEADERBOARD_NEIGHBOURS", "2"))
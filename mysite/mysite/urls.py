@@ -14,17 +14,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.views.generic import RedirectView
 
+from polls.media import serve_media
+
 urlpatterns = [
     path('', RedirectView.as_view(url='polls/')),
     path('polls/', include('polls.urls')),
     path('polls/uploadimage', include('polls.urls')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(r'^{0}(?P<path>.+)$'.format(settings.MEDIA_URL.lstrip('/')), serve_media),
+]
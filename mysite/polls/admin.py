@@ -10,9 +10,11 @@ class ImageAdmin(admin.ModelAdmin):
     """This is used for looking at all the
      images saved on the database."""
     fields = ['user', 'description', 'img', 'image_tag',
-              'gps_coordinates', 'taken_date', 'score', 'challenge']
+              'gps_coordinates', 'taken_date', 'score', 'challenge',
+              'status', 'rejection_reason']
     readonly_fields = ['user', 'description', 'img',
-                       'image_tag', 'gps_coordinates', 'taken_date', 'challenge']
+                       'image_tag', 'gps_coordinates', 'taken_date', 'challenge',
+                       'rejection_reason', 'score']
     actions = ['delete_model']
 
     def image_tag(self, img):
@@ -24,11 +26,14 @@ class ImageAdmin(admin.ModelAdmin):
         """This is used to update add permissions to false."""
         return False
 
+    def save_model(self, request, obj, form, change):
+        """Saving changes made by a moderator, which the feed shows straight away."""
+        obj.card_version += 1
+        super().save_model(request, obj, form, change)
+
     def delete_model(self, request, obj):
         """Overwriting the image deletion method to allow for overwriting the image."""
-        obj.description = "This image has been deleted by an administrator."
-        obj.img = "picture/error.jpg"
-        obj.save()
+        obj.remove_photo("This image has been deleted by an administrator.")
 
     image_tag.short_description = 'Image'
 
@@ -47,7 +52,7 @@ class BadgeAdmin(admin.ModelAdmin):
 class ChallengeAdmin(admin.ModelAdmin):
     """This is used to display challenges in admin."""
     fields = ['name', 'description', 'location', 'locationRadius',
-              'subject', 'startDate', 'endDate']
+              'subject', 'synonyms', 'startDate', 'endDate']
 
 
 @admin.register(Profile)
@@ -0,0 +1,80 @@
+"""A persistent cache of the AI results for photos. Results are keyed by the SHA-256 of
+the photo's bytes and the version of the models, so a photo that is submitted again, or
+submitted to several challenges, is only analysed once."""
+import hashlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from .image_decoding import DecodedImage
+from .ml_ai_image_classification import ai_face_recognition, classify_image
+from .models import AnalysisResult
+
+# change this whenever the classifier or face detector changes, so that old results are
+# no longer used
+MODEL_VERSION = 'xception-imagenet-top25/haarcascade-frontalface-alt'
+
+
+def model_version():
+    """The version results are stored under, including the face detection resolution."""
+    return f"{MODEL_VERSION}@{getattr(settings, 'FACE_DETECTION_MAX_SIDE', 1280)}/decoded"
+
+
+def content_hash(image_file):
+    """Return the SHA-256 of an image file, reading it in chunks, or of the bytes of an
+    image that has already been read into a DecodedImage."""
+    if isinstance(image_file, DecodedImage):
+        return hashlib.sha256(image_file.data).hexdigest()
+    sha = hashlib.sha256()
+    for chunk in image_file.chunks():
+        sha.update(chunk)
+    image_file.seek(0)
+    return sha.hexdigest()
+
+
+def _lookup(digest):
+    """Return the cached result for a photo, marking it as recently used."""
+    results = AnalysisResult.objects.filter(content_hash=digest, model_version=model_version())
+    result = results.first()
+    if result is not None:
+        results.update(last_used=timezone.now())
+    return result
+
+
+def _store(digest, **values):
+    """Save a result for a photo, then evict the least recently used results."""
+    values['last_used'] = timezone.now()
+    AnalysisResult.objects.update_or_create(content_hash=digest, model_version=model_version(),
+                                            defaults=values)
+    evict()
+
+
+def evict():
+    """Delete the least recently used results beyond ANALYSIS_CACHE_MAX_ENTRIES."""
+    limit = getattr(settings, 'ANALYSIS_CACHE_MAX_ENTRIES', 10000)
+    stale = AnalysisResult.objects.order_by('-last_used').values_list('id', flat=True)[limit:]
+    stale = list(stale)
+    if stale:
+        AnalysisResult.objects.filter(id__in=stale).delete()
+
+
+def get_predictions(image_file, digest=None):
+    """Return the top 25 (class index, label, score) predictions for a photo."""
+    digest = digest or content_hash(image_file)
+    result = _lookup(digest)
+    if result is not None and result.predictions is not None:
+        return [tuple(prediction) for prediction in result.predictions]
+    predictions = classify_image(image_file)
+    _store(digest, predictions=predictions)
+    return predictions
+
+
+def get_face_count(image_file, digest=None):
+    """Return the number of faces found in a photo."""
+    digest = digest or content_hash(image_file)
+    result = _lookup(digest)
+    if result is not None and result.face_count is not None:
+        return result.face_count
+    face_count = ai_face_recognition(image_file)
+    _store(digest, face_count=face_count)
+    return face_count
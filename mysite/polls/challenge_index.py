@@ -0,0 +1,102 @@
+"""A spatial index over the running challenges, used to find every challenge a photo
+qualifies for from where and when it was taken. The world is split into a grid of cells
+and each challenge is listed in the cells its bounding box touches, so a lookup only
+checks the few challenges near the photo instead of every challenge."""
+import math
+import threading
+import time
+from collections import namedtuple
+
+import pytz
+from django.conf import settings
+from django.utils import timezone
+
+from .image_metadata import in_bounding_box, within_distance
+from .models import Challenge
+
+ChallengeArea = namedtuple('ChallengeArea', ['id', 'start', 'end', 'latitude', 'longitude',
+                                             'radius', 'box'])
+
+
+class ChallengeIndex:
+    """Grid buckets of ChallengeArea entries, cell_size degrees on each side.
+    A challenge that would cover more than max_cells cells is checked for every lookup."""
+
+    def __init__(self, areas, cell_size=0.1, max_cells=1024):
+        self.cell_size = cell_size
+        self.columns = math.ceil(360 / cell_size)
+        self.cells = {}
+        self.large = []
+        for area in areas:
+            self.add(area, max_cells)
+
+    def _row(self, latitude):
+        return math.floor(latitude / self.cell_size)
+
+    def _column(self, longitude):
+        return math.floor(longitude / self.cell_size) % self.columns
+
+    def add(self, area, max_cells=1024):
+        """List an area in every cell its bounding box touches."""
+        min_lat, max_lat, min_long, max_long = area.box
+        rows = range(self._row(min_lat), self._row(max_lat) + 1)
+        first = math.floor(min_long / self.cell_size)
+        count = min(math.floor(max_long / self.cell_size) - first + 1, self.columns)
+        if len(rows) * count > max_cells:
+            self.large.append(area)
+            return
+        for row in rows:
+            for column in range(first, first + count):
+                self.cells.setdefault((row, column % self.columns), []).append(area)
+
+    def find(self, latitude, longitude, taken, now=None):
+        """Return the ids of the challenges running at now that a photo taken at taken,
+        at latitude and longitude, qualifies for, the soonest to end first."""
+        now = now or timezone.now()
+        candidates = self.cells.get((self._row(latitude), self._column(longitude)), [])
+        matches = [area for area in candidates + self.large
+                   if area.start < taken < area.end and area.start <= now < area.end
+                   and in_bounding_box(area.box, latitude, longitude)
+                   and within_distance((area.latitude, area.longitude),
+                                       (latitude, longitude), area.radius)]
+        return [area.id for area in sorted(matches, key=lambda area: area.end)]
+
+
+def load_areas():
+    """Read the geometry of every challenge that has not ended from the database."""
+    rows = Challenge.objects.filter(endDate__gt=timezone.now(), min_latitude__isnull=False) \
+        .values_list('id', 'startDate', 'endDate', 'latitude', 'longitude', 'locationRadius',
+                     'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude')
+    return [ChallengeArea(*row[:6], box=row[6:]) for row in rows]
+
+
+_index = None
+_index_built = 0
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the index of the running challenges, rebuilding it when it is older than
+    CHALLENGE_INDEX_TTL seconds or a challenge has changed in this process."""
+    global _index, _index_built
+    with _index_lock:
+        if _index is None or \
+                time.monotonic() - _index_built > getattr(settings, 'CHALLENGE_INDEX_TTL', 30):
+            _index = ChallengeIndex(load_areas(),
+                                    getattr(settings, 'CHALLENGE_INDEX_CELL_DEGREES', 0.1))
+            _index_built = time.monotonic()
+        return _index
+
+
+def invalidate():
+    """Make the next lookup rebuild the index."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def find_challenge_ids(latitude, longitude, taken_date):
+    """Return the ids of the running challenges a photo qualifies for.
+    taken_date is the naive UTC time from the photo's metadata."""
+    taken = pytz.UTC.localize(taken_date) if timezone.is_naive(taken_date) else taken_date
+    return get_index().find(latitude, longitude, taken)
@@ -0,0 +1,30 @@
+"""Path converters for the polls urls."""
+import re
+
+# the largest id the converter accepts, well inside the range of a BigAutoField
+MAX_ID = 10 ** 18 - 1
+
+
+class IdConverter:
+    """The id of a row, a whole number small enough to be stored in a BigAutoField, so
+    ids the database could not hold are answered with a 404 before they reach it."""
+    regex = '[0-9]{1,18}'
+
+    def to_python(self, value):
+        return int(value)
+
+    def to_url(self, value):
+        return str(value)
+
+
+def parse_id(value):
+    """Return value as an id if it is one, otherwise None."""
+    if value is None or not re.fullmatch(IdConverter.regex, value):
+        return None
+    return int(value)
+
+
+def is_id(value):
+    """See if a value decoded from JSON is an id. Only whole numbers are, not bools or
+    numbers given as strings."""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_ID
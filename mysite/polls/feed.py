@@ -0,0 +1,133 @@
+"""This is used to page through the photo feed in a random order without sorting every photo
+on every visit. Each photo gets a random sort_key when it is uploaded, and each session gets
+a random seed. A session's feed starts at the first photo whose key is at least the seed,
+runs to the largest key, then wraps round to the smallest, so every session sees the photos
+in a different but stable order. Pages are read with the image_feed_order index from the
+last photo shown, so a page costs the same however many photos there are."""
+import base64
+import binascii
+import random
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Q
+from django.urls import reverse
+
+from .models import SORT_KEY_SPAN, Challenge, Image, Vote
+from .votes import merge_pending
+
+SEED_SESSION_KEY = 'feed_seed'
+# the most photos a client may ask for in one page
+MAX_PAGE_SIZE = 50
+
+
+def get_seed(session):
+    """Return the session's feed seed, choosing one the first time."""
+    seed = session.get(SEED_SESSION_KEY)
+    if not isinstance(seed, int) or not 0 <= seed < SORT_KEY_SPAN:
+        seed = random.randrange(SORT_KEY_SPAN)
+        session[SEED_SESSION_KEY] = seed
+    return seed
+
+
+def encode_cursor(wrapped, sort_key, image_id):
+    """Turn the position of the last photo shown into an opaque string for the next link."""
+    text = f'{int(wrapped)}.{sort_key}.{image_id}'
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (wrapped, sort_key, image_id) from a cursor, or None if it is not valid."""
+    if not cursor:
+        return None
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        wrapped, sort_key, image_id = (int(part) for part in text.split('.'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if wrapped not in (0, 1):
+        return None
+    return bool(wrapped), sort_key, image_id
+
+
+def feed_queryset():
+    """The accepted photos in running challenges, loaded with the challenge, photographer
+    and profile picture each card shows."""
+    active = list(Challenge.objects.filter(active=True).values_list('id', flat=True))
+    return Image.objects.filter(status=Image.ACCEPTED, challenge_id__in=active) \
+        .select_related('challenge', 'user', 'user__profile')
+
+
+def voted_ids(user, images):
+    """The ids of the images in images that user has voted for, found in one query."""
+    if not user.is_authenticated or not images:
+        return set()
+    votes = Vote.objects.filter(user_id=user.id, image_id__in=[image.id for image in images])
+    return set(votes.values_list('image_id', flat=True))
+
+
+def feed_page(seed, cursor=None, page_size=None, queryset=None):
+    """Return the next page of photos after cursor in the order given by seed, and the
+    cursor for the page after it, which is None once every photo has been shown."""
+    page_size = page_size or getattr(settings, 'FEED_PAGE_SIZE', 10)
+    queryset = feed_queryset() if queryset is None else queryset
+    wrapped, last_key, last_id = decode_cursor(cursor) or (False, None, None)
+
+    images = []
+    while True:
+        # first the keys from the seed upwards, then the keys below the seed
+        part = queryset.filter(sort_key__lt=seed) if wrapped \
+            else queryset.filter(sort_key__gte=seed)
+        if last_key is not None:
+            part = part.filter(Q(sort_key__gt=last_key) | Q(sort_key=last_key, id__gt=last_id))
+        # one extra photo shows whether there is another page
+        images += part.order_by('sort_key', 'id')[:page_size + 1 - len(images)]
+        if len(images) > page_size or wrapped:
+            break
+        wrapped, last_key, last_id = True, None, None
+
+    if len(images) <= page_size:
+        return merge_pending(images), None
+    images = images[:page_size]
+    last = images[-1]
+    return merge_pending(images), encode_cursor(last.sort_key < seed, last.sort_key, last.id)
+
+
+def page_size_param(value):
+    """The page size a client asked for, kept between 1 and MAX_PAGE_SIZE, or None to
+    use the default."""
+    try:
+        return min(max(int(value), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return None
+
+
+def feed_card(image, viewer, voted):
+    """The data the feed page needs to show one photo, for the JSON feed."""
+    try:
+        avatar = image.user.profile.thumbnail_url
+    except ObjectDoesNotExist:
+        avatar = None
+    card = {
+        'id': image.id,
+        'challenge': image.challenge.name,
+        'thumbnail': image.thumbnail_url,
+        'src': image.display_url,
+        'webp_srcset': image.webp_srcset,
+        'jpeg_srcset': image.jpeg_srcset,
+        'description': image.description,
+        'taken_date': image.taken_date.isoformat(),
+        'author': image.user.username,
+        'author_url': reverse('viewprofile', args=[image.user.username]),
+        'avatar': avatar,
+        'score': image.score,
+        'voted': voted,
+        'vote_url': None,
+        'other_vote_url': None,
+    }
+    if image.user_id != viewer.id:
+        # the form posts to vote_url, and to other_vote_url once the vote has changed
+        vote_url, unvote_url = reverse('vote', args=[image.id]), reverse('unvote', args=[image.id])
+        card['vote_url'], card['other_vote_url'] = \
+            (unvote_url, vote_url) if voted else (vote_url, unvote_url)
+    return card
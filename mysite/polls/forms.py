@@ -12,7 +12,10 @@ from .models import Profile, Challenge
 
 class ImagefieldForm(forms.Form):
     """The form used to upload a new image."""
-    challenge = forms.ModelChoiceField(queryset=Challenge.objects.filter(active=True), initial=0)
+    # left empty, the challenge is found from where and when the photo was taken
+    challenge = forms.ModelChoiceField(queryset=Challenge.objects.filter(active=True),
+                                       required=False,
+                                       empty_label="Find from the photo's location")
     description = forms.CharField(widget=forms.Textarea(attrs={'style': "width:95vw;"}),
                                   max_length=200)
     image = forms.ImageField(validators=[check_image_type])
@@ -0,0 +1,88 @@
+"""This is used to decode an uploaded photo once and share the pixels between the
+classifier and the face detector. JPEG photos are decoded at a reduced scale when only a
+small image is needed, which is much faster and uses far less memory than a full decode."""
+import math
+from io import BytesIO
+
+import numpy as np
+from PIL import Image as PilImage
+
+EXIF_ORIENTATION = 0x0112
+# how to transpose the pixels for each exif orientation, as in PIL's ImageOps.exif_transpose
+ORIENTATIONS = {
+    2: PilImage.Transpose.FLIP_LEFT_RIGHT,
+    3: PilImage.Transpose.ROTATE_180,
+    4: PilImage.Transpose.FLIP_TOP_BOTTOM,
+    5: PilImage.Transpose.TRANSPOSE,
+    6: PilImage.Transpose.ROTATE_270,
+    7: PilImage.Transpose.TRANSVERSE,
+    8: PilImage.Transpose.ROTATE_90,
+}
+
+
+def read_image_bytes(image_file):
+    """Read the contents of an image file, which can be a stored image or
+    an upload that has not been saved yet."""
+    image_file.seek(0)
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+
+class DecodedImage:
+    """A photo read into memory once, with its pixels decoded on demand and reused."""
+
+    def __init__(self, image_file):
+        self.data = read_image_bytes(image_file)
+        self._header = PilImage.open(BytesIO(self.data))
+        self.size = self._header.size
+        self._decoded = None
+
+    def decode(self, mode, min_width, min_height):
+        """Return the photo as a PIL image in mode that is at least min_width by
+        min_height, or full size if the photo is smaller. An earlier decode that is big
+        enough is reused, otherwise JPEG photos are decoded at the smallest scale that
+        is big enough."""
+        need = (min(min_width, self.size[0]), min(min_height, self.size[1]))
+        cached = self._decoded
+        if cached is not None and cached.width >= need[0] and cached.height >= need[1] \
+                and (cached.mode == mode or cached.mode == 'RGB'):
+            return cached if cached.mode == mode else cached.convert(mode)
+
+        image = PilImage.open(BytesIO(self.data))
+        # only JPEG decoders support this, other formats are decoded at full size
+        image.draft(mode, need)
+        image = image.convert(mode)
+        if cached is None or image.width > cached.width:
+            self._decoded = image
+        return image
+
+    def for_classifier(self, size=299):
+        """Return the photo as a size by size RGB array for the image classifier."""
+        image = self.decode('RGB', size, size).resize((size, size), PilImage.NEAREST)
+        return np.asarray(self._orient(image), dtype=np.uint8)
+
+    def grayscale(self, max_side):
+        """Return the photo as a grayscale array whose longest side is at most max_side
+        (0 for full size), rotated the way it was taken, and the scale from the original."""
+        width, height = self.size
+        scale = 1.0
+        if max_side and max(width, height) > max_side:
+            scale = max_side / max(width, height)
+        image = self.decode('L', math.ceil(width * scale), math.ceil(height * scale))
+        if image.width != round(width * scale):
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                 PilImage.BOX)
+        return np.asarray(self._orient(image), dtype=np.uint8), scale
+
+    def _orient(self, image):
+        """Rotate decoded pixels the way the photo's exif says it was taken."""
+        method = ORIENTATIONS.get(self._header.getexif().get(EXIF_ORIENTATION, 1))
+        return image if method is None else image.transpose(method)
+
+
+def as_decoded(image):
+    """Return image if it has already been decoded, otherwise read it into a DecodedImage."""
+    if isinstance(image, DecodedImage):
+        return image
+    return DecodedImage(image)
@@ -1,18 +1,101 @@
 """This is used to extract metadata from the image like the location and time taken."""
 import datetime
+import math
+import re
 from exif import Image
 import geopy.distance
+from geopy.point import Point
 
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+# geopy's pattern for a location, anchored so that text before the numbers is not skipped
+POINT_PATTERN = re.compile(r'\s*' + Point.POINT_PATTERN.pattern.replace('.*?', '', 1), re.X)
+# a little less than the shortest a degree can be, so a bounding box is never too small
+KM_PER_DEGREE = 110.5
+EARTH_RADIUS_KM = 6371.0088
+# the great circle distance is within this fraction of the exact distance on the ellipsoid
+GREAT_CIRCLE_ERROR = 0.01
 
-def get_gps(fname):
-    """Function which returns GPS coordinated in form tuple (latitude, longitude) in decimal."""
-    with open(fname, 'rb') as image_file:
-        my_image = Image(image_file)
 
-    if my_image.has_exif:
-        return (get_lat(my_image.gps_latitude_ref, my_image.gps_latitude)
-                , get_long(my_image.gps_longitude_ref, my_image.gps_longitude))
-    raise Exception('exif not found')
+class PhotoMetadata:
+    """The metadata read from a photo's exif block in a single pass.
+    status is "valid", "missing gps", "missing datetime" or "missing metadata"."""
+
+    def __init__(self, has_exif=False, gps=None, datetime_original=None):
+        self.has_exif = has_exif
+        self.gps = gps
+        self.datetime_original = datetime_original
+
+    @property
+    def status(self):
+        """The validation status of the metadata, as used by the upload page."""
+        if not self.has_exif:
+            return "missing metadata"
+        if self.gps is None:
+            return "missing gps"
+        if self.datetime_original is None:
+            return "missing datetime"
+        return "valid"
+
+    @property
+    def taken_date(self):
+        """The time the photo was taken as a naive datetime, or None if it is missing."""
+        if self.datetime_original is None:
+            return None
+        return datetime.datetime.strptime(self.datetime_original, EXIF_DATETIME_FORMAT)
+
+
+def _read_exif(source):
+    """Parse the exif block from a file path or an open file object."""
+    if hasattr(source, 'read'):
+        source.seek(0)
+        data = source.read()
+        source.seek(0)
+        return Image(data)
+    with open(source, 'rb') as image_file:
+        return Image(image_file)
+
+
+def extract_metadata(source):
+    """Read the exif block of a photo once and return a PhotoMetadata.
+    source can be a file path or an open file object such as an UploadedFile."""
+    my_image = _read_exif(source)
+    if not my_image.has_exif:
+        return PhotoMetadata()
+
+    try:
+        if my_image.gps_latitude_ref is None or my_image.gps_latitude is None or \
+                my_image.gps_longitude_ref is None or my_image.gps_longitude is None:
+            gps = None
+        else:
+            gps = (get_lat(my_image.gps_latitude_ref, my_image.gps_latitude),
+                   get_long(my_image.gps_longitude_ref, my_image.gps_longitude))
+    except AttributeError:
+        gps = None
+
+    try:
+        datetime_original = my_image.datetime_original
+    except AttributeError:
+        datetime_original = None
+
+    return PhotoMetadata(True, gps, datetime_original)
+
+
+def _as_metadata(source):
+    """Return source if it has already been extracted, otherwise extract it."""
+    if isinstance(source, PhotoMetadata):
+        return source
+    return extract_metadata(source)
+
+
+def get_gps(fname):
+    """Function which returns GPS coordinated in form tuple (latitude, longitude) in decimal.
+    fname can be a path, an open file or an already extracted PhotoMetadata."""
+    metadata = _as_metadata(fname)
+    if not metadata.has_exif:
+        raise Exception('exif not found')
+    if metadata.gps is None:
+        raise Exception('gps not found')
+    return metadata.gps
 
 
 def get_lat(ref, lat):
@@ -29,29 +112,87 @@ def get_long(ref, long):
     return -(long[0] + (long[1] / 60) + (long[2] / 3600))
 
 
+def parse_coordinates(text):
+    """Parse a location such as "(50.7366, -3.535)", "50.7366 N, 3.535 W" or
+    50°44'12"N 3°32'6"W into a (latitude, longitude) tuple of floats, reading it with geopy
+    as the distances to it are, or None if it cannot be read."""
+    text = re.sub(r"''", '"', str(text).strip().strip('()[]'))
+    if not POINT_PATTERN.match(text):
+        return None
+    try:
+        point = Point(text)
+    except ValueError:
+        return None
+    return point.latitude, point.longitude
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (min_lat, max_lat, min_long, max_long) of a box that contains every point
+    within radius_km of a location, used as a cheap check before the exact distance."""
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        # near the poles the box has to cover every longitude
+        long_delta = 180
+    else:
+        long_delta = radius_km / (KM_PER_DEGREE * cos_lat)
+    return (max(-90.0, latitude - lat_delta), min(90.0, latitude + lat_delta),
+            longitude - long_delta, longitude + long_delta)
+
+
+def in_bounding_box(box, latitude, longitude):
+    """See if a point is inside a box from bounding_box, allowing for boxes that cross
+    the antimeridian."""
+    min_lat, max_lat, min_long, max_long = box
+    if not min_lat <= latitude <= max_lat:
+        return False
+    if max_long - min_long >= 360:
+        return True
+    return any(min_long <= long <= max_long for long in (longitude - 360, longitude,
+                                                          longitude + 360))
+
+
 def get_distance(starting_point, end_point):
     """A function that gets the distance in km between the location of
      a photo and a GPS location in form (latitude, longitude) in decimal"""
     return geopy.distance.distance(starting_point, end_point).km
 
 
+def great_circle_km(starting_point, end_point):
+    """The distance in km between two (latitude, longitude) points on a sphere, which is
+    much quicker to work out than get_distance but up to half a percent out."""
+    lat1, long1, lat2, long2 = map(math.radians, (*starting_point, *end_point))
+    half_chord = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(half_chord)))
+
+
+def within_distance(starting_point, end_point, radius_km):
+    """See if two points are within radius_km of each other by get_distance, only working
+    out the exact distance when the great circle distance is too close to tell."""
+    estimate = great_circle_km(starting_point, end_point)
+    if estimate < radius_km * (1 - GREAT_CIRCLE_ERROR):
+        return True
+    if estimate > radius_km * (1 + GREAT_CIRCLE_ERROR):
+        return False
+    return get_distance(starting_point, end_point) <= radius_km
+
+
 def get_time(fname):
     """A function that gets the time information from image
-     as a string in format YYYY:MM:DD HH:MM:SS."""
-    with open(fname, 'rb') as image_file:
-        my_image = Image(image_file)
-
-    if my_image.has_exif:
-        return my_image.datetime_original
-    raise Exception('time not found')
+     as a string in format YYYY:MM:DD HH:MM:SS.
+     fname can be a path, an open file or an already extracted PhotoMetadata."""
+    metadata = _as_metadata(fname)
+    if not metadata.has_exif or metadata.datetime_original is None:
+        raise Exception('time not found')
+    return metadata.datetime_original
 
 
 def get_time_dif(starting_time, fname):
     """A function that gets the time difference between when a photo
      was taken and a time of choice in format datetime."""
     difference = starting_time - datetime.datetime.strptime(get_time(fname),
-                                                            "%Y:%m:%d %H:%M:%S")
+                                                            EXIF_DATETIME_FORMAT)
     # converts the string into a datetime object
-    datetime.timedelta(0, 8, 562000)
     seconds_in_day = 24 * 60 * 60
     return (difference.days * seconds_in_day + difference.seconds) / 60
@@ -0,0 +1,147 @@
+"""A local inference service that lets every web worker share one copy of the image
+classifier. Requests that arrive together are grouped into micro batches, so the model
+runs one prediction for many photos instead of one prediction per photo."""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """Turn "host:port" into a tuple for a TCP socket, anything else is a unix socket path."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def get_authkey():
+    """The key the web workers and the inference server use to trust each other."""
+    return settings.SECRET_KEY.encode()
+
+
+class MicroBatcher:
+    """Collects images from many threads into batches of up to batch_size images,
+    waiting at most max_latency seconds after the first image before predicting."""
+
+    def __init__(self, predict_batch, batch_size=16, max_latency=0.02):
+        self.predict_batch = predict_batch
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+
+    def submit(self, image):
+        """Queue an image and return a Future for its row of predictions."""
+        future = Future()
+        self.requests.put((image, future))
+        return future
+
+    def next_batch(self):
+        """Wait for an image, then gather more until the batch is full or the time is up."""
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        """Predict batches forever, sending each caller their own result."""
+        while True:
+            batch = self.next_batch()
+            try:
+                predictions = self.predict_batch(np.stack([image for image, _ in batch]))
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("Batch prediction failed")
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+
+class InferenceServer:
+    """Accepts connections from web workers and answers their predictions through a batcher."""
+
+    def __init__(self, address, batcher, authkey):
+        self.listener = Listener(address, authkey=authkey)
+        self.batcher = batcher
+
+    def handle(self, connection):
+        """Answer every image sent over one connection until the worker disconnects."""
+        with connection:
+            while True:
+                try:
+                    image = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    connection.send(('ok', self.batcher.submit(image).result()))
+                except Exception as error:  # pylint: disable=broad-except
+                    connection.send(('error', str(error)))
+
+    def serve_forever(self):
+        """Start the batcher and accept connections until the process is stopped."""
+        threading.Thread(target=self.batcher.run, daemon=True, name='batcher').start()
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                # a client that fails to authenticate should not stop the server
+                logger.exception("Rejected inference connection")
+                continue
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+
+class InferenceClient:
+    """Sends images to the inference server, keeping one connection per thread."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.local = threading.local()
+
+    def predict(self, image):
+        """Return the model's row of predictions for one 299x299 RGB image."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = Client(self.address, authkey=self.authkey)
+            self.local.connection = connection
+        try:
+            connection.send(image)
+            status, value = connection.recv()
+        except (EOFError, OSError):
+            # the server went away, so connect again next time
+            self.local.connection = None
+            connection.close()
+            raise
+        if status != 'ok':
+            raise RuntimeError(value)
+        return value
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared client for the configured INFERENCE_SERVER_ADDRESS."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClient(parse_address(settings.INFERENCE_SERVER_ADDRESS),
+                                      get_authkey())
+    return _client
@@ -0,0 +1,59 @@
+"""The leaderboards of users by the total score of their photos, overall and in each
+challenge. The totals are kept in UserScore and ChallengeScore, so the pages read the top
+of an index instead of adding up every photo, see rankings for reading them. Votes change
+the totals of the photo's owner along with the photo, photos that are deleted take their
+score with them, and rebuild_user_scores sets the totals from the photos."""
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ChallengeScore, Image, UserScore
+
+
+def add_points(image_id, points):
+    """Add points to the totals of the user who took a photo, overall and in its challenge."""
+    photo = Image.objects.filter(id=image_id)
+    owner = Subquery(photo.values('user_id')[:1])
+    UserScore.objects.filter(user_id=owner).update(score=F('score') + points)
+    ChallengeScore.objects.filter(user_id=owner,
+                                  challenge_id=Subquery(photo.values('challenge_id')[:1])) \
+        .update(score=F('score') + points)
+
+
+def add_photo(image):
+    """Put the owner of a new photo on the leaderboards, with the photo's score."""
+    UserScore.objects.get_or_create(user_id=image.user_id)
+    ChallengeScore.objects.get_or_create(user_id=image.user_id, challenge_id=image.challenge_id)
+    if image.score:
+        UserScore.objects.filter(user_id=image.user_id).update(score=F('score') + image.score)
+        ChallengeScore.objects.filter(user_id=image.user_id, challenge_id=image.challenge_id) \
+            .update(score=F('score') + image.score)
+
+
+def rebuild_user_scores(user_ids=None):
+    """Set the totals of the users in user_ids, or of everyone, from their photos.
+    The rows are set in place by one UPDATE each rather than replaced, so points added by
+    add_points while they are worked out are not lost, then the rows of users who have
+    no photos left are removed and those of users who have none yet are added."""
+    photos = Image.objects.order_by()
+    scores = UserScore.objects.all()
+    challenge_scores = ChallengeScore.objects.all()
+    if user_ids is not None:
+        photos = photos.filter(user_id__in=user_ids)
+        scores = scores.filter(user_id__in=user_ids)
+        challenge_scores = challenge_scores.filter(user_id__in=user_ids)
+    own_photos = photos.filter(user_id=OuterRef('user_id'))
+    with transaction.atomic():
+        for model, rows, matching, fields in (
+                (UserScore, scores, own_photos, ('user_id',)),
+                (ChallengeScore, challenge_scores,
+                 own_photos.filter(challenge_id=OuterRef('challenge_id')),
+                 ('user_id', 'challenge_id'))):
+            total = matching.values('user_id').annotate(total=Sum('score')).values('total')
+            rows.update(score=Coalesce(Subquery(total), Value(0)))
+            rows.exclude(Exists(matching)).delete()
+            existing = model.objects.filter(**{field: OuterRef(field) for field in fields})
+            model.objects.bulk_create(
+                (model(score=row.pop('total'), **row) for row in
+                 photos.exclude(Exists(existing)).values(*fields).annotate(total=Sum('score'))),
+                ignore_conflicts=True)
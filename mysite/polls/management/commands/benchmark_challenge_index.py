@@ -0,0 +1,66 @@
+"""A command to time challenge lookups by photo location against checking every challenge."""
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from polls.challenge_index import ChallengeArea, ChallengeIndex
+from polls.image_metadata import bounding_box, get_distance
+
+
+def random_areas(count, rng):
+    """Make count running challenges spread over Great Britain with radii of 0.5 to 20km."""
+    now = timezone.now()
+    areas = []
+    for challenge_id in range(count):
+        latitude, longitude = rng.uniform(50, 58), rng.uniform(-6, 2)
+        radius = rng.uniform(0.5, 20)
+        areas.append(ChallengeArea(challenge_id, now - datetime.timedelta(days=1),
+                                   now + datetime.timedelta(days=rng.uniform(1, 30)),
+                                   latitude, longitude, radius,
+                                   bounding_box(latitude, longitude, radius)))
+    return areas
+
+
+class Command(BaseCommand):
+    """Build an index of synthetic challenges and time lookups for random photos."""
+    help = "Report challenge lookup latency with the spatial index and with a full scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--challenges', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--lookups', type=int, default=1000)
+        parser.add_argument('--cell-size', type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        """Compare the index with checking the distance to every challenge."""
+        rng = random.Random(0)
+        now = timezone.now()
+        self.stdout.write(f"{'challenges':>10} {'build ms':>9} {'index ms':>9} "
+                          f"{'scan ms':>9} {'matches':>8}")
+        for count in options['challenges']:
+            areas = random_areas(count, rng)
+            start = time.perf_counter()
+            index = ChallengeIndex(areas, options['cell_size'])
+            build = time.perf_counter() - start
+
+            points = [(rng.uniform(50, 58), rng.uniform(-6, 2))
+                      for _ in range(options['lookups'])]
+            start = time.perf_counter()
+            found = [index.find(latitude, longitude, now, now) for latitude, longitude in points]
+            lookup = (time.perf_counter() - start) / len(points)
+
+            # a full scan is slow, so it is only timed on the first hundred photos
+            sample = points[:100]
+            start = time.perf_counter()
+            scanned = [sorted(area.id for area in areas
+                              if get_distance((area.latitude, area.longitude),
+                                              point) <= area.radius)
+                       for point in sample]
+            scan = (time.perf_counter() - start) / len(sample)
+            if scanned != [sorted(ids) for ids in found[:len(sample)]]:
+                self.stderr.write(f"The index disagrees with the full scan for {count}")
+
+            self.stdout.write(f"{count:>10} {build * 1000:>9.1f} {lookup * 1000:>9.3f} "
+                              f"{scan * 1000:>9.2f} {sum(map(len, found)) / len(found):>8.2f}")
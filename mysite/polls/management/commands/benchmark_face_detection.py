@@ -0,0 +1,47 @@
+"""A command to compare face detection on shrunk photos with full resolution detection."""
+import glob
+import os
+import time
+
+import cv2 as cv
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.ml_ai_image_classification import detect_faces
+
+
+class Command(BaseCommand):
+    """Time face detection at several working resolutions on a folder of photos."""
+    help = "Report face detection latency and face count agreement with full resolution."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'feed',
+                                                             'picture', '*.jpg'),
+                            help="Glob of the sample photos.")
+        parser.add_argument('--max-sides', type=int, nargs='+', default=[512, 1024, 2048])
+
+    def handle(self, *args, **options):
+        """Detect faces in every photo at full resolution and at each max side."""
+        paths = sorted(glob.glob(options['images']))
+        images = [cv.imread(path, cv.IMREAD_GRAYSCALE) for path in paths]
+        images = [image for image in images if image is not None]
+        if not images:
+            self.stderr.write("No photos found.")
+            return
+
+        results = {}
+        for max_side in [0] + options['max_sides']:
+            counts, elapsed = [], 0.0
+            for image in images:
+                start = time.perf_counter()
+                counts.append(len(detect_faces(image, max_side)))
+                elapsed += time.perf_counter() - start
+            results[max_side] = (counts, elapsed / len(images))
+
+        full_counts = results[0][0]
+        self.stdout.write(f"{len(images)} photos")
+        self.stdout.write(f"{'max side':>8} {'mean ms':>8} {'faces':>6} {'agree %':>8}")
+        for max_side, (counts, mean) in results.items():
+            agree = sum(a == b for a, b in zip(counts, full_counts)) * 100 / len(images)
+            self.stdout.write(f"{max_side or 'full':>8} {mean * 1000:>8.1f} "
+                              f"{sum(counts):>6} {agree:>8.0f}")
@@ -0,0 +1,77 @@
+"""A command to measure classification throughput with and without micro batching."""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from polls.inference_server import InferenceClient, get_authkey
+
+
+def wait_for_server(address, authkey, timeout=300):
+    """Wait until the server accepts connections, as loading the model takes a while."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            Client(address, authkey=authkey).close()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError("Inference server did not start")
+
+
+def run_clients(client, concurrency, requests):
+    """Send requests images from concurrency threads and return the time of each one."""
+    image = np.random.randint(0, 256, (299, 299, 3), dtype=np.uint8)
+
+    def timed_predict(_):
+        start = time.perf_counter()
+        client.predict(image)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(timed_predict, range(requests)))
+
+
+class Command(BaseCommand):
+    """Start an inference server for each batch size and load it with concurrent clients."""
+    help = "Measure inference server throughput for a range of batch sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--max-latency-ms', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help="Number of uploads classified at the same time.")
+        parser.add_argument('--requests', type=int, default=128)
+
+    def handle(self, *args, **options):
+        """Report images per second and latency percentiles for each batch size."""
+        authkey = get_authkey()
+        self.stdout.write(f"{'batch':>5} {'images/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for batch_size in options['batch_sizes']:
+            address = os.path.join(tempfile.mkdtemp(), 'inference.sock')
+            server = subprocess.Popen(
+                [sys.executable, sys.argv[0], 'run_inference_server', '--address', address,
+                 '--batch-size', str(batch_size),
+                 '--max-latency-ms', str(options['max_latency_ms'])],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(address, authkey)
+                client = InferenceClient(address, authkey)
+                # one request first so that start up costs are not measured
+                run_clients(client, 1, 1)
+                start = time.perf_counter()
+                latencies = run_clients(client, options['concurrency'], options['requests'])
+                elapsed = time.perf_counter() - start
+            finally:
+                server.terminate()
+                server.wait()
+            self.stdout.write(
+                f"{batch_size:>5} {options['requests'] / elapsed:>9.1f} "
+                f"{np.percentile(latencies, 50) * 1000:>8.0f} "
+                f"{np.percentile(latencies, 95) * 1000:>8.0f}")
@@ -0,0 +1,103 @@
+"""A command to compare the start up time and memory use of each model loading mode."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from polls import ml_ai_image_classification
+
+MODES = ['lazy', 'warmup', 'preload']
+
+
+def memory_mb():
+    """Return the resident and proportional set size of this process in MB.
+    The proportional size splits shared pages between the processes sharing them."""
+    usage = {}
+    for path, key in (('/proc/self/status', 'VmRSS:'), ('/proc/self/smaps_rollup', 'Pss:')):
+        try:
+            with open(path) as proc_file:
+                for line in proc_file:
+                    if line.startswith(key):
+                        usage[key.strip(':').lower()] = int(line.split()[1]) / 1024
+                        break
+        except OSError:
+            pass
+    return usage.get('vmrss'), usage.get('pss')
+
+
+def run_worker(mode, write_fd):
+    """Boot a forked worker in the given mode, classify one image and report the timings."""
+    start = time.perf_counter()
+    if mode in ('warmup', 'preload'):
+        ml_ai_image_classification.warm_up()
+    boot = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ml_ai_image_classification.get_model().predict(
+        np.zeros((1, 299, 299, 3), dtype=np.float32), verbose=0)
+    first_request = time.perf_counter() - start
+
+    rss, pss = memory_mb()
+    os.write(write_fd, json.dumps({'boot': boot, 'first_request': first_request,
+                                   'rss': rss, 'pss': pss}).encode() + b'\n')
+
+
+def run_master(mode, workers):
+    """Act as a gunicorn master in the given mode and fork the workers."""
+    start = time.perf_counter()
+    if mode == 'preload':
+        ml_ai_image_classification.preload()
+    master_start = time.perf_counter() - start
+
+    read_fd, write_fd = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            run_worker(mode, write_fd)
+            os._exit(0)  # pylint: disable=protected-access
+        pids.append(pid)
+    os.close(write_fd)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as results:
+        reports = [json.loads(line) for line in results]
+    return {'master_start': master_start, 'workers': reports}
+
+
+class Command(BaseCommand):
+    """Compare the lazy, warmup and preload modes for loading the Xception model."""
+    help = "Measure start up time and memory use for each model loading mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help="Number of workers to fork for each mode.")
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+        parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        """Run each mode in a fresh process so that no mode benefits from another's imports."""
+        if options['child']:
+            result = run_master(options['child'], options['workers'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(f"{'mode':<8} {'master s':>9} {'boot s':>8} {'1st req s':>10} "
+                          f"{'rss MB':>8} {'pss MB':>8}")
+        for mode in options['modes']:
+            output = subprocess.run(
+                [sys.executable, sys.argv[0], 'benchmark_model_loading',
+                 '--child', mode, '--workers', str(options['workers'])],
+                check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            for worker in result['workers']:
+                self.stdout.write(
+                    f"{mode:<8} {result['master_start']:>9.2f} {worker['boot']:>8.2f} "
+                    f"{worker['first_request']:>10.2f} {worker['rss'] or 0:>8.0f} "
+                    f"{worker['pss'] or 0:>8.0f}")
@@ -0,0 +1,90 @@
+"""A command to time a burst of votes for a few photos, with each vote updating the photo
+and with the write-behind vote buffer."""
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from polls import votes
+from polls.models import Challenge, Image
+
+PREFIX = 'benchmark_vote_'
+
+
+class Command(BaseCommand):
+    """Vote for a few hot photos from many threads at once in each mode."""
+    help = "Report vote throughput and latency with direct and buffered score updates. " \
+           "Test users and photos are created in the database and removed afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--photos', type=int, default=3)
+
+    def handle(self, *args, **options):
+        """Run the burst once without and once with the buffer, on fresh photos."""
+        users = [User.objects.create(username=f'{PREFIX}{number}')
+                 for number in range(options['users'])]
+        owner = User.objects.create(username=f'{PREFIX}owner')
+        now = timezone.now()
+        challenge = Challenge.objects.create(name=f'{PREFIX}challenge', description='',
+                                             location='0, 0', locationRadius=1, subject='',
+                                             startDate=now, endDate=now)
+        try:
+            self.stdout.write(f"{'mode':>9} {'votes/s':>8} {'p50 ms':>7} {'p99 ms':>7} "
+                              f"{'UPDATEs':>8} {'correct':>8}")
+            for write_behind in (False, True):
+                photos = [Image.objects.create(
+                    user=owner, challenge=challenge, img='picture/error.jpg', score=0,
+                    gps_coordinates='(0, 0)', taken_date=now, status=Image.ACCEPTED)
+                          for _ in range(options['photos'])]
+                with override_settings(VOTE_WRITE_BEHIND=write_behind):
+                    self.burst('buffered' if write_behind else 'direct', users, photos,
+                               options['threads'])
+        finally:
+            challenge.delete()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    def burst(self, mode, users, photos, threads):
+        """Every user votes for every photo, shared out between the threads."""
+        work = [(user, photo.id) for user in users for photo in photos]
+        latencies = []
+        updates = []
+
+        def vote(jobs):
+            timings = []
+            with CaptureQueriesContext(connection) as queries:
+                for user, photo_id in jobs:
+                    start = time.perf_counter()
+                    votes.cast_vote(user, photo_id)
+                    timings.append(time.perf_counter() - start)
+            latencies.extend(timings)
+            updates.append(sum(query['sql'].startswith('UPDATE') for query in queries))
+            connection.close()
+
+        buffer = votes.get_buffer()
+        workers = [threading.Thread(target=vote, args=(work[number::threads],))
+                   for number in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if buffer is not None:
+            with CaptureQueriesContext(connection) as queries:
+                buffer.stop()
+            updates.append(sum(query['sql'].startswith('UPDATE') for query in queries))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        expected = len(users) * votes.VOTE_POINTS
+        correct = all(Image.objects.get(id=photo.id).score == expected for photo in photos)
+        self.stdout.write(f"{mode:>9} {len(work) / elapsed:8.0f} "
+                          f"{statistics.median(latencies) * 1000:7.2f} "
+                          f"{latencies[int(len(latencies) * 0.99)] * 1000:7.2f} "
+                          f"{sum(updates):8d} {str(correct):>8}")
@@ -0,0 +1,37 @@
+"""A command to make the smaller copies of photos uploaded before they were made on upload."""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from polls.models import Image, Profile, image_storage
+from polls.renditions import IMAGE_WIDTHS, PROFILE_WIDTHS, generate_renditions
+
+
+class Command(BaseCommand):
+    """Make renditions for every accepted photo and profile picture that is missing them."""
+    help = "Make the WebP and progressive JPEG copies of photos and profile pictures."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Make the copies again even if they are up to date.")
+
+    def handle(self, *args, **options):
+        """Go through the photos, then the profile pictures."""
+        default = Profile._meta.get_field('img').default
+        # the feed caches each photo's card by its version, so the cards show the new copies
+        for model, queryset, widths, changes in (
+                (Image, Image.objects.filter(status=Image.ACCEPTED), IMAGE_WIDTHS,
+                 {'card_version': F('card_version') + 1}),
+                (Profile, Profile.objects.exclude(img=default), PROFILE_WIDTHS, {})):
+            made = failed = 0
+            for obj in queryset.only('id', 'img', 'renditions').iterator():
+                if not options['force'] and obj.renditions.get('source') == obj.img.name:
+                    continue
+                try:
+                    renditions = generate_renditions(image_storage, obj.img.name, widths)
+                except OSError as error:
+                    self.stderr.write(f"{model.__name__} {obj.id}: {error}")
+                    failed += 1
+                    continue
+                model.objects.filter(id=obj.id).update(renditions=renditions, **changes)
+                made += 1
+            self.stdout.write(f"{model.__name__}: made {made}, failed {failed}")
@@ -0,0 +1,69 @@
+"""A command to move photos stored under their upload names to content addressed names."""
+import os
+import posixpath
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from polls.models import REMOVED_IMAGE, Image, StoredFile, image_storage, photo_storage
+from polls.storage import file_hash, hashed_name, is_hashed_name
+
+
+def link_or_copy(source, target):
+    """Give target the same content as source, with a hard link when the filesystem allows
+    it so that nothing is copied."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class Command(BaseCommand):
+    """Rename every photo in picture/ to the hash of its content, merging duplicates."""
+    help = "Move existing photos into the content addressed, sharded photo storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be moved without changing anything.")
+
+    def handle(self, *args, **options):
+        """Move one stored file at a time, updating every photo that refers to it."""
+        names = Image.objects.exclude(img__in=['', REMOVED_IMAGE]) \
+            .values_list('img', flat=True).distinct().order_by('img')
+        moved = merged = missing = 0
+        for name in names.iterator():
+            if is_hashed_name(name):
+                continue
+            if not image_storage.exists(name):
+                self.stderr.write(f"Missing {name}")
+                missing += 1
+                continue
+            with image_storage.open(name) as image_file:
+                digest = file_hash(image_file)
+            target = hashed_name(posixpath.dirname(name), digest, posixpath.splitext(name)[1])
+            duplicate = photo_storage.exists(target)
+            self.stdout.write(f"{name} -> {target}{' (duplicate)' if duplicate else ''}")
+            if options['dry_run']:
+                continue
+
+            # the new name is made before the photos point at it, and the old name is only
+            # removed once they do, so a photo never points at a missing file
+            if not duplicate:
+                link_or_copy(image_storage.path(name), photo_storage.path(target))
+            with transaction.atomic():
+                photos = Image.objects.filter(img=name)
+                reference, _ = StoredFile.objects.get_or_create(name=target)
+                StoredFile.objects.filter(pk=reference.pk).update(
+                    references=F('references') + photos.count())
+                for photo in photos.only('id', 'renditions'):
+                    if photo.renditions.get('source') == name:
+                        photo.renditions['source'] = target
+                        Image.objects.filter(id=photo.id).update(renditions=photo.renditions)
+                photos.update(img=target, content_hash=digest)
+            image_storage.delete(name)
+            merged += duplicate
+            moved += not duplicate
+        self.stdout.write(f"Moved {moved}, merged {merged} duplicates, {missing} missing")
@@ -0,0 +1,33 @@
+"""A command to run the shared image classification server."""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.inference_server import InferenceServer, MicroBatcher, get_authkey, parse_address
+from polls.ml_ai_image_classification import predict_images, warm_up
+
+
+class Command(BaseCommand):
+    """Load the model once and answer classification requests from the web workers."""
+    help = "Run the micro batching inference server for the image classifier."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=settings.INFERENCE_SERVER_ADDRESS,
+                            help="host:port or unix socket path to listen on.")
+        parser.add_argument('--batch-size', type=int, default=settings.INFERENCE_BATCH_SIZE,
+                            help="Largest number of images predicted together.")
+        parser.add_argument('--max-latency-ms', type=int,
+                            default=settings.INFERENCE_MAX_LATENCY_MS,
+                            help="Longest time to wait for a batch to fill up.")
+
+    def handle(self, *args, **options):
+        """Warm the model up, then serve until stopped."""
+        if not options['address']:
+            self.stderr.write("Set INFERENCE_SERVER_ADDRESS or pass --address.")
+            return
+        warm_up()
+        batcher = MicroBatcher(predict_images, options['batch_size'],
+                               options['max_latency_ms'] / 1000)
+        server = InferenceServer(parse_address(options['address']), batcher, get_authkey())
+        self.stdout.write(f"Inference server listening on {options['address']}", ending='\n')
+        self.stdout.flush()
+        server.serve_forever()
@@ -0,0 +1,17 @@
+"""A command to check any photos left pending, for example after a restart."""
+from django.core.management.base import BaseCommand
+
+from polls.models import Image
+from polls.verification import verify_image
+
+
+class Command(BaseCommand):
+    """Run the AI checks on every pending photo."""
+    help = "Run the AI checks on every photo that is still pending."
+
+    def handle(self, *args, **options):
+        """Verify the pending photos one at a time."""
+        pending = Image.objects.filter(status=Image.PENDING).values_list('id', flat=True)
+        for image_id in list(pending):
+            status = verify_image(image_id)
+            self.stdout.write(f"Image {image_id}: {status}")
@@ -0,0 +1,162 @@
+"""This is used to serve the uploaded photos and other media files. Django checks the user
+may see the file, then hands the transfer to the front server if one is configured:
+
+    MEDIA_SENDFILE = 'x-accel-redirect' with nginx and
+        location /protected-media/ { internal; alias /path/to/mysite/media/; }
+    MEDIA_SENDFILE = 'x-sendfile' with Apache's mod_xsendfile or lighttpd
+
+Without a front server the file is sent by Django with ETag, conditional and Range
+support, through the WSGI server's file wrapper, which gunicorn sends with os.sendfile."""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+from .storage import is_hashed_name
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+# content addressed files never change, so browsers can keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def can_view(request, path):
+    """Photos and profile pictures are only shown to users who have logged in,
+    the icons and styles used by the login page are public."""
+    return not path.startswith('feed/') or request.user.is_authenticated
+
+
+def cache_control(request, path):
+    """Cache-Control for a media file. Files named by their content are cached for good,
+    and files that need a login are only kept by the user's own browser."""
+    scope = 'private' if path.startswith('feed/') else 'public'
+    if is_hashed_name(path):
+        return f'{scope}, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f"{scope}, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def file_etag(stat):
+    """An ETag that changes whenever the file is replaced or modified."""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """Return the (start, end) of a single "bytes=" range, end included, or None if the
+    header should be ignored. Raises ValueError for a range outside the file."""
+    match = RANGE_PATTERN.match(header or '')
+    if match is None or match.groups() == ('', ''):
+        # no range, or several ranges, which are answered with the whole file
+        return None
+    first, last = match.groups()
+    if first == '':
+        # the last n bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start, end = int(first), int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+class RangeFile:
+    """A file limited to length bytes from its current position. It keeps fileno, so the
+    WSGI server can still send it with sendfile, limited by the Content-Length."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        """Read at most size bytes without going past the end of the range."""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def send_file(request, full_path, path):
+    """Send a file from Python, answering conditional and Range requests."""
+    stat = os.stat(full_path)
+    etag = file_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(request, path),
+        'Accept-Ranges': 'bytes',
+    }
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    try:
+        byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range and if_range != etag:
+        # the copy the browser has part of has changed, so it needs the whole file
+        byte_range = None
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    file = open(full_path, 'rb')  # pylint: disable=consider-using-with
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(RangeFile(file, end - start + 1), status=206,
+                                content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT to a user who may see it."""
+    if not can_view(request, path):
+        return HttpResponse(status=403)
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation as error:
+        # a path outside MEDIA_ROOT
+        raise Http404("Media file not found") from error
+    if not os.path.isfile(full_path):
+        raise Http404("Media file not found")
+
+    mode = getattr(settings, 'MEDIA_SENDFILE', '')
+    if mode == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = quote(
+            getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/') + path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = full_path
+    else:
+        return send_file(request, full_path, path)
+    # the front server works out the content type and length, and answers ranges itself
+    del response['Content-Type']
+    response['Cache-Control'] = cache_control(request, path)
+    return response
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0018_merge_20220322_1820'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('rejected', 'Rejected')], db_index=True, default='accepted', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='rejection_reason',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0019_image_status_image_rejection_reason'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('model_version', models.CharField(max_length=100)),
+                ('predictions', models.JSONField(blank=True, null=True)),
+                ('face_count', models.IntegerField(blank=True, null=True)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='analysisresult',
+            constraint=models.UniqueConstraint(fields=('content_hash', 'model_version'), name='unique_analysis_result'),
+        ),
+    ]
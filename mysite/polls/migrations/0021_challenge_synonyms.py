@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0020_analysisresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='challenge',
+            name='synonyms',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+    ]
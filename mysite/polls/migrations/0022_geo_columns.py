@@ -0,0 +1,106 @@
+import math
+import re
+
+from django.db import migrations, models
+from geopy.point import Point
+
+# copies of polls.image_metadata's helpers as they were when this migration was written,
+# so that later changes to that module do not change what the migration does
+POINT_PATTERN = re.compile(r'\s*' + Point.POINT_PATTERN.pattern.replace('.*?', '', 1), re.X)
+KM_PER_DEGREE = 110.5
+
+
+def parse_coordinates(text):
+    """Read a location such as "(50.7366, -3.535)" or "50.7366 N, 3.535 W" into a
+    (latitude, longitude) tuple, or None if it cannot be read."""
+    text = re.sub(r"''", '"', str(text).strip().strip('()[]'))
+    if not POINT_PATTERN.match(text):
+        return None
+    try:
+        point = Point(text)
+    except ValueError:
+        return None
+    return point.latitude, point.longitude
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (min_lat, max_lat, min_long, max_long) of a box around a circle."""
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        long_delta = 180
+    else:
+        long_delta = radius_km / (KM_PER_DEGREE * cos_lat)
+    return (max(-90.0, latitude - lat_delta), min(90.0, latitude + lat_delta),
+            longitude - long_delta, longitude + long_delta)
+
+
+def fill_geo_columns(apps, schema_editor):
+    """Parse the stored location strings of existing challenges and photos."""
+    Challenge = apps.get_model('polls', 'Challenge')
+    Image = apps.get_model('polls', 'Image')
+    for challenge in Challenge.objects.all():
+        coordinates = parse_coordinates(challenge.location)
+        if coordinates is None:
+            continue
+        challenge.latitude, challenge.longitude = coordinates
+        challenge.min_latitude, challenge.max_latitude, challenge.min_longitude, \
+            challenge.max_longitude = bounding_box(*coordinates, challenge.locationRadius)
+        challenge.save(update_fields=['latitude', 'longitude', 'min_latitude', 'max_latitude',
+                                      'min_longitude', 'max_longitude'])
+    for image in Image.objects.filter(latitude__isnull=True).only('id', 'gps_coordinates'):
+        coordinates = parse_coordinates(image.gps_coordinates)
+        if coordinates is not None:
+            Image.objects.filter(id=image.id).update(latitude=coordinates[0],
+                                                     longitude=coordinates[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0021_challenge_synonyms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='challenge',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='min_latitude',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='max_latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='min_longitude',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='max_longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='latitude',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='longitude',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_geo_columns, migrations.RunPython.noop),
+    ]
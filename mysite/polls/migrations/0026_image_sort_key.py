@@ -0,0 +1,33 @@
+import random
+
+from django.db import migrations, models
+
+import polls.models
+
+
+def shuffle_existing(apps, schema_editor):
+    """Give every existing photo its own random place in the feed."""
+    Image = apps.get_model('polls', 'Image')
+    for image_id in Image.objects.values_list('id', flat=True).iterator():
+        Image.objects.filter(id=image_id).update(
+            sort_key=random.randrange(polls.models.SORT_KEY_SPAN))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0025_storedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='sort_key',
+            field=models.IntegerField(default=polls.models.random_sort_key),
+        ),
+        migrations.RunPython(shuffle_existing, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['status', 'sort_key', 'id'], name='image_feed_order'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# The votes recorded in Image.user_votes are merged into the Vote table in a migration of
+# their own, so the new rows are committed before 0028_single_vote_store alters the table.
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+VOTE_POINTS = 10
+
+
+def merge_votes(apps, schema_editor):
+    """Keep one Vote row for each user and photo, add the votes that were only recorded in
+    user_votes, and set every score from the votes that are left."""
+    image_model = apps.get_model('polls', 'Image')
+    vote_model = apps.get_model('polls', 'Vote')
+    duplicates = vote_model.objects.values('user_id', 'image_id') \
+        .annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        vote_model.objects.filter(user_id=duplicate['user_id'], image_id=duplicate['image_id']) \
+            .exclude(id=duplicate['keep']).delete()
+
+    recorded = set(vote_model.objects.values_list('user_id', 'image_id'))
+    vote_model.objects.bulk_create(
+        vote_model(user_id=user_id, image_id=image_id)
+        for user_id, image_id in image_model.user_votes.through.objects
+        .values_list('user_id', 'image_id') if (user_id, image_id) not in recorded)
+
+    counts = dict(vote_model.objects.values_list('image_id').annotate(count=Count('id')))
+    for image in image_model.objects.only('id', 'score', 'card_version').iterator():
+        score = counts.get(image.id, 0) * VOTE_POINTS
+        if image.score != score:
+            image_model.objects.filter(id=image.id).update(
+                score=score, card_version=image.card_version + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0027_image_card_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0028_merge_votes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'image'),
+                                               name='one_vote_per_photo'),
+        ),
+        migrations.RemoveField(
+            model_name='vote',
+            name='already_voted',
+        ),
+        migrations.RemoveField(
+            model_name='image',
+            name='user_votes',
+        ),
+    ]
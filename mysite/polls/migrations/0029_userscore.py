@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def add_up_scores(apps, schema_editor):
+    """Start the totals from the photos that are already stored."""
+    image_model = apps.get_model('polls', 'Image')
+    user_score_model = apps.get_model('polls', 'UserScore')
+    totals = image_model.objects.order_by().values('user_id').annotate(total=Sum('score'))
+    user_score_model.objects.bulk_create(
+        user_score_model(user_id=row['user_id'], score=row['total']) for row in totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0028_single_vote_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserScore',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='total_score', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('score', models.IntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(add_up_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def add_up_scores(apps, schema_editor):
+    """Start the challenge totals from the photos that are already stored."""
+    image_model = apps.get_model('polls', 'Image')
+    challenge_score_model = apps.get_model('polls', 'ChallengeScore')
+    totals = image_model.objects.order_by().values('user_id', 'challenge_id') \
+        .annotate(total=Sum('score'))
+    challenge_score_model.objects.bulk_create(
+        challenge_score_model(user_id=row['user_id'], challenge_id=row['challenge_id'],
+                              score=row['total']) for row in totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0029_userscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='polls.challenge')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_scores', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='challengescore',
+            constraint=models.UniqueConstraint(fields=('user', 'challenge'),
+                                               name='one_score_per_challenge'),
+        ),
+        migrations.AddIndex(
+            model_name='challengescore',
+            index=models.Index(fields=['challenge', 'score', '-user'], name='challenge_ranking'),
+        ),
+        migrations.AddIndex(
+            model_name='userscore',
+            index=models.Index(fields=['score', '-user'], name='global_ranking'),
+        ),
+        migrations.RunPython(add_up_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+import polls.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0030_challengescore'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='img',
+            field=models.ImageField(storage=polls.models.get_photo_storage,
+                                    upload_to=polls.models.image_directory_path),
+        ),
+    ]
@@ -1,97 +1,186 @@
-"""Classify images and find faces in them"""
-from keras.applications.xception import Xception
-from keras.preprocessing import image
-from keras.applications.xception import preprocess_input, decode_predictions
-from pathlib import Path
+"""Classify images and find faces in them.
+Keras is only imported, and the Xception model only loaded, the first time a photo is
+classified, so management commands and tests that never classify do not pay for it."""
+import logging
+from functools import lru_cache
+from threading import Lock, local
 import numpy as np
 import cv2 as cv
-# load the model
-model = Xception(weights='imagenet', include_top=True)
-
-def ai_classify_image(img_path, subject):
-	"""classify a given image, and see if the classification matches a given subject.
-	classification is done via the Viola-Jones algorithm"""
-	subjects = []
-	subjects.append(subject)
-	img_path = './media/feed/' + img_path.name
-	# load the image as size 299,299 for the model to process
-	img = image.load_img(img_path, target_size=(299, 299))
-	#############################################
-	# convert to numpy array
-	x = image.img_to_array(img)
-	x = np.expand_dims(x, axis=0)
-	x = preprocess_input(x)
-	# predict the features of the image
-	features = model.predict(x)
-	# return the top 25 detected objects
-	label = decode_predictions(features, top=25)
-
-	# building is a very broad subject so additional subjects are added
-	if subject == 'building':
-		subjects.append('shop')
-		subjects.append('house')
-		subjects.append('stage')
-		subjects.append('library')
-		subjects.append('planetarium')
-		subjects.append('church')
-		subjects.append('restaurant')
-		subjects.append('wall')
-		subjects.append('tile')
-		subjects.append('bar')
-		subjects.append('dome')
-	elif subject == 'wildlife':
-		subjects.append('insect')
-		subjects.append('forest')
-		subjects.append('grass')
-		subjects.append('flower')
-		subjects.append('rose')
-		subjects.append('daffodil')
-		subjects.append('leaf')
-		subjects.append('tree')
-		subjects.append('sky')
-		subjects.append('sun')
-		subjects.append('pond')
-		subjects.append('water')
-		subjects.append('lake')
-		subjects.append('bird')
-		subjects.append('animal')
-		subjects.append('duck')
-		subjects.append('cat')
-		subjects.append('fox')
-		subjects.append('rabbit')
-
-	# see if the subject is one of the features that has been classified
-	for subject in subjects:
-		if subject in str(label):
-			print('val found')
-			print(label)
-			return True
-	print(label)
-	return False
-
-def ai_face_recognition(image_path):
-	"""ai to find and recognise how many faces are in an image"""
-	original_image = cv.imread(('./media/feed/'+image_path.name))
-	# Convert color image to grayscale for Viola-Jones
-	grayscale_image = cv.cvtColor(original_image, cv.COLOR_BGR2GRAY)
-	# Load the classifier and create a cascade object for face detection
-	face_cascade = cv.CascadeClassifier(cv.data.haarcascades+'haarcascade_frontalface_alt.xml')
-	# additional cascade object for bodies 
-	#body_cascade = cv.CascadeClassifier(cv.data.haarcascades+'haarcascade_fullbody.xml')
+from django.conf import settings
+from .image_decoding import as_decoded
+from .inference_server import get_client
+
+logger = logging.getLogger(__name__)
+
+# the model is shared by every thread in the process once it has been loaded
+_model = None
+_model_lock = Lock()
+_class_labels = None
+_cascades = local()
+
+# broad subjects also accept the photo if one of these related subjects is found
+SUBJECT_SYNONYMS = {
+	# labels are matched by whole word, so compound labels such as greenhouse are listed
+	'building': ['shop', 'house', 'stage', 'library', 'planetarium', 'church', 'restaurant',
+		'wall', 'tile', 'bar', 'dome', 'greenhouse', 'boathouse', 'barn', 'bookshop',
+		'barbershop', 'toyshop'],
+	'wildlife': ['insect', 'forest', 'grass', 'flower', 'rose', 'daffodil', 'leaf', 'tree',
+		'sky', 'sun', 'pond', 'water', 'lake', 'bird', 'animal', 'duck', 'cat', 'fox', 'rabbit'],
+}
+
+# labels that contain a subject as a whole word without showing that subject
+FALSE_MATCHES = {
+	'house': ['house_finch'],
+}
+
+def get_model():
+	"""load the Xception model on first use and return the shared copy afterwards"""
+	global _model
+	if _model is None:
+		with _model_lock:
+			if _model is None:
+				# pylint: disable=import-outside-toplevel
+				from keras.applications.xception import Xception
+				_model = Xception(weights=getattr(settings, 'XCEPTION_WEIGHTS', 'imagenet'),
+					include_top=True)
+	return _model
+
+def preload():
+	"""import keras and tensorflow without loading the model, used by the gunicorn master
+	so that forked workers share the imported modules instead of each importing them.
+	the model itself must not be built before forking, as tensorflow hangs in the child"""
+	# pylint: disable=import-outside-toplevel,unused-import
+	import keras.applications.xception
+
+def warm_up():
+	"""load the model and run one prediction so the first upload is not slowed down.
+	called by each worker after it boots, never in the gunicorn master: when the model is
+	preloaded the master only imports the libraries with preload() before forking"""
+	get_model().predict(np.zeros((1, 299, 299, 3), dtype=np.float32), verbose=0)
+	for subject in SUBJECT_SYNONYMS:
+		subject_class_indices(subject)
+
+def predict_images(images):
+	"""run the model on a batch of 299x299 RGB images, returning a row of predictions for each"""
+	# pylint: disable=import-outside-toplevel
+	from keras.applications.xception import preprocess_input
+	return get_model().predict(preprocess_input(images.astype(np.float32)), verbose=0)
+
+def predict_image(img_array):
+	"""predict one 299x299 RGB image, on the shared inference server if one is configured
+	so that it can be batched with other uploads, otherwise with this process's model"""
+	if getattr(settings, 'INFERENCE_SERVER_ADDRESS', None):
+		try:
+			return get_client().predict(img_array)
+		except (OSError, EOFError):
+			logger.warning("Inference server unavailable, classifying in this process",
+				exc_info=True)
+	return predict_images(np.expand_dims(img_array, axis=0))[0]
+
+def get_class_labels():
+	"""return the imagenet label of each of the model's 1000 classes, loaded once"""
+	global _class_labels
+	if _class_labels is None:
+		# pylint: disable=import-outside-toplevel
+		from keras.applications.xception import decode_predictions
+		# scoring every class by its own index makes keras list the label of every class
+		decoded = decode_predictions(np.arange(1000, dtype=np.float32)[np.newaxis], top=1000)[0]
+		_class_labels = [label for _, label, _ in sorted(decoded, key=lambda row: row[2])]
+	return _class_labels
+
+def classify_image(image_file, top=25):
+	"""classify a given image, returning its top predictions as (class index, label, score).
+	image_file can be a file or a DecodedImage shared with the face detector"""
+	# decode the image as size 299,299 for the model to process and predict its features
+	features = predict_image(as_decoded(image_file).for_classifier(299))
+	# return the top detected objects
+	labels = get_class_labels()
+	return [(int(index), labels[index], float(features[index]))
+		for index in np.argsort(features)[::-1][:top]]
+
+def ai_classify_image(image_file, subject, synonyms=''):
+	"""classify a given image, and see if the classification matches a given subject."""
+	return matches_subject(classify_image(image_file), subject, synonyms)
+
+def split_terms(terms):
+	"""split a comma separated list of subjects into lower case words, so that
+	'Sea lion, cat' becomes [('sea', 'lion'), ('cat',)]"""
+	return [tuple(term.lower().replace('_', ' ').split())
+		for term in terms.split(',') if term.strip()]
+
+def label_matches(label, term):
+	"""see if every word of a term appears in order in a label, so 'cat' matches
+	'tiger_cat' but not 'catamaran'"""
+	if label in FALSE_MATCHES.get(' '.join(term), ()):
+		return False
+	words = tuple(label.lower().split('_'))
+	return any(words[start:start + len(term)] == term for start in range(len(words)))
+
+@lru_cache(maxsize=None)
+def subject_class_indices(subject, synonyms=''):
+	"""compile a subject, its built in related subjects and any synonyms set on the
+	challenge into the set of imagenet class indices that count as the subject.
+	each combination is only compiled once per process"""
+	terms = split_terms(subject) + split_terms(synonyms)
+	terms += split_terms(', '.join(SUBJECT_SYNONYMS.get(subject, [])))
+	labels = get_class_labels()
+	return np.array([index for index, label in enumerate(labels)
+		if any(label_matches(label, term) for term in terms)], dtype=np.int64)
+
+def matches_subject(predictions, subject, synonyms=''):
+	"""see if a subject, or one of the subjects related to it, is in the predictions
+	returned by classify_image"""
+	top_indices = np.array([prediction[0] for prediction in predictions], dtype=np.int64)
+	return bool(np.isin(top_indices, subject_class_indices(subject, synonyms)).any())
+
+def get_face_cascade():
+	"""return the face cascade for this thread, loading it from its xml file only once.
+	each thread has its own as a cascade should not run two detections at the same time"""
+	cascade = getattr(_cascades, 'face', None)
+	if cascade is None:
+		cascade = cv.CascadeClassifier(cv.data.haarcascades+'haarcascade_frontalface_alt.xml')
+		_cascades.face = cascade
+	return cascade
+
+def detect_faces(grayscale_image, max_side=None, scale=1.0):
+	"""find faces in a grayscale image, first shrinking it so its longest side is at most
+	max_side (FACE_DETECTION_MAX_SIDE by default, 0 to use the full resolution).
+	scale is how much the image given has already been shrunk from the original photo.
+	the faces are returned as (x, y, w, h) in the coordinates of the original photo"""
+	if max_side is None:
+		max_side = get_face_max_side()
+	height, width = grayscale_image.shape[:2]
+	if max_side and max(height, width) > max_side:
+		shrink = max_side / max(height, width)
+		scale *= shrink
+		grayscale_image = cv.resize(grayscale_image,
+			(max(1, round(width * shrink)), max(1, round(height * shrink))),
+			interpolation=cv.INTER_AREA)
+	# faces smaller than 30 pixels in the original photo are still ignored
+	min_side = max(1, round(30 * scale))
 	# analyse the image in multiple scales to detect faces
-	detected_faces = face_cascade.detectMultiScale(
+	detected_faces = get_face_cascade().detectMultiScale(
 		grayscale_image,
 		scaleFactor=1.2,
 		minNeighbors=5,
-		minSize=(30,30))
+		minSize=(min_side, min_side))
+	return [tuple(round(value / scale) for value in face) for face in detected_faces]
+
+def get_face_max_side():
+	"""the longest side photos are shrunk to before looking for faces"""
+	return getattr(settings, 'FACE_DETECTION_MAX_SIDE', 1280)
 
-	# do the same for bodies- in case faces are covered
-	#detected_bodies = body_cascade.detectMultiScale(grayscale_image)
+def ai_face_recognition(image_file):
+	"""ai to find and recognise how many faces are in an image.
+	image_file can be a file or a DecodedImage shared with the classifier"""
+	# decode straight to a small grayscale image for Viola-Jones
+	grayscale_image, scale = as_decoded(image_file).grayscale(get_face_max_side())
+	detected_faces = detect_faces(grayscale_image, scale=scale)
 
 	# uncomment the line below to see what faces are detected while developing
-	# show_faces(original_image,detected_faces)
+	# show_faces(grayscale_image,detected_faces)
 
-	# return the number of detected faces/bodies by returning the highest value for leniency
+	# return the number of detected faces
 	return len(detected_faces)
 
 def show_faces(image,faces):
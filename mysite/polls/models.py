@@ -1,18 +1,50 @@
 """This is used for creating the schema to the database."""
+import random
 from datetime import datetime
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.contrib.auth.models import User
-from PIL import Image as PilImage
 from django.utils import timezone
 
+from .image_metadata import bounding_box, in_bounding_box, parse_coordinates, within_distance
+from .storage import ContentAddressedStorage
+from .renditions import (PROFILE_WIDTHS, RenditionsMixin, delete_renditions, generate_renditions,
+                         save_avatar)
+
 image_storage = FileSystemStorage(
     # Physical file location ROOT
     location=u'{0}/feed/'.format(settings.MEDIA_ROOT),
     # Url for file
     base_url=u'{0}feed/'.format(settings.MEDIA_URL),
 )
+# the same files as image_storage, with uploaded photos stored under the hash of their content
+photo_storage = ContentAddressedStorage(
+    location=image_storage.base_location,
+    base_url=image_storage.base_url,
+)
+# shown instead of a photo that has been removed
+REMOVED_IMAGE = 'picture/error.jpg'
+
+
+def get_photo_storage():
+    """The storage of Image.img, given to the field as a callable so that migrations refer
+    to this function instead of recording the media directory of the machine they were
+    made on."""
+    return photo_storage
+
+
+def release_photo(storage, name, renditions):
+    """Let go of one reference to a photo in storage once the transaction commits, and
+    remove its smaller copies along with the file when no other photo uses it."""
+    def release():
+        if not name:
+            return
+        storage.delete(name)
+        if not storage.exists(name) and (renditions or {}).get('source') == name:
+            # the copies are not counted, so they are removed from the plain storage
+            delete_renditions(FileSystemStorage(location=storage.location), renditions)
+    transaction.on_commit(release)
 
 
 def image_directory_path(instance, filename):
@@ -20,6 +52,14 @@ def image_directory_path(instance, filename):
     return u'picture/{0}'.format(filename)
 
 
+SORT_KEY_SPAN = 2 ** 31
+
+
+def random_sort_key():
+    """A random position for a photo in the feed, fixed when it is uploaded."""
+    return random.randrange(SORT_KEY_SPAN)
+
+
 class Challenge(models.Model):
     """A model used to store challenges"""
     name = models.CharField(max_length=200)
@@ -27,15 +67,55 @@ class Challenge(models.Model):
     location = models.CharField(max_length=200)
     locationRadius = models.FloatField()
     subject = models.CharField(max_length=200)
+    # extra comma separated subjects the AI also accepts for this challenge
+    synonyms = models.CharField(max_length=500, blank=True, default='')
     startDate = models.DateTimeField()
     endDate = models.DateTimeField()
     active = models.BooleanField(default=False, blank=True)
-
+    # parsed from location when the challenge is saved, with the box around the area
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    min_latitude = models.FloatField(null=True, blank=True, editable=False, db_index=True)
+    max_latitude = models.FloatField(null=True, blank=True, editable=False)
+    min_longitude = models.FloatField(null=True, blank=True, editable=False, db_index=True)
+    max_longitude = models.FloatField(null=True, blank=True, editable=False)
 
     def __str__(self):
         # how the model is displayed
         return f'{self.name}'
 
+    def save(self, *args, **kwargs):
+        """Parse the location once, so distance checks do not need to parse it."""
+        self.update_geometry()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'location', 'locationRadius'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'latitude', 'longitude', 'min_latitude',
+                                       'max_latitude', 'min_longitude', 'max_longitude'}
+        super().save(*args, **kwargs)
+
+    def update_geometry(self):
+        """Set the numeric location and bounding box from location and locationRadius."""
+        coordinates = parse_coordinates(self.location)
+        if coordinates is None:
+            self.latitude = self.longitude = None
+            self.min_latitude = self.max_latitude = None
+            self.min_longitude = self.max_longitude = None
+            return
+        self.latitude, self.longitude = coordinates
+        self.min_latitude, self.max_latitude, self.min_longitude, self.max_longitude = \
+            bounding_box(self.latitude, self.longitude, self.locationRadius)
+
+    def contains(self, latitude, longitude):
+        """See if a point is within the challenge's radius, checking the bounding box
+        before working out the distance."""
+        if self.latitude is None:
+            return False
+        box = (self.min_latitude, self.max_latitude, self.min_longitude, self.max_longitude)
+        if not in_bounding_box(box, latitude, longitude):
+            return False
+        return within_distance((self.latitude, self.longitude), (latitude, longitude),
+                               self.locationRadius)
+
 
 class Badge(models.Model):
     user = models.ForeignKey(
@@ -46,53 +126,187 @@ class Badge(models.Model):
     badge_image = models.ImageField(upload_to=image_directory_path, storage=image_storage)
 
 
-class Image(models.Model):
-    """A model used to store images and other related information."""
+class Image(RenditionsMixin, models.Model):
+    """A model used to store images and other related information.
+    New uploads are pending until the AI has checked them in the background."""
+    PENDING = 'pending'
+    ACCEPTED = 'accepted'
+    REJECTED = 'rejected'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (ACCEPTED, 'Accepted'),
+        (REJECTED, 'Rejected'),
+    ]
+
     challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name="challenges", default=1)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE, related_name="author")
     description = models.CharField(max_length=200)
-    img = models.ImageField(upload_to=image_directory_path, storage=image_storage)
+    img = models.ImageField(upload_to=image_directory_path, storage=get_photo_storage)
     gps_coordinates = models.CharField(max_length=200)
+    latitude = models.FloatField(null=True, blank=True, db_index=True)
+    longitude = models.FloatField(null=True, blank=True, db_index=True)
     taken_date = models.DateTimeField()
+    # the points from the photo's votes, changed by votes.cast_vote and votes.remove_vote
     score = models.IntegerField()
-    user_votes = models.ManyToManyField(User)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACCEPTED,
+                              db_index=True)
+    rejection_reason = models.CharField(max_length=200, blank=True, default='')
+    # the feed pages through photos in the order of this random key
+    sort_key = models.IntegerField(default=random_sort_key)
+    # the SHA-256 of the uploaded photo, worked out while it was received
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # smaller copies of img for the pages, made once the photo is accepted
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # the feed caches each photo's card under this, so it goes up whenever the card changes
+    card_version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         """The meta information for the Image class."""
         db_table = "polls_image"
+        indexes = [
+            models.Index(fields=['status', 'sort_key', 'id'], name='image_feed_order'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the location the photo was loaded with, so save() can see it change."""
+        image = super().from_db(db, field_names, values)
+        image._saved_gps_coordinates = image.__dict__.get('gps_coordinates')
+        return image
 
+    def save(self, *args, **kwargs):
+        """Fill in the numeric location from gps_coordinates when a photo is added without
+        one, and again whenever gps_coordinates is changed."""
+        if self._state.adding:
+            changed = self.latitude is None and bool(self.gps_coordinates)
+        else:
+            changed = 'gps_coordinates' in self.__dict__ and \
+                self.gps_coordinates != getattr(self, '_saved_gps_coordinates', None)
+        if changed:
+            self.latitude, self.longitude = parse_coordinates(self.gps_coordinates) or (None, None)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'gps_coordinates' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'latitude', 'longitude'}
+        super().save(*args, **kwargs)
+        self._saved_gps_coordinates = self.__dict__.get('gps_coordinates')
 
-class Profile(models.Model):
+    def remove_photo(self, description):
+        """Show the placeholder instead of the photo and release its stored file."""
+        name, renditions = self.img.name, self.renditions
+        self.img = REMOVED_IMAGE
+        self.renditions = {}
+        self.description = description
+        self.card_version += 1
+        self.save()
+        release_photo(self.img.storage, name, renditions)
+
+
+class Profile(RenditionsMixin, models.Model):
     """A model to store user profiles"""
     # delete profile if user is deleted
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     img = models.ImageField(default='default.jpg', upload_to=image_directory_path,
                             storage=image_storage)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         """Used to display the profile model"""
         return f'{self.user.username} Profile'
 
     def save(self, *args, **kwargs):
-        """Overwrite the profile image and resize it"""
-        super(Profile, self).save(*args, **kwargs)
-
-        img = PilImage.open(self.img.path)  # Open image
-
-        # resize image
-        if img.height > 300 or img.width > 300:
-            output_size = (300, 300)
-            img.thumbnail(output_size)  # Resize image
-            img.save(self.img.path)  # Save it again and override the larger image
+        """Shrink a newly uploaded picture and make its smaller copies. Nothing is opened
+        or written when the picture has not changed."""
+        if self.img and not self.img._committed:  # pylint: disable=protected-access
+            # a new upload, stored under the hash of its content instead of its file name
+            self.img = save_avatar(self.img, self.img.storage)
+        # the default picture is already small, so it is shown as it is
+        default = self._meta.get_field('img').default
+        if self.img.name != default and self.renditions.get('source') != self.img.name:
+            self.renditions = generate_renditions(self.img.storage, self.img.name,
+                                                  PROFILE_WIDTHS, overwrite=False)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'renditions'}
+        super().save(*args, **kwargs)
 
 
 class Vote(models.Model):
-    """A user's vote for a photo"""
+    """A user's vote for a photo, users have at most one vote for each photo"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="users")
     image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="images")
-    already_voted = models.BooleanField(default=False)
+
+    class Meta:
+        """The meta information for the Vote class."""
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'image'], name='one_vote_per_photo'),
+        ]
 
     def __str__(self):
         return f"{self.user} voted for {self.image}"
+
+
+class UserScore(models.Model):
+    """The total score of a user's photos, for the leaderboard. It is changed along with
+    the scores of the photos, and leaderboard.rebuild_user_scores sets it from them."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='total_score')
+    score = models.IntegerField(default=0, db_index=True)
+
+    class Meta:
+        """The meta information for the UserScore class."""
+        indexes = [
+            models.Index(fields=['score', '-user'], name='global_ranking'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} ({self.score})"
+
+
+class ChallengeScore(models.Model):
+    """The total score of a user's photos in one challenge, for the challenge's leaderboard."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge_scores')
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name='scores')
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        """The meta information for the ChallengeScore class."""
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'challenge'],
+                                    name='one_score_per_challenge'),
+        ]
+        indexes = [
+            models.Index(fields=['challenge', 'score', '-user'], name='challenge_ranking'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.challenge} ({self.score})"
+
+
+class StoredFile(models.Model):
+    """The number of references to a file in photo_storage."""
+    name = models.CharField(max_length=255, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+
+
+class AnalysisResult(models.Model):
+    """The AI results for a photo, keyed by a hash of its content and the version of the
+    models, so that a photo submitted again is not analysed again."""
+    content_hash = models.CharField(max_length=64)
+    model_version = models.CharField(max_length=100)
+    predictions = models.JSONField(null=True, blank=True)
+    face_count = models.IntegerField(null=True, blank=True)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        """The meta information for the AnalysisResult class."""
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'model_version'],
+                                    name='unique_analysis_result'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_hash} ({self.model_version})"
@@ -0,0 +1,97 @@
+"""Ranks on the leaderboards, read from the totals in UserScore and ChallengeScore.
+Users are listed by score, highest first, and then by user id, and users with the same
+score share a rank, so a user's rank is one more than the number of users with a higher
+score. That is counted with the (score, -user) index, so finding a rank, a page of the
+leaderboard or the users either side of someone never sorts the whole leaderboard."""
+from collections import namedtuple
+
+from django.conf import settings
+
+from .models import ChallengeScore, UserScore
+
+RankedScore = namedtuple('RankedScore', ['rank', 'user', 'score'])
+
+
+def leaderboard_scores(challenge=None):
+    """The totals on the overall leaderboard, or on a challenge's leaderboard."""
+    if challenge is None:
+        return UserScore.objects.all()
+    return ChallengeScore.objects.filter(challenge=challenge)
+
+
+def rank_of(scores, score):
+    """The rank of a total of score on a leaderboard."""
+    return scores.filter(score__gt=score).count() + 1
+
+
+def ranked(scores, entries, position, first_rank=None):
+    """Add ranks to entries, a run of totals in leaderboard order starting at position,
+    where position is the number of entries before them on the leaderboard. The rank of
+    the first entry is counted unless it is given."""
+    results = []
+    for number, entry in enumerate(entries):
+        if not results:
+            rank = first_rank or (position + 1 if position == 0 else rank_of(scores, entry.score))
+        elif entry.score < results[-1].score:
+            # everyone before this entry has a higher score
+            rank = position + number + 1
+        else:
+            rank = results[-1].rank
+        results.append(RankedScore(rank, entry.user, entry.score))
+    return results
+
+
+def top_page(scores, page=1, page_size=None):
+    """A page of a leaderboard, with users and profiles, and whether there is a next page."""
+    page_size = page_size or getattr(settings, 'LEADERBOARD_SIZE', 100)
+    position = (max(page, 1) - 1) * page_size
+    entries = list(scores.select_related('user__profile')
+                   .order_by('-score', 'user_id')[position:position + page_size + 1])
+    return ranked(scores, entries[:page_size], position), len(entries) > page_size
+
+
+def user_rank(scores, user):
+    """A user's place on a leaderboard, or None if they are not on it."""
+    entry = scores.filter(user=user).only('score').first()
+    if entry is None:
+        return None
+    return RankedScore(rank_of(scores, entry.score), user, entry.score)
+
+
+def around(scores, user, count=None):
+    """The user's place on a leaderboard with up to count users either side of them,
+    or an empty list if they are not on it."""
+    count = getattr(settings, 'LEADERBOARD_NEIGHBOURS', 2) if count is None else count
+    entry = scores.filter(user=user).select_related('user__profile').first()
+    if entry is None:
+        return []
+    scores_with_users = scores.select_related('user__profile')
+    # the users with the same score come first, each query reads one run of the index
+    tied_ahead = scores.filter(score=entry.score, user_id__lt=entry.user_id)
+    above = list(tied_ahead.select_related('user__profile').order_by('-user_id')[:count])
+    if len(above) < count:
+        above += scores_with_users.filter(score__gt=entry.score) \
+            .order_by('score', '-user_id')[:count - len(above)]
+    below = list(scores_with_users.filter(score=entry.score, user_id__gt=entry.user_id)
+                 .order_by('user_id')[:count])
+    if len(below) < count:
+        below += scores_with_users.filter(score__lt=entry.score) \
+            .order_by('-score', 'user_id')[:count - len(below)]
+    # only the user's own rank is counted from the top, the first rank shown is found by
+    # counting the few scores between the two
+    rank = rank_of(scores, entry.score)
+    first_rank = rank
+    if above and above[-1].score > entry.score:
+        first_rank -= scores.filter(score__gt=entry.score, score__lte=above[-1].score).count()
+    position = rank - 1 + tied_ahead.count() - len(above)
+    return ranked(scores, [*above[::-1], entry, *below], position, first_rank)
+
+
+def challenge_ranks(user):
+    """The user's place in each challenge they have entered, newest challenge first,
+    as (challenge, RankedScore) pairs."""
+    entries = ChallengeScore.objects.filter(user=user).select_related('challenge') \
+        .order_by('-challenge__startDate')
+    return [(entry.challenge, RankedScore(rank_of(leaderboard_scores(entry.challenge_id),
+                                                  entry.score), user, entry.score))
+            for entry in entries]
@@ -0,0 +1,133 @@
+"""This is used to make smaller copies of photos for the pages to show, so that a phone
+viewing the feed downloads a few hundred kilobytes instead of every original upload.
+Each size is saved as WebP and as a progressive JPEG for browsers without WebP."""
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image as PilImage, ImageOps
+
+# the widths shown in the feed and on profiles, and the small avatars next to photos
+IMAGE_WIDTHS = (320, 640, 1280)
+PROFILE_WIDTHS = (64, 150, 300)
+AVATAR_SIZE = 300
+AVATAR_DIRECTORY = 'picture/avatars'
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'progressive': True, 'optimize': True}),
+}
+
+
+def rendition_name(name, width, extension):
+    """Where the copy of name at width is stored, next to the original."""
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'renditions', f'{stem}_{width}.{extension}')
+
+
+def generate_renditions(storage, name, widths, overwrite=True):
+    """Save copies of the image called name in storage at each width that is not wider
+    than the image. Returns the renditions to store on the model, which are
+    {'source': name, 'webp': [[width, name], ...], 'jpeg': [[width, name], ...]}.
+    Without overwrite, copies that already exist are kept, which is only safe when the
+    name identifies the content of the image."""
+    with storage.open(name) as image_file:
+        image = PilImage.open(image_file)
+        image.draft('RGB', (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    # a photo narrower than the largest width also gets a copy at its own width,
+    # so big screens are not left with a much smaller copy than the original
+    sizes = [width for width in sorted(widths) if width < image.width]
+    if image.width <= max(widths):
+        sizes.append(image.width)
+    renditions = {'source': name}
+    for extension, (image_format, options) in FORMATS.items():
+        renditions[extension] = []
+        for width in sizes:
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else \
+                image.resize((width, height), PilImage.LANCZOS, reducing_gap=2.0)
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            target = rendition_name(name, width, extension)
+            if storage.exists(target):
+                if not overwrite:
+                    renditions[extension].append([width, target])
+                    continue
+                storage.delete(target)
+            saved = storage.save(target, ContentFile(buffer.getvalue()))
+            renditions[extension].append([width, saved])
+    return renditions
+
+
+def save_avatar(image_file, storage):
+    """Store an uploaded profile picture shrunk to fit AVATAR_SIZE and return its name.
+    The name is a hash of the upload, so a picture that has been stored before is
+    neither decoded nor written again."""
+    image_file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in image_file.chunks() if hasattr(image_file, 'chunks') else [image_file.read()]:
+        digest.update(chunk)
+    name = posixpath.join(AVATAR_DIRECTORY, f'{digest.hexdigest()[:32]}.jpg')
+    if storage.exists(name):
+        return name
+
+    image_file.seek(0)
+    image = PilImage.open(image_file)
+    image.draft('RGB', (AVATAR_SIZE, AVATAR_SIZE))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((AVATAR_SIZE, AVATAR_SIZE), PilImage.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=90, optimize=True)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def delete_renditions(storage, renditions):
+    """Remove the stored copies listed in renditions."""
+    for extension in FORMATS:
+        for _, name in renditions.get(extension, []):
+            storage.delete(name)
+
+
+class RenditionsMixin:
+    """Adds srcset and src properties to a model with an img field and a renditions field,
+    which fall back to the original if the copies are missing or out of date."""
+
+    def _current_renditions(self):
+        renditions = self.renditions or {}
+        if renditions.get('source') != self.img.name:
+            return {}
+        return renditions
+
+    def _srcset(self, extension):
+        storage = self.img.storage
+        return ', '.join(f'{storage.url(name)} {width}w'
+                         for width, name in self._current_renditions().get(extension, []))
+
+    @property
+    def webp_srcset(self):
+        """The WebP copies as a srcset attribute, or '' if there are none."""
+        return self._srcset('webp')
+
+    @property
+    def jpeg_srcset(self):
+        """The progressive JPEG copies as a srcset attribute, or '' if there are none."""
+        return self._srcset('jpeg')
+
+    @property
+    def thumbnail_url(self):
+        """The url of the smallest JPEG copy, or the original if there are no copies."""
+        jpegs = self._current_renditions().get('jpeg')
+        if jpegs:
+            return self.img.storage.url(jpegs[0][1])
+        return self.img.url
+
+    @property
+    def display_url(self):
+        """The url for browsers that ignore srcset, the largest JPEG copy or the original."""
+        jpegs = self._current_renditions().get('jpeg')
+        if jpegs:
+            return self.img.storage.url(jpegs[-1][1])
+        return self.img.url
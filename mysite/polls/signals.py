@@ -1,8 +1,13 @@
-"""This module signals to django that every new user needs a profile"""
-from django.db.models.signals import post_save #Import a post_save signal when a user is created
+"""This module signals to django that every new user needs a profile,
+that the challenge index must be rebuilt when a challenge changes,
+that the leaderboard totals change when photos are added or removed,
+that a removed photo's stored file is released,
+and that the scores of photos are recounted when their voters are deleted"""
+from django.db.models.signals import post_save, pre_delete, post_delete #Import the signals for saving models
 from django.contrib.auth.models import User # Import the built-in User model, which is a sender
 from django.dispatch import receiver # Import the receiver
-from .models import Profile
+from .models import Profile, Challenge, Image, Vote, release_photo
+from . import challenge_index, leaderboard, votes
 
 
 @receiver(post_save, sender=User)
@@ -13,7 +18,53 @@ def create_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-	"""When the profile is created, save it"""
+def save_profile(sender, instance, created, update_fields=None, **kwargs):
+	"""When the user is saved, save changes made to their profile through it.
+	A profile that has not been loaded has no changes, and logging in only saves last_login"""
+	if created or update_fields is not None or not User.profile.related.is_cached(instance):
+		return
 	instance.profile.save()
-	
\ No newline at end of file
+	
+
+@receiver(post_save, sender=Challenge)
+@receiver(post_delete, sender=Challenge)
+def challenge_changed(sender, instance, update_fields=None, **kwargs):
+	"""When a challenge is added, changed or removed, rebuild the index of challenge areas.
+	Turning a challenge on or off does not change its area, so the index is kept."""
+	if update_fields is None or set(update_fields) != {'active'}:
+		challenge_index.invalidate()
+
+
+@receiver(post_save, sender=Image)
+def image_added(sender, instance, created, **kwargs):
+	"""When a user's photo is added, make sure they are on the leaderboards"""
+	if created:
+		leaderboard.add_photo(instance)
+
+
+@receiver(post_delete, sender=Image)
+def image_removed(sender, instance, **kwargs):
+	"""When a photo is deleted, add up its owner's total again from the photos they have left.
+	The deleted photo's own score may be out of date, as votes do not change loaded photos"""
+	leaderboard.rebuild_user_scores([instance.user_id])
+
+
+@receiver(post_delete, sender=Image)
+def photo_file_released(sender, instance, **kwargs):
+	"""When a photo is deleted, release its stored file and the smaller copies made from it"""
+	release_photo(instance.img.storage, instance.img.name, instance.renditions)
+
+
+@receiver(pre_delete, sender=User)
+def voter_removing(sender, instance, **kwargs):
+	"""Before a user is deleted, note the photos they voted for, as their votes go with them"""
+	instance.voted_image_ids = list(Vote.objects.filter(user=instance)
+		.values_list('image_id', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def voter_removed(sender, instance, **kwargs):
+	"""When a user has been deleted, take their votes off the photos they voted for
+	and off the totals of the photos' owners"""
+	if getattr(instance, 'voted_image_ids', None):
+		votes.recount_scores(Image.objects.filter(id__in=instance.voted_image_ids))
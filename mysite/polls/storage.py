@@ -0,0 +1,82 @@
+"""A storage for uploaded photos that names each file after the SHA-256 of its content.
+Files are spread over two levels of subdirectories taken from the hash, so no directory
+grows past a few hundred entries, and an identical photo uploaded again is stored once.
+Every save of a file adds a reference to it and every delete removes one, the file itself
+is only removed with its last reference."""
+import hashlib
+import posixpath
+import re
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASHED_NAME_PATTERN = re.compile(r'(^|/)([0-9a-f]{2})/([0-9a-f]{2})/\2\3[0-9a-f]{60}(\.\w+)?$')
+
+
+def file_hash(content):
+    """Return the SHA-256 of a file, or the hash it was given while it was uploaded."""
+    digest = getattr(content, 'content_hash', None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE) if hasattr(content, 'chunks') \
+            else iter(lambda: content.read(HASH_CHUNK_SIZE), b''):
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+def hashed_name(directory, digest, extension):
+    """The name of a file with this hash, for example picture/ab/cd/abcd....jpg."""
+    return posixpath.join(directory, digest[:2], digest[2:4], digest + extension.lower())
+
+
+def is_hashed_name(name):
+    """See if a file is already stored under the hash of its content."""
+    return HASHED_NAME_PATTERN.search(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """A FileSystemStorage that saves every file under the hash of its content, inside the
+    directory the field's upload_to gives it, and counts the references to each file."""
+
+    def save(self, name, content, max_length=None):
+        """Store content unless a file with the same content is already stored, and return
+        the name of the stored file."""
+        directory, filename = posixpath.split(name)
+        name = hashed_name(directory, file_hash(content), posixpath.splitext(filename)[1])
+        stored_file = apps.get_model('polls', 'StoredFile')
+        with transaction.atomic():
+            reference, _ = stored_file.objects.select_for_update().get_or_create(name=name)
+            if not self.exists(name):
+                name = super().save(name, content, max_length)
+                if name != reference.name:
+                    # another process wrote the same name at the same moment
+                    reference.delete()
+                    reference, _ = stored_file.objects.get_or_create(name=name)
+            stored_file.objects.filter(pk=reference.pk).update(references=F('references') + 1)
+        return name
+
+    def delete(self, name):
+        """Remove one reference to a file, and the file once nothing refers to it.
+        Files without a count, such as the placeholder or photos stored before references
+        were counted, may be shared by any number of rows, so they are left alone."""
+        stored_file = apps.get_model('polls', 'StoredFile')
+        with transaction.atomic():
+            references = stored_file.objects.select_for_update().filter(name=name)
+            if references.filter(references__gt=1).update(references=F('references') - 1):
+                return
+            if references.delete()[0]:
+                super().delete(name)
+
+    def references(self, name):
+        """The number of saves of a file that have not been deleted."""
+        stored_file = apps.get_model('polls', 'StoredFile')
+        return stored_file.objects.filter(name=name).values_list('references', flat=True) \
+            .first() or 0
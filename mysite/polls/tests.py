@@ -1,15 +1,52 @@
 """Django tests to ensure that the app is working correctly are written and run here."""
+import hashlib
 import tempfile
 import datetime
+import threading
+from io import StringIO
+from unittest import mock
 
 from django.db.models.fields.files import ImageFieldFile
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib import admin
+from django.core.cache import caches
+from django.db.models import F
+from django.db import IntegrityError, connection, transaction
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.contrib.auth.models import User
 from django.test.client import Client
-from .models import Profile, Image, Challenge
-from . import validate, image_metadata
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from PIL import Image as PilImage
+import geopy.distance
+from .models import Profile, Image, Challenge, AnalysisResult, StoredFile, SORT_KEY_SPAN, Vote
+from .models import UserScore, ChallengeScore
+from . import validate, image_metadata, verification, ml_ai_image_classification, analysis_cache
+from . import challenge_index, feed, leaderboard, media, rankings, votes, views
+from .inference_server import MicroBatcher, parse_address
+from .image_decoding import DecodedImage
+from .renditions import generate_renditions, delete_renditions
+from .storage import ContentAddressedStorage, is_hashed_name
+from .admin import ImageAdmin
+from .vote_buffer import VoteBuffer
+
+def use_temporary_media(test):
+	"""Store the photos a test uploads in a temporary directory that is removed afterwards"""
+	tempdir = tempfile.TemporaryDirectory()
+	test.addCleanup(tempdir.cleanup)
+	storage = ContentAddressedStorage(location=tempdir.name, base_url='/media/')
+	plain_storage = FileSystemStorage(location=tempdir.name, base_url='/media/')
+	for patch in (mock.patch.object(Image._meta.get_field('img'), 'storage', storage),
+				mock.patch.object(verification, 'image_storage', plain_storage)):
+		patch.start()
+		test.addCleanup(patch.stop)
+	return storage
 
 class TestAdminPanel(TestCase):
 	"""test admin functionality"""
@@ -276,6 +313,70 @@ class TestChallenge(TestCase):
 		self.assertEqual(self.challenge_obj.location,(50.7366,-3.5350))
 		self.assertEqual(self.challenge_obj.subject,'building')
 
+	def test_inactive_challenge_is_not_saved(self):
+		"""a challenge that is already inactive is only read when checking which are active"""
+		self.assertFalse(self.challenge_obj.active)
+		with self.assertNumQueries(1):
+			views.check_challenge_active()
+
+	def test_challenge_geometry(self):
+		"""test that the location is parsed into numeric columns and a bounding box"""
+		self.assertEqual(self.challenge_obj.latitude, 50.7366)
+		self.assertEqual(self.challenge_obj.longitude, -3.535)
+		self.assertLess(self.challenge_obj.min_latitude, 50.7366)
+		self.assertGreater(self.challenge_obj.max_longitude, -3.535)
+		self.assertTrue(self.challenge_obj.contains(50.7366, -3.535))
+		# just inside and just outside the 1km radius
+		self.assertTrue(self.challenge_obj.contains(50.7366, -3.5230))
+		self.assertFalse(self.challenge_obj.contains(50.7366, -3.5190))
+		self.assertFalse(self.challenge_obj.contains(-50.7366, 3.535))
+		found = Challenge.objects.filter(min_latitude__lte=50.74, max_latitude__gte=50.74)
+		self.assertIn(self.challenge_obj, found)
+
+	def test_challenge_in_western_hemisphere(self):
+		"""test that a location given with compass letters is placed in the right hemisphere"""
+		self.challenge_obj.location = '50.7366 N, 3.535 W'
+		self.challenge_obj.save()
+		self.assertTrue(self.challenge_obj.contains(50.7366, -3.535))
+		self.assertFalse(self.challenge_obj.contains(50.7366, 3.535))
+
+	def test_challenge_geometry_saved_with_location(self):
+		"""test that saving only the location also saves the position and box from it"""
+		self.challenge_obj.location = '10, 20'
+		self.challenge_obj.save(update_fields=['location'])
+		stored = Challenge.objects.get(id=self.challenge_obj.id)
+		self.assertEqual((10, 20), (stored.latitude, stored.longitude))
+		self.assertTrue(stored.contains(10, 20))
+
+	def test_photo_location_follows_gps_coordinates(self):
+		"""test that a photo's numeric location is worked out again when its location changes"""
+		user = User.objects.create_user(username="test_location", password="Cheesytoenails@123")
+		image = Image.objects.create(user=user, challenge=self.challenge_obj, description='desc',
+									img='picture/feed.jpg', gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=0)
+		self.assertEqual((50.7366, -3.535), (image.latitude, image.longitude))
+		image = Image.objects.get(id=image.id)
+		image.gps_coordinates = '(10, 20)'
+		image.save(update_fields=['gps_coordinates'])
+		image = Image.objects.get(id=image.id)
+		self.assertEqual((10, 20), (image.latitude, image.longitude))
+		image.gps_coordinates = 'unknown'
+		image.save()
+		self.assertIsNone(Image.objects.get(id=image.id).latitude)
+
+	def test_challenge_geometry_updated(self):
+		"""test that changing the location or radius moves the bounding box"""
+		self.challenge_obj.location = '0, 179.999'
+		self.challenge_obj.locationRadius = 5
+		self.challenge_obj.save()
+		self.assertEqual(self.challenge_obj.latitude, 0)
+		# the box crosses the antimeridian
+		self.assertTrue(self.challenge_obj.contains(0, -179.99))
+		self.challenge_obj.location = 'somewhere'
+		self.challenge_obj.save()
+		self.assertIsNone(self.challenge_obj.min_latitude)
+		self.assertFalse(self.challenge_obj.contains(0, 179.999))
+
 class TestImageMetadata(TestCase):
 	"""test methods from image_metadata"""
 	def create_user(self):
@@ -331,6 +432,46 @@ class TestImageMetadata(TestCase):
 		# unexpected data should be ignored
 		assert image_metadata.get_lat("asfadfac",[1,0,2]) <0
 
+	def test_parse_coordinates(self):
+		"""test that stored locations are parsed into floats"""
+		self.assertEqual(image_metadata.parse_coordinates('(50.7366, -3.535)'), (50.7366, -3.535))
+		self.assertEqual(image_metadata.parse_coordinates('50.7366,-3.535'), (50.7366, -3.535))
+		self.assertEqual(image_metadata.parse_coordinates((50, 3)), (50.0, 3.0))
+		self.assertIsNone(image_metadata.parse_coordinates('Exeter'))
+		self.assertIsNone(image_metadata.parse_coordinates('(91, 0)'))
+
+	def test_parse_coordinates_with_hemispheres(self):
+		"""test that the compass letters and degrees, minutes and seconds are read"""
+		self.assertEqual(image_metadata.parse_coordinates('50.7366 N, 3.535 W'), (50.7366, -3.535))
+		self.assertEqual(image_metadata.parse_coordinates('33.9 S; 151.2 E'), (-33.9, 151.2))
+		latitude, longitude = image_metadata.parse_coordinates('50°44\'11.76"N 3°32\'6"W')
+		self.assertAlmostEqual(50.7366, latitude)
+		self.assertAlmostEqual(-3.535, longitude)
+		latitude, longitude = image_metadata.parse_coordinates("50 44m 11.76s N, 3 32m 6s W")
+		self.assertAlmostEqual(50.7366, latitude)
+		self.assertAlmostEqual(-3.535, longitude)
+		# text that cannot be read is not turned into whichever numbers it holds
+		self.assertIsNone(image_metadata.parse_coordinates('50 44 11.76 N, 3 32 6 W'))
+		self.assertIsNone(image_metadata.parse_coordinates('near 50, 3'))
+
+	def test_bounding_box(self):
+		"""test that the bounding box holds every point within the radius"""
+		box = image_metadata.bounding_box(50.7366, -3.535, 10)
+		for bearing in range(0, 360, 15):
+			point = geopy.distance.distance(kilometers=9.99).destination((50.7366, -3.535), bearing)
+			self.assertTrue(image_metadata.in_bounding_box(box, point.latitude, point.longitude))
+		self.assertFalse(image_metadata.in_bounding_box(box, 50.7366, -3.0))
+		self.assertEqual(image_metadata.bounding_box(89.99, 0, 10)[2:], (-180, 180))
+
+	def test_within_distance(self):
+		"""test that the quick distance check agrees with the exact distance"""
+		start = (50.7366, -3.535)
+		for bearing in range(0, 360, 30):
+			for km in (0.5, 0.995, 1.005, 2):
+				end = geopy.distance.distance(kilometers=km).destination(start, bearing)
+				self.assertEqual(km <= 1,
+								image_metadata.within_distance(start, (end.latitude, end.longitude), 1))
+
 	def test_get_distance(self):
 		"""test that distance between two points is correct"""
 
@@ -358,3 +499,1294 @@ class TestImageMetadata(TestCase):
 
     	#difference between equal dates should be 0 to prove that the sum is calculated correctly
 		self.assertEqual(0,ret_val)
+
+	def test_extract_metadata(self):
+		"""test that a single extraction serves gps, time and validation status"""
+		metadata = image_metadata.extract_metadata(self.good_image_path)
+		self.assertEqual("valid", metadata.status)
+		self.assertEqual(metadata.gps, image_metadata.get_gps(metadata))
+		self.assertEqual(metadata.datetime_original, image_metadata.get_time(metadata))
+		self.assertEqual(metadata.taken_date,
+						datetime.datetime.strptime(metadata.datetime_original, '%Y:%m:%d %H:%M:%S'))
+		self.assertEqual("valid", validate.validate_metadata(metadata))
+
+		# an open file gives the same result as a path
+		with open(self.good_image_path, 'rb') as image_file:
+			self.assertEqual(metadata.gps, image_metadata.extract_metadata(image_file).gps)
+
+		# image without metadata has no gps or time
+		metadata = image_metadata.extract_metadata(self.bad_image_path)
+		self.assertEqual("missing metadata", metadata.status)
+		self.assertIsNone(metadata.gps)
+		self.assertIsNone(metadata.taken_date)
+
+class TestUploadImage(TestCase):
+	"""test the upload view"""
+	def setUp(self):
+		"""create a logged in user and an active challenge"""
+		self.user = User.objects.create_user(username="test_uploader", password="Cheesytoenails@123")
+		self.client = Client()
+		self.client.login(username="test_uploader", password="Cheesytoenails@123")
+		self.challenge = Challenge.objects.create(name='test_challenge',
+												description='desc',
+												location='50.7366, -3.5350',
+												locationRadius=1,
+												subject='test',
+												startDate=timezone.now() - datetime.timedelta(days=1),
+												endDate=timezone.now() + datetime.timedelta(days=1))
+		self.bad_image_path = './media/feed/picture/university-of-exeter-forum.jpg'
+
+	def test_rejected_upload_is_not_saved(self):
+		"""a photo without metadata is rejected before a row or file is written"""
+		with open(self.bad_image_path, 'rb') as image_file:
+			upload = SimpleUploadedFile(name='rejected_upload.jpg', content=image_file.read(),
+										content_type='image/jpeg')
+		resp = self.client.post("/polls/uploadimage", {'challenge': self.challenge.id,
+														'description': 'desc',
+														'image': upload})
+		self.assertEqual(resp.status_code, 200)
+		self.assertContains(resp, 'Photo must contain information about when and where it was taken')
+		self.assertEqual(0, Image.objects.count())
+		self.assertFalse(Image.img.field.storage.exists('picture/rejected_upload.jpg'))
+
+class TestChallengeIndex(TestCase):
+	"""test finding challenges from where and when a photo was taken"""
+	def setUp(self):
+		"""create two overlapping challenges and one far away"""
+		self.start = timezone.make_aware(datetime.datetime(2022, 3, 1))
+		self.end = timezone.now() + datetime.timedelta(days=1)
+		self.forum = Challenge.objects.create(name='forum', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', startDate=self.start, endDate=self.end)
+		self.campus = Challenge.objects.create(name='campus', description='desc',
+											location='50.7370, -3.5340', locationRadius=5,
+											subject='test', startDate=self.start,
+											endDate=self.end + datetime.timedelta(days=1))
+		self.london = Challenge.objects.create(name='london', description='desc',
+											location='51.5072, -0.1276', locationRadius=10,
+											subject='test', startDate=self.start, endDate=self.end)
+		self.good_image_path = './media/feed/picture/Brennan_On_the_Side_of_the_Angels_2.jpg'
+
+	def test_find_challenges(self):
+		"""challenges are found by distance and time, the soonest to end first"""
+		taken = datetime.datetime(2022, 3, 12, 19, 36)
+		self.assertEqual([self.forum.id, self.campus.id],
+						challenge_index.find_challenge_ids(50.7369, -3.5364, taken))
+		self.assertEqual([self.campus.id],
+						challenge_index.find_challenge_ids(50.7500, -3.5364, taken))
+		self.assertEqual([self.london.id],
+						challenge_index.find_challenge_ids(51.5, -0.1, taken))
+		self.assertEqual([], challenge_index.find_challenge_ids(50.7369, -3.5364,
+																datetime.datetime(2022, 2, 1)))
+
+	def test_index_follows_changes(self):
+		"""moving or deleting a challenge rebuilds the index"""
+		taken = datetime.datetime(2022, 3, 12, 19, 36)
+		self.assertEqual([self.london.id], challenge_index.find_challenge_ids(51.5, -0.1, taken))
+		self.london.location = '53.4808, -2.2426'
+		self.london.save()
+		self.assertEqual([], challenge_index.find_challenge_ids(51.5, -0.1, taken))
+		self.london.delete()
+		self.assertEqual([], challenge_index.find_challenge_ids(53.48, -2.24, taken))
+
+	def test_large_challenges_and_antimeridian(self):
+		"""a challenge covering many cells or crossing the antimeridian is still found"""
+		now = timezone.now()
+		areas = [challenge_index.ChallengeArea(1, self.start, self.end, 0, 179.99, 5,
+											image_metadata.bounding_box(0, 179.99, 5)),
+				challenge_index.ChallengeArea(2, self.start, self.end, 10, 10, 500,
+											image_metadata.bounding_box(10, 10, 500))]
+		index = challenge_index.ChallengeIndex(areas, cell_size=0.1, max_cells=100)
+		self.assertEqual([2], [area.id for area in index.large])
+		self.assertEqual([1], index.find(0, -179.99, now, now))
+		self.assertEqual([2], index.find(12, 12, now, now))
+
+	@override_settings(VERIFICATION_ASYNC=False)
+	def test_upload_picks_challenge(self):
+		"""a photo uploaded without a challenge is given the one it fits"""
+		use_temporary_media(self)
+		client = Client()
+		User.objects.create_user(username="test_uploader", password="Cheesytoenails@123")
+		client.login(username="test_uploader", password="Cheesytoenails@123")
+		self.campus.delete()
+		with open(self.good_image_path, 'rb') as image_file:
+			upload = SimpleUploadedFile(name='matched_upload.jpg', content=image_file.read(),
+										content_type='image/jpeg')
+		resp = client.post("/polls/uploadimage", {'description': 'desc', 'image': upload})
+		image = Image.objects.get()
+		self.assertEqual(resp.status_code, 302)
+		self.assertEqual(self.forum, image.challenge)
+
+	def test_upload_with_several_matches(self):
+		"""a photo that fits more than one challenge asks the user to choose"""
+		client = Client()
+		User.objects.create_user(username="test_uploader", password="Cheesytoenails@123")
+		client.login(username="test_uploader", password="Cheesytoenails@123")
+		with open(self.good_image_path, 'rb') as image_file:
+			upload = SimpleUploadedFile(name='matched_upload.jpg', content=image_file.read(),
+										content_type='image/jpeg')
+		resp = client.post("/polls/uploadimage", {'description': 'desc', 'image': upload})
+		self.assertContains(resp, 'Your photo fits more than one challenge, please choose one')
+		self.assertEqual(0, Image.objects.count())
+		choices = list(resp.context['form'].fields['challenge'].queryset)
+		self.assertEqual({self.forum, self.campus}, set(choices))
+
+class TestRenditions(TestCase):
+	"""test the smaller copies of photos made for the pages"""
+	def setUp(self):
+		"""copy a photo into a temporary storage"""
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.storage = FileSystemStorage(location=self.tempdir.name, base_url='/media/')
+		with open('./media/feed/picture/Brennan_On_the_Side_of_the_Angels_2.jpg', 'rb') as image_file:
+			self.original = image_file.read()
+		self.name = self.storage.save('picture/photo.jpg', ContentFile(self.original))
+
+	def tearDown(self):
+		"""remove the temporary storage"""
+		self.tempdir.cleanup()
+
+	def test_generate_renditions(self):
+		"""each width is saved as WebP and progressive JPEG, smaller than the original"""
+		renditions = generate_renditions(self.storage, self.name, (320, 640, 100000))
+		self.assertEqual(self.name, renditions['source'])
+		# the photo is 960 wide, so it also gets a copy at its own width
+		self.assertEqual([320, 640, 960], [width for width, _ in renditions['webp']])
+		self.assertEqual([320, 640, 960], [width for width, _ in renditions['jpeg']])
+		for width, name in renditions['webp'] + renditions['jpeg']:
+			with self.storage.open(name) as image_file:
+				image = PilImage.open(image_file)
+				self.assertEqual(width, image.width)
+				self.assertIn(image.format, ('WEBP', 'JPEG'))
+				if image.format == 'JPEG':
+					self.assertTrue(image.info.get('progressive'))
+			self.assertLess(self.storage.size(name), len(self.original) / (4 if width == 320 else 1))
+		# making them again replaces the copies instead of adding more
+		self.assertEqual(renditions, generate_renditions(self.storage, self.name, (320, 640, 100000)))
+		delete_renditions(self.storage, renditions)
+		self.assertEqual([], self.storage.listdir('picture/renditions')[1])
+
+	def test_srcset(self):
+		"""the pages only use copies made from the current picture"""
+		user = User.objects.create_user(username="test_renditions", password="Cheesytoenails@123")
+		challenge = Challenge.objects.create(name='test_challenge', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', startDate=timezone.now(),
+											endDate=timezone.now())
+		image = Image(user=user, challenge=challenge, description='desc',
+					img='picture/photo.jpg', gps_coordinates='(50.7366, -3.535)',
+					taken_date=timezone.now(), score=0)
+		self.assertEqual('', image.webp_srcset)
+		self.assertEqual(image.img.url, image.display_url)
+		image.renditions = {'source': 'picture/photo.jpg',
+							'webp': [[320, 'picture/renditions/photo_320.webp']],
+							'jpeg': [[320, 'picture/renditions/photo_320.jpg'],
+									[640, 'picture/renditions/photo_640.jpg']]}
+		self.assertTrue(image.webp_srcset.endswith('picture/renditions/photo_320.webp 320w'))
+		self.assertIn('photo_320.jpg 320w, ', image.jpeg_srcset)
+		self.assertTrue(image.display_url.endswith('picture/renditions/photo_640.jpg'))
+		image.img = 'picture/error.jpg'
+		self.assertEqual('', image.jpeg_srcset)
+		self.assertEqual(image.img.url, image.display_url)
+
+	def test_identical_upload_keeps_copies(self):
+		"""copies made for an identical upload are reused rather than written again"""
+		renditions = generate_renditions(self.storage, self.name, (320,))
+		copy = renditions['jpeg'][0][1]
+		modified = self.storage.get_modified_time(copy)
+		image = Image(id=1, img=self.name)
+		with mock.patch.object(verification, 'image_storage', self.storage), \
+				mock.patch.object(self.storage, 'save', wraps=self.storage.save) as save:
+			self.assertEqual(copy, verification.make_renditions(image)['jpeg'][0][1])
+		self.assertNotIn(copy, [call.args[0] for call in save.call_args_list])
+		self.assertEqual(modified, self.storage.get_modified_time(copy))
+
+	def test_command_updates_cards(self):
+		"""the command makes the missing copies and bumps the version of the photo's card"""
+		user = User.objects.create_user(username="test_renditions", password="Cheesytoenails@123")
+		challenge = Challenge.objects.create(name='test_challenge', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', startDate=timezone.now(),
+											endDate=timezone.now())
+		image = Image.objects.create(user=user, challenge=challenge, description='desc',
+									img=self.name, gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=0)
+		with mock.patch('polls.management.commands.generate_renditions.image_storage', self.storage):
+			call_command('generate_renditions', stdout=StringIO())
+		image.refresh_from_db()
+		self.assertEqual(self.name, image.renditions['source'])
+		self.assertEqual(1, image.card_version)
+
+class TestProfilePicture(TestCase):
+	"""test that profile pictures are only processed when they change"""
+	def setUp(self):
+		"""create a user and a temporary storage for their pictures"""
+		self.user = User.objects.create_user(username="test_profile", password="Cheesytoenails@123")
+		self.tempdir = tempfile.TemporaryDirectory()
+		self.storage = FileSystemStorage(location=self.tempdir.name, base_url='/media/')
+		self.storage_patch = mock.patch.object(Profile._meta.get_field('img'), 'storage', self.storage)
+		self.storage_patch.start()
+		with open('./media/feed/picture/Brennan_On_the_Side_of_the_Angels_2.jpg', 'rb') as image_file:
+			self.picture = image_file.read()
+
+	def tearDown(self):
+		"""remove the temporary storage"""
+		self.storage_patch.stop()
+		self.tempdir.cleanup()
+
+	def test_login_does_not_save_profile(self):
+		"""logging in and saving the user leave the profile alone"""
+		client = Client()
+		with mock.patch.object(Profile, 'save') as save:
+			self.assertTrue(client.login(username="test_profile", password="Cheesytoenails@123"))
+			User.objects.get(id=self.user.id).save()
+		save.assert_not_called()
+
+	def test_picture_is_content_addressed(self):
+		"""the same picture uploaded twice is stored once, shrunk to fit 300 pixels"""
+		names = []
+		for upload_name in ('first.jpg', 'second.jpg'):
+			profile = Profile.objects.get(user=self.user)
+			profile.img = SimpleUploadedFile(upload_name, self.picture, content_type='image/jpeg')
+			profile.save()
+			names.append(profile.img.name)
+		self.assertEqual(names[0], names[1])
+		self.assertTrue(names[0].startswith('picture/avatars/'))
+		self.assertEqual(1, len(self.storage.listdir('picture/avatars')[1]))
+		with self.storage.open(names[0]) as image_file:
+			self.assertEqual(300, max(PilImage.open(image_file).size))
+		profile.refresh_from_db()
+		self.assertEqual(names[0], profile.renditions['source'])
+		self.assertTrue(profile.webp_srcset)
+
+		# saving again does not open the picture
+		with mock.patch('polls.renditions.PilImage.open') as pil_open:
+			profile.save()
+			self.user.profile.save()
+		pil_open.assert_not_called()
+
+class TestUploadHandler(TestCase):
+	"""test that uploads are limited and hashed while they are received"""
+	def setUp(self):
+		"""create a logged in user and a challenge the good photo fits"""
+		User.objects.create_user(username="test_uploader", password="Cheesytoenails@123")
+		self.client = Client()
+		self.client.login(username="test_uploader", password="Cheesytoenails@123")
+		self.challenge = Challenge.objects.create(name='test_challenge', description='desc',
+												location='50.7366, -3.5350', locationRadius=1,
+												subject='test',
+												startDate=timezone.make_aware(datetime.datetime(2022, 3, 1)),
+												endDate=timezone.now() + datetime.timedelta(days=1))
+		with open('./media/feed/picture/Brennan_On_the_Side_of_the_Angels_2.jpg', 'rb') as image_file:
+			self.photo = image_file.read()
+
+	def post_photo(self, content):
+		"""upload content as a photo for the challenge"""
+		upload = SimpleUploadedFile('handler_upload.jpg', content, content_type='image/jpeg')
+		return self.client.post("/polls/uploadimage", {'challenge': self.challenge.id,
+														'description': 'desc',
+														'image': upload})
+
+	def test_request_too_large(self):
+		"""a request that says it is too large is refused without being read"""
+		with mock.patch('polls.upload_handlers.MAX_IMAGE_SIZE', 10 * 1024), \
+				mock.patch('polls.upload_handlers.PhotoUploadHandler.receive_data_chunk') as receive:
+			resp = self.post_photo(self.photo)
+		receive.assert_not_called()
+		self.assertContains(resp, 'Photo must be less than 20mb')
+		self.assertEqual(0, Image.objects.count())
+
+	def test_file_too_large(self):
+		"""a photo that grows past the limit while it is received is stopped"""
+		with mock.patch('polls.upload_handlers.MAX_IMAGE_SIZE', 10 * 1024):
+			resp = self.post_photo(self.photo[:50 * 1024])
+		self.assertContains(resp, 'Photo must be less than 20mb')
+		self.assertEqual(0, Image.objects.count())
+
+	@override_settings(VERIFICATION_ASYNC=False)
+	def test_upload_is_hashed(self):
+		"""the hash worked out while receiving is stored and the metadata read from the head"""
+		storage = use_temporary_media(self)
+		with mock.patch('polls.views.extract_metadata', wraps=image_metadata.extract_metadata) as extract:
+			resp = self.post_photo(self.photo)
+		self.assertEqual(resp.status_code, 302)
+		self.assertEqual(len(extract.call_args[0][0].getvalue()), 128 * 1024)
+		image = Image.objects.get()
+		self.assertEqual(hashlib.sha256(self.photo).hexdigest(), image.content_hash)
+		self.assertTrue(storage.exists(image.img.name))
+		self.assertEqual((50.7369302, -3.536476717027954), (image.latitude, image.longitude))
+
+class TestContentAddressedStorage(TestCase):
+	"""test that photos are stored once under the hash of their content"""
+	def setUp(self):
+		"""use a temporary directory for the photos"""
+		self.storage = use_temporary_media(self)
+		self.content = b'not really a photo'
+		self.digest = hashlib.sha256(self.content).hexdigest()
+
+	def test_identical_files_are_stored_once(self):
+		"""saving the same content twice gives one sharded file with two references"""
+		first = self.storage.save('picture/one.JPG', ContentFile(self.content))
+		second = self.storage.save('picture/two.jpg', ContentFile(self.content))
+		self.assertEqual(first, second)
+		self.assertEqual(f'picture/{self.digest[:2]}/{self.digest[2:4]}/{self.digest}.jpg', first)
+		self.assertTrue(is_hashed_name(first))
+		self.assertFalse(is_hashed_name('picture/one.jpg'))
+		self.assertEqual(2, self.storage.references(first))
+
+		self.storage.delete(first)
+		self.assertTrue(self.storage.exists(first))
+		self.storage.delete(first)
+		self.assertFalse(self.storage.exists(first))
+		self.assertEqual(0, StoredFile.objects.count())
+
+	def test_only_owner_or_staff_removes_photo(self):
+		"""a photo can only be removed by the user who took it or a member of staff"""
+		owner = User.objects.create_user(username="test_owner", password="Cheesytoenails@123")
+		User.objects.create_user(username="test_other", password="Cheesytoenails@123")
+		User.objects.create_user(username="test_staff", password="Cheesytoenails@123",
+								is_staff=True)
+		challenge = Challenge.objects.create(name='test_challenge', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', startDate=timezone.now(),
+											endDate=timezone.now())
+		image = Image.objects.create(user=owner, challenge=challenge, description='desc',
+									img=self.storage.save('picture/one.jpg', ContentFile(self.content)),
+									gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=0)
+		url = reverse('deletephoto', args=[image.id])
+		self.assertRedirects(Client().get(url), reverse('home'), fetch_redirect_response=False)
+		client = Client()
+		client.login(username="test_other", password="Cheesytoenails@123")
+		self.assertEqual(403, client.get(url).status_code)
+		self.assertEqual(404, client.get(reverse('deletephoto', args=[image.id + 100])).status_code)
+		self.assertEqual('desc', Image.objects.get(id=image.id).description)
+		client.login(username="test_staff", password="Cheesytoenails@123")
+		client.get(url)
+		self.assertEqual("User deleted the photo", Image.objects.get(id=image.id).description)
+
+	def test_uncounted_files_are_kept(self):
+		"""files stored before references were counted are not removed, as rows may share them"""
+		plain_storage = FileSystemStorage(location=self.storage.location)
+		name = plain_storage.save('picture/old.jpg', ContentFile(self.content))
+		self.storage.delete(name)
+		self.assertTrue(self.storage.exists(name))
+
+	def test_hash_from_upload_is_used(self):
+		"""a hash worked out while the photo was uploaded is not worked out again"""
+		content = ContentFile(self.content)
+		content.content_hash = '0' * 64
+		self.assertEqual('picture/00/00/' + '0' * 64 + '.jpg',
+						self.storage.save('picture/one.jpg', content))
+
+	def test_removed_photos_are_released(self):
+		"""removing or deleting a photo releases its file, and the copies once it is unused"""
+		user = User.objects.create_user(username="test_release", password="Cheesytoenails@123")
+		challenge = Challenge.objects.create(name='test_challenge', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', startDate=timezone.now(),
+											endDate=timezone.now())
+		name = self.storage.save('picture/one.jpg', ContentFile(self.content))
+		self.storage.save('picture/two.jpg', ContentFile(self.content))
+		plain_storage = FileSystemStorage(location=self.storage.location)
+		copy = plain_storage.save('picture/renditions/copy_320.jpeg', ContentFile(self.content))
+		renditions = {'source': name, 'webp': [], 'jpeg': [[320, copy]]}
+		first, second = [Image.objects.create(user=user, challenge=challenge, description='desc',
+											img=name, gps_coordinates='(50.7366, -3.535)',
+											taken_date=timezone.now(), score=0,
+											renditions=renditions) for _ in range(2)]
+
+		client = Client()
+		client.login(username="test_release", password="Cheesytoenails@123")
+		with self.captureOnCommitCallbacks(execute=True):
+			client.get(reverse('deletephoto', args=[first.id]))
+		self.assertEqual(1, self.storage.references(name))
+		self.assertTrue(self.storage.exists(name))
+		self.assertTrue(plain_storage.exists(copy))
+
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		self.assertEqual(0, StoredFile.objects.count())
+		self.assertFalse(self.storage.exists(name))
+		self.assertFalse(plain_storage.exists(copy))
+
+	def test_migrate_existing_files(self):
+		"""photos stored under their upload names are moved and duplicates merged"""
+		plain_storage = FileSystemStorage(location=self.storage.location)
+		user = User.objects.create_user(username="test_storage", password="Cheesytoenails@123")
+		challenge = Challenge.objects.create(name='test_challenge', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', startDate=timezone.now(),
+											endDate=timezone.now())
+		for name in ('picture/one.jpg', 'picture/two.jpg'):
+			plain_storage.save(name, ContentFile(self.content))
+			Image.objects.create(user=user, challenge=challenge, description='desc', img=name,
+								gps_coordinates='(50.7366, -3.535)', taken_date=timezone.now(),
+								score=0, renditions={'source': name})
+		with mock.patch('polls.management.commands.migrate_media_storage.image_storage', plain_storage), \
+				mock.patch('polls.management.commands.migrate_media_storage.photo_storage', self.storage):
+			call_command('migrate_media_storage', stdout=StringIO())
+		target = f'picture/{self.digest[:2]}/{self.digest[2:4]}/{self.digest}.jpg'
+		for image in Image.objects.all():
+			self.assertEqual(target, image.img.name)
+			self.assertEqual(target, image.renditions['source'])
+			self.assertEqual(self.digest, image.content_hash)
+		self.assertEqual(2, self.storage.references(target))
+		self.assertFalse(plain_storage.exists('picture/one.jpg'))
+		self.assertFalse(plain_storage.exists('picture/two.jpg'))
+
+class TestMediaServing(TestCase):
+	"""test that media files are sent with caching and range support"""
+	def setUp(self):
+		"""create a logged in user"""
+		User.objects.create_user(username="test_media", password="Cheesytoenails@123")
+		self.client = Client()
+		self.client.login(username="test_media", password="Cheesytoenails@123")
+		with open('./media/feed/default.jpg', 'rb') as image_file:
+			self.content = image_file.read()
+
+	def test_login_needed_for_photos(self):
+		"""photos need a login but the icons used by the login page do not"""
+		self.assertEqual(403, Client().get('/polls/media/feed/default.jpg').status_code)
+		self.assertEqual(200, Client().get('/polls/media/favicon.png').status_code)
+		self.assertEqual(404, self.client.get('/polls/media/feed/missing.jpg').status_code)
+		self.assertEqual(404, self.client.get('/media/..%2Fmanage.py').status_code)
+
+	def test_full_and_conditional_requests(self):
+		"""the whole file is sent with an ETag, and not sent again when it is unchanged"""
+		resp = self.client.get('/polls/media/feed/default.jpg')
+		self.assertEqual(200, resp.status_code)
+		self.assertEqual(self.content, b''.join(resp.streaming_content))
+		self.assertEqual('image/jpeg', resp['Content-Type'])
+		self.assertEqual(str(len(self.content)), resp['Content-Length'])
+		self.assertEqual('private, max-age=3600', resp['Cache-Control'])
+		resp = self.client.get('/media/feed/default.jpg', HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(304, resp.status_code)
+
+	def test_range_requests(self):
+		"""single byte ranges are answered with just those bytes"""
+		resp = self.client.get('/polls/media/feed/default.jpg', HTTP_RANGE='bytes=10-19')
+		self.assertEqual(206, resp.status_code)
+		self.assertEqual(self.content[10:20], b''.join(resp.streaming_content))
+		self.assertEqual(f'bytes 10-19/{len(self.content)}', resp['Content-Range'])
+		resp = self.client.get('/polls/media/feed/default.jpg', HTTP_RANGE='bytes=-5')
+		self.assertEqual(self.content[-5:], b''.join(resp.streaming_content))
+		resp = self.client.get('/polls/media/feed/default.jpg', HTTP_RANGE='bytes=100000-')
+		self.assertEqual(416, resp.status_code)
+		resp = self.client.get('/polls/media/feed/default.jpg', HTTP_RANGE='bytes=0-1',
+							HTTP_IF_RANGE='"stale"')
+		self.assertEqual(200, resp.status_code)
+
+	def test_front_server_offload(self):
+		"""with a front server configured Django only sends the headers"""
+		with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+			resp = self.client.get('/polls/media/feed/picture/ab/cd/' + 'abcd' + 'e' * 60 + '.jpg')
+			self.assertEqual(404, resp.status_code)
+			resp = self.client.get('/polls/media/feed/default.jpg')
+		self.assertEqual('/protected-media/feed/default.jpg', resp['X-Accel-Redirect'])
+		self.assertEqual(b'', resp.content)
+		with override_settings(MEDIA_SENDFILE='x-sendfile'):
+			resp = self.client.get('/polls/media/feed/default.jpg')
+		self.assertTrue(resp['X-Sendfile'].endswith('media/feed/default.jpg'))
+
+	def test_content_addressed_files_are_immutable(self):
+		"""photos named by their content can be cached for good"""
+		self.assertEqual('private, max-age=31536000, immutable',
+						media.cache_control(None, 'feed/picture/ab/cd/abcd' + 'e' * 60 + '.jpg'))
+
+class TestFeed(TestCase):
+	"""test the seeded, paged photo feed"""
+	def setUp(self):
+		"""create photos in a running challenge and one that has ended"""
+		caches['feed_cards'].clear()
+		self.user = User.objects.create_user(username="test_feed", password="Cheesytoenails@123")
+		self.challenge = Challenge.objects.create(name='running', description='desc',
+												location='50.7366, -3.5350', locationRadius=1,
+												subject='test', active=True,
+												startDate=timezone.now(), endDate=timezone.now())
+		ended = Challenge.objects.create(name='ended', description='desc',
+										location='50.7366, -3.5350', locationRadius=1,
+										subject='test', active=False,
+										startDate=timezone.now(), endDate=timezone.now())
+		for challenge, status, count in ((self.challenge, Image.ACCEPTED, 23),
+										(self.challenge, Image.PENDING, 2), (ended, Image.ACCEPTED, 2)):
+			for _ in range(count):
+				Image.objects.create(user=self.user, challenge=challenge, description='desc',
+									img='picture/feed.jpg', gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=0, status=status)
+		self.shown = set(Image.objects.filter(challenge=self.challenge, status=Image.ACCEPTED)
+						.values_list('id', flat=True))
+
+	def read_feed(self, seed, page_size=5):
+		"""read every page of the feed for a seed"""
+		order, cursor, pages = [], None, 0
+		while True:
+			images, cursor = feed.feed_page(seed, cursor, page_size)
+			order += [image.id for image in images]
+			pages += 1
+			if cursor is None:
+				return order, pages
+
+	def test_every_photo_shown_once(self):
+		"""the pages hold each accepted photo of a running challenge exactly once"""
+		for seed in (0, 12345, SORT_KEY_SPAN - 1):
+			order, pages = self.read_feed(seed)
+			self.assertEqual(len(self.shown), len(order))
+			self.assertEqual(self.shown, set(order))
+			self.assertEqual(5, pages)
+
+	def test_order_is_stable_for_a_seed(self):
+		"""a seed always gives the same order, which starts at the seed"""
+		Image.objects.filter(id__in=self.shown).update(sort_key=0)
+		for position, image_id in enumerate(sorted(self.shown)):
+			Image.objects.filter(id=image_id).update(sort_key=position * 100)
+		order, _ = self.read_feed(1050)
+		self.assertEqual(order, self.read_feed(1050)[0])
+		self.assertEqual(sorted(self.shown)[11:] + sorted(self.shown)[:11], order)
+
+	def test_page_cost_does_not_grow(self):
+		"""a page is read with a fixed number of queries"""
+		images, cursor = feed.feed_page(0, None, 5)
+		with self.assertNumQueries(2):
+			images, cursor = feed.feed_page(0, cursor, 5)
+			self.assertEqual(5, len(images))
+
+	def test_bad_cursor_starts_again(self):
+		"""a cursor that cannot be read gives the first page"""
+		self.assertEqual(feed.feed_page(7, None, 5)[0], feed.feed_page(7, 'not a cursor', 5)[0])
+		self.assertEqual(feed.feed_page(7, None, 5)[0], feed.feed_page(7, 'OS4xLjE', 5)[0])
+
+	def test_feed_view_uses_session_seed(self):
+		"""the feed view keeps the same order for a session and links to the next page"""
+		client = Client()
+		client.login(username="test_feed", password="Cheesytoenails@123")
+		resp = client.get('/polls/feed')
+		self.assertEqual(10, len(resp.context['images']))
+		self.assertIn(feed.SEED_SESSION_KEY, client.session)
+		again = client.get('/polls/feed')
+		self.assertEqual(list(resp.context['images']), list(again.context['images']))
+		resp = client.get('/polls/feed?cursor=' + resp.context['next_cursor'])
+		self.assertContains(resp, 'More photos')
+
+	def test_json_feed(self):
+		"""the JSON feed pages through the same photos as the feed page, with a card for each"""
+		client = Client()
+		self.assertEqual(403, client.get('/polls/feed.json').status_code)
+		client.login(username="test_feed", password="Cheesytoenails@123")
+		other = User.objects.create_user(username="feed_other", password="Cheesytoenails@123")
+		others = sorted(self.shown)[:3]
+		Image.objects.filter(id__in=others).update(user=other)
+		# the viewer votes for one of the photos they did not take
+		voted = Image.objects.get(id=others[0])
+		Vote.objects.create(user=self.user, image=voted)
+
+		cards, cursor = [], None
+		while True:
+			data = client.get('/polls/feed.json', {'cursor': cursor or '', 'limit': 4}).json()
+			self.assertLessEqual(len(data['cards']), 4)
+			cards += data['cards']
+			cursor = data['next_cursor']
+			if cursor is None:
+				break
+		self.assertEqual(self.shown, {card['id'] for card in cards})
+		self.assertEqual(len(self.shown), len(cards))
+		# the page and the JSON feed start in the same place for a session
+		self.assertEqual([image.id for image in client.get('/polls/feed').context['images']],
+						[card['id'] for card in cards[:10]])
+
+		by_id = {card['id']: card for card in cards}
+		self.assertTrue(by_id[voted.id]['voted'])
+		self.assertEqual(reverse('unvote', args=[voted.id]), by_id[voted.id]['vote_url'])
+		for image in Image.objects.filter(id__in=self.shown).exclude(id=voted.id):
+			card = by_id[image.id]
+			self.assertFalse(card['voted'])
+			# photographers cannot vote for their own photos
+			expected = reverse('vote', args=[image.id]) if image.user == other else None
+			self.assertEqual(expected, card['vote_url'])
+			self.assertEqual('running', card['challenge'])
+			self.assertEqual(image.user.username, card['author'])
+			self.assertEqual(image.img.url, card['thumbnail'])
+
+	def feed_queries(self, photographers):
+		"""the number of queries to show a feed page of photos by some more users,
+		half of which the viewer has voted for, with a card for every photo"""
+		for number in range(photographers):
+			user = User.objects.create_user(username=f"feed_{number}", password="Cheesytoenails@123")
+			image = Image.objects.create(user=user, challenge=self.challenge, description='desc',
+										img='picture/feed.jpg', gps_coordinates='(50.7366, -3.535)',
+										taken_date=timezone.now(), score=10, status=Image.ACCEPTED)
+			if number % 2:
+				Vote.objects.create(user=self.user, image=image)
+		client = Client()
+		client.login(username="test_feed", password="Cheesytoenails@123")
+		session = client.session
+		# every photo comes after the seed, so each page is read in the same way
+		session[feed.SEED_SESSION_KEY] = 0
+		session.save()
+		Image.objects.update(sort_key=1)
+		with override_settings(FEED_PAGE_SIZE=photographers), \
+				CaptureQueriesContext(connection) as queries:
+			resp = client.get('/polls/feed')
+		self.assertEqual(photographers, len(resp.context['images']))
+		return len(queries), resp
+
+	def test_feed_queries_do_not_grow_with_cards(self):
+		"""the feed is shown with the same number of queries however many photographers
+		and votes are on the page"""
+		Image.objects.all().delete()
+		few, _ = self.feed_queries(3)
+		Image.objects.all().delete()
+		User.objects.filter(username__startswith='feed_').delete()
+		many, resp = self.feed_queries(10)
+		self.assertEqual(few, many)
+		shown = resp.context['images']
+		self.assertEqual({image.id for image in shown if votes.has_voted(self.user, image.id)},
+						resp.context['voted_ids'])
+		self.assertContains(resp, 'Remove vote</button>', count=len(resp.context['voted_ids']))
+
+class TestFeedCardCache(TestCase):
+	"""test the cache of rendered feed cards"""
+	def setUp(self):
+		"""create a photo by one user for another to vote on"""
+		caches['feed_cards'].clear()
+		self.owner = User.objects.create_user(username="card_owner", password="Cheesytoenails@123")
+		self.voter = User.objects.create_user(username="card_voter", password="Cheesytoenails@123")
+		challenge = Challenge.objects.create(name='running', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', active=True,
+											startDate=timezone.now(), endDate=timezone.now())
+		self.image = Image.objects.create(user=self.owner, challenge=challenge,
+										description='first description', img='picture/feed.jpg',
+										gps_coordinates='(50.7366, -3.535)',
+										taken_date=timezone.now(), score=0,
+										status=Image.ACCEPTED)
+
+	def feed(self, username):
+		"""the feed page as a user sees it"""
+		client = Client()
+		client.login(username=username, password="Cheesytoenails@123")
+		return client, client.get('/polls/feed')
+
+	def test_card_is_cached_until_it_changes(self):
+		"""a card is rendered once, and again after a change that bumps its version"""
+		self.feed("card_voter")
+		Image.objects.filter(id=self.image.id).update(description='changed without a bump')
+		_, resp = self.feed("card_voter")
+		self.assertContains(resp, 'first description')
+
+		Image.objects.filter(id=self.image.id).update(card_version=F('card_version') + 1)
+		_, resp = self.feed("card_voter")
+		self.assertContains(resp, 'changed without a bump')
+
+	def test_votes_update_card(self):
+		"""voting and unvoting show the new score, and each user sees their own button"""
+		client, resp = self.feed("card_voter")
+		self.assertContains(resp, f'data-score-for="{self.image.id}">0<')
+		client.post(reverse('vote', args=[self.image.id]))
+		resp = client.get('/polls/feed')
+		self.assertContains(resp, f'data-score-for="{self.image.id}">10<')
+		self.assertContains(resp, 'Remove vote</button>')
+		# the owner gets the same cached card without a vote button
+		_, resp = self.feed("card_owner")
+		self.assertContains(resp, f'data-score-for="{self.image.id}">10<')
+		self.assertNotContains(resp, 'vote</button>')
+		client.post(reverse('unvote', args=[self.image.id]))
+		resp = client.get('/polls/feed')
+		self.assertContains(resp, f'data-score-for="{self.image.id}">0<')
+		self.assertContains(resp, '>Vote</button>')
+
+	def test_admin_delete_updates_card(self):
+		"""a photo removed by a moderator is shown as removed straight away"""
+		self.feed("card_voter")
+		ImageAdmin(Image, admin.site).delete_model(None, Image.objects.get(id=self.image.id))
+		_, resp = self.feed("card_voter")
+		self.assertNotContains(resp, 'first description')
+		self.assertContains(resp, 'This image has been deleted by an administrator.')
+
+
+class TestVotes(TestCase):
+	"""test voting for photos"""
+	def setUp(self):
+		"""create a photo and a user to vote for it"""
+		caches['feed_cards'].clear()
+		self.owner = User.objects.create_user(username="vote_owner", password="Cheesytoenails@123")
+		self.voter = User.objects.create_user(username="vote_voter", password="Cheesytoenails@123")
+		challenge = Challenge.objects.create(name='running', description='desc',
+											location='50.7366, -3.5350', locationRadius=1,
+											subject='test', active=True,
+											startDate=timezone.now(), endDate=timezone.now())
+		self.image = Image.objects.create(user=self.owner, challenge=challenge, description='desc',
+										img='picture/feed.jpg', gps_coordinates='(50.7366, -3.535)',
+										taken_date=timezone.now(), score=0, status=Image.ACCEPTED)
+
+	def score(self):
+		"""the photo's score as stored"""
+		return Image.objects.get(id=self.image.id).score
+
+	def test_one_vote_per_photo(self):
+		"""a second vote by the same user is not counted, and cannot be stored"""
+		self.assertTrue(votes.cast_vote(self.voter, self.image.id))
+		self.assertFalse(votes.cast_vote(self.voter, self.image.id))
+		self.assertEqual(votes.VOTE_POINTS, self.score())
+		self.assertEqual(1, Vote.objects.count())
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Vote.objects.create(user=self.voter, image=self.image)
+
+	def test_unvote(self):
+		"""taking back a vote removes its points once"""
+		votes.cast_vote(self.voter, self.image.id)
+		self.assertTrue(votes.remove_vote(self.voter, self.image.id))
+		self.assertFalse(votes.remove_vote(self.voter, self.image.id))
+		self.assertEqual(0, self.score())
+		self.assertFalse(votes.has_voted(self.voter, self.image.id))
+
+	def test_deleted_voter(self):
+		"""deleting a voter's account takes their votes off the scores"""
+		votes.cast_vote(self.voter, self.image.id)
+		self.assertEqual(votes.VOTE_POINTS, UserScore.objects.get(user=self.owner).score)
+		Client().get(reverse('deleteuser', args=[self.voter.username]))
+		self.assertFalse(User.objects.filter(id=self.voter.id).exists())
+		self.assertEqual(0, self.score())
+		self.assertEqual(0, UserScore.objects.get(user=self.owner).score)
+
+	def test_cannot_vote_for_own_or_missing_photo(self):
+		"""photographers cannot vote for their own photos, or for photos that do not exist"""
+		with self.assertRaises(Image.DoesNotExist):
+			votes.cast_vote(self.owner, self.image.id)
+		with self.assertRaises(Image.DoesNotExist):
+			votes.cast_vote(self.voter, self.image.id + 100)
+		self.assertEqual(0, Vote.objects.count())
+		self.assertEqual(0, self.score())
+
+	def test_vote_only_changes_counters(self):
+		"""a vote does not write back a copy of the photo it loaded, so changes made
+		elsewhere at the same time are kept"""
+		with CaptureQueriesContext(connection) as queries:
+			votes.cast_vote(self.voter, self.image.id)
+		updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+		# the photo's score and its owner's totals on the leaderboards
+		self.assertEqual(3, len(updates))
+		self.assertTrue(updates[0].startswith('UPDATE "polls_image"'))
+		self.assertNotIn('"description"', updates[0])
+		self.assertFalse(any(query['sql'].startswith('SELECT') for query in queries))
+
+	def test_vote_views(self):
+		"""the vote and unvote pages change the vote and go back to the feed"""
+		client = Client()
+		client.login(username="vote_voter", password="Cheesytoenails@123")
+		resp = client.post(reverse('vote', args=[self.image.id]))
+		self.assertRedirects(resp, reverse('feed'), fetch_redirect_response=False)
+		client.post(reverse('vote', args=[self.image.id]))
+		self.assertEqual(votes.VOTE_POINTS, self.score())
+		client.post(reverse('unvote', args=[self.image.id]))
+		self.assertEqual(0, self.score())
+		self.assertEqual(404, client.post(reverse('vote', args=[self.image.id + 100])).status_code)
+
+	def test_write_behind(self):
+		"""with the buffer, votes are stored straight away, feed scores include the waiting
+		votes, and a flush writes a burst of votes for a photo in one UPDATE"""
+		others = [User.objects.create_user(username=f"vote_{number}") for number in range(5)]
+		buffer = VoteBuffer(lambda image_ids: votes.recount_scores(
+			Image.objects.filter(id__in=image_ids)))
+		with override_settings(VOTE_WRITE_BEHIND=True), mock.patch.object(votes, '_buffer', buffer):
+			for user in others:
+				with self.captureOnCommitCallbacks(execute=True):
+					votes.cast_vote(user, self.image.id)
+			with self.captureOnCommitCallbacks(execute=True):
+				votes.remove_vote(others[0], self.image.id)
+			self.assertFalse(votes.cast_vote(others[1], self.image.id))
+			with self.assertRaises(Image.DoesNotExist):
+				votes.cast_vote(self.owner, self.image.id)
+
+			self.assertEqual(4, Vote.objects.count())
+			self.assertEqual(0, self.score())
+			images, _ = feed.feed_page(0)
+			self.assertEqual([4 * votes.VOTE_POINTS], [image.score for image in images])
+
+			with CaptureQueriesContext(connection) as queries:
+				self.assertEqual(1, buffer.flush())
+			self.assertEqual(1, sum(query['sql'].startswith('UPDATE "polls_image"')
+								for query in queries))
+			self.assertEqual(4 * votes.VOTE_POINTS, self.score())
+			self.assertEqual(0, buffer.pending(self.image.id))
+			self.assertEqual(0, buffer.flush())
+
+	def test_failed_flush_keeps_votes(self):
+		"""votes that could not be written are kept for the next flush"""
+		write = mock.Mock(side_effect=[RuntimeError('database went away'), None])
+		buffer = VoteBuffer(write)
+		buffer.add(self.image.id, 10)
+		with self.assertRaises(RuntimeError):
+			buffer.flush()
+		self.assertEqual(10, buffer.pending(self.image.id))
+		self.assertEqual(1, buffer.flush())
+		write.assert_called_with([self.image.id])
+
+	def test_vote_api(self):
+		"""the JSON vote endpoints change one vote and answer with the new state"""
+		client = Client(enforce_csrf_checks=True)
+		self.assertEqual(403, client.post(reverse('vote_api', args=[self.image.id])).status_code)
+		client.login(username="vote_voter", password="Cheesytoenails@123")
+		# the endpoints are protected from cross site requests like the forms
+		self.assertEqual(403, client.post(reverse('vote_api', args=[self.image.id])).status_code)
+		client = Client()
+		client.login(username="vote_voter", password="Cheesytoenails@123")
+		self.assertEqual(405, client.get(reverse('vote_api', args=[self.image.id])).status_code)
+
+		resp = client.post(reverse('vote_api', args=[self.image.id]))
+		self.assertEqual({'id': self.image.id, 'score': 10, 'voted': True}, resp.json())
+		resp = client.post(reverse('vote_api', args=[self.image.id]))
+		self.assertEqual({'id': self.image.id, 'score': 10, 'voted': True}, resp.json())
+		resp = client.post(reverse('unvote_api', args=[self.image.id]))
+		self.assertEqual({'id': self.image.id, 'score': 0, 'voted': False}, resp.json())
+		self.assertEqual(404, client.post(reverse('vote_api', args=[self.image.id + 100]))
+						.status_code)
+		for photo_id in ('abc', '9' * 30):
+			self.assertEqual(404, client.post(f'/polls/vote.json/{photo_id}').status_code)
+			self.assertEqual(404, client.post(f'/polls/vote/{photo_id}').status_code)
+			self.assertEqual(404, client.post(f'/polls/unvote/{photo_id}').status_code)
+
+	def test_votes_api(self):
+		"""several votes can be sent at once, each with its own answer"""
+		other = Image.objects.create(user=self.voter, challenge=self.image.challenge,
+									description='desc', img='picture/feed.jpg',
+									gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=0, status=Image.ACCEPTED)
+		client = Client()
+		client.login(username="vote_voter", password="Cheesytoenails@123")
+		body = {'votes': [{'id': self.image.id, 'vote': True}, {'id': other.id, 'vote': True},
+						{'id': self.image.id + 100, 'vote': False}]}
+		resp = client.post(reverse('votes_api'), body, content_type='application/json')
+		self.assertEqual([{'id': self.image.id, 'score': 10, 'voted': True},
+						{'id': other.id, 'error': 'photo not found'},
+						{'id': self.image.id + 100, 'error': 'photo not found'}],
+						resp.json()['votes'])
+		for bad in ({}, {'votes': [{'id': 'x', 'vote': True}]}, {'votes': 3},
+					{'votes': [{'id': str(self.image.id), 'vote': True}]},
+					{'votes': [{'id': True, 'vote': True}]},
+					{'votes': [{'id': float(self.image.id), 'vote': True}]},
+					{'votes': [{'id': 99999999999999999999999, 'vote': True}]},
+					{'votes': [{'id': self.image.id, 'vote': 'false'}]},
+					{'votes': [{'id': self.image.id, 'vote': 1}]}):
+			resp = client.post(reverse('votes_api'), bad, content_type='application/json')
+			self.assertEqual(400, resp.status_code)
+		resp = client.post(reverse('votes_api'), '{"votes": [{"id": 1e400, "vote": true}]}',
+						content_type='application/json')
+		self.assertEqual(400, resp.status_code)
+		too_many = {'votes': [{'id': self.image.id, 'vote': True}] * 51}
+		resp = client.post(reverse('votes_api'), too_many, content_type='application/json')
+		self.assertEqual(400, resp.status_code)
+		self.assertEqual(votes.VOTE_POINTS, self.score())
+
+	def test_recount_scores(self):
+		"""scores that do not match the votes are put right"""
+		votes.cast_vote(self.voter, self.image.id)
+		Image.objects.filter(id=self.image.id).update(score=55)
+		self.assertEqual(1, votes.recount_scores())
+		self.assertEqual(votes.VOTE_POINTS, self.score())
+		self.assertEqual(0, votes.recount_scores())
+
+
+class TestLeaderboard(TestCase):
+	"""test the leaderboard totals"""
+	def setUp(self):
+		"""create some users with photos"""
+		caches['feed_cards'].clear()
+		self.challenge = Challenge.objects.create(name='running', description='desc',
+												location='50.7366, -3.5350', locationRadius=1,
+												subject='test', active=True,
+												startDate=timezone.now(), endDate=timezone.now())
+		self.viewer = User.objects.create_user(username="board_viewer", password="Cheesytoenails@123")
+
+	def add_photo(self, user, score=0):
+		"""add an accepted photo by user"""
+		return Image.objects.create(user=user, challenge=self.challenge, description='desc',
+									img='picture/feed.jpg', gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=score, status=Image.ACCEPTED)
+
+	def totals(self):
+		"""each user's total as stored"""
+		return dict(UserScore.objects.values_list('user__username', 'score'))
+
+	def test_totals_follow_votes_and_deletions(self):
+		"""votes change the owner's total, and a deleted photo takes its score with it"""
+		owner = User.objects.create_user(username="board_owner")
+		first, second = self.add_photo(owner, score=20), self.add_photo(owner)
+		self.assertEqual({'board_owner': 20}, self.totals())
+		votes.cast_vote(self.viewer, second.id)
+		votes.cast_vote(self.viewer, first.id)
+		votes.remove_vote(self.viewer, first.id)
+		self.assertEqual({'board_owner': 30}, self.totals())
+		second.delete()
+		self.assertEqual({'board_owner': 20}, self.totals())
+
+	def test_rebuild(self):
+		"""the totals can be rebuilt from the photos"""
+		owners = [User.objects.create_user(username=f"board_{number}") for number in range(3)]
+		for number, owner in enumerate(owners):
+			self.add_photo(owner, score=number * 10)
+			self.add_photo(owner, score=5)
+		UserScore.objects.filter(user=owners[0]).update(score=999)
+		UserScore.objects.filter(user=owners[1]).delete()
+		expected = {'board_0': 5, 'board_1': 15, 'board_2': 25}
+		with CaptureQueriesContext(connection) as queries:
+			leaderboard.rebuild_user_scores()
+		# the overall and challenge totals each come from one GROUP BY
+		self.assertEqual(2, sum(query['sql'].startswith('SELECT') for query in queries))
+		self.assertEqual(expected, self.totals())
+		UserScore.objects.filter(user=owners[2]).update(score=0)
+		leaderboard.rebuild_user_scores([owners[2].id])
+		self.assertEqual(expected, self.totals())
+
+	def test_rebuild_sets_totals_in_place(self):
+		"""the totals are updated where they are rather than deleted and inserted again, so
+		points added while they are rebuilt are kept, and users without photos are removed"""
+		owner = User.objects.create_user(username="board_owner")
+		former = User.objects.create_user(username="board_former")
+		photo = self.add_photo(owner, score=10)
+		self.add_photo(former, score=5)
+		Image.objects.filter(user=former).delete()
+		Image.objects.filter(id=photo.id).update(score=30)
+		with CaptureQueriesContext(connection) as queries:
+			leaderboard.rebuild_user_scores()
+		self.assertEqual({'board_owner': 30}, self.totals())
+		self.assertEqual(30, ChallengeScore.objects.get(user=owner).score)
+		for table in ('polls_userscore', 'polls_challengescore'):
+			self.assertTrue(any(query['sql'].startswith(f'UPDATE "{table}"') for query in queries))
+			# only the rows of users with no photos left are deleted
+			self.assertTrue(all('EXISTS' in query['sql'] for query in queries
+								if query['sql'].startswith(f'DELETE FROM "{table}"')))
+
+	def test_leaderboard_page(self):
+		"""the page shows the highest totals first, in the same number of queries
+		however many users there are"""
+		def show_leaderboard():
+			with CaptureQueriesContext(connection) as queries:
+				resp = client.get('/polls/leaderboards')
+			return len(queries), resp
+
+		client = Client()
+		client.login(username="board_viewer", password="Cheesytoenails@123")
+		for number in range(3):
+			self.add_photo(User.objects.create_user(username=f"board_{number}"), score=number * 10)
+		few, _ = show_leaderboard()
+		for number in range(3, 20):
+			self.add_photo(User.objects.create_user(username=f"board_{number}"), score=number * 10)
+		many, resp = show_leaderboard()
+		self.assertEqual(few, many)
+		shown = [entry.user.username for entry in resp.context['scores']]
+		self.assertEqual([f"board_{number}" for number in range(19, -1, -1)], shown)
+		with override_settings(LEADERBOARD_SIZE=5):
+			_, resp = show_leaderboard()
+		self.assertEqual(5, len(resp.context['scores']))
+		self.assertContains(resp, 'Score: 190')
+
+
+class TestRankings(TestCase):
+	"""test ranks on the overall and challenge leaderboards"""
+	def setUp(self):
+		"""create users with photos in two challenges"""
+		caches['feed_cards'].clear()
+		self.first, self.second = (
+			Challenge.objects.create(name=name, description='desc', location='50.7366, -3.5350',
+									locationRadius=1, subject='test', active=True,
+									startDate=timezone.now(), endDate=timezone.now())
+			for name in ('first', 'second'))
+		self.users = {}
+		# overall 50, 40, 40, 30, 10, and in the second challenge only e and d
+		for name, first_score, second_score in (('a', 50, 0), ('b', 40, 0), ('c', 40, 0),
+												('d', 20, 10), ('e', 0, 10)):
+			user = User.objects.create_user(username=f"rank_{name}", password="Cheesytoenails@123")
+			self.users[name] = user
+			self.add_photo(user, self.first, first_score)
+			if second_score:
+				self.add_photo(user, self.second, second_score)
+
+	def add_photo(self, user, challenge, score):
+		"""add an accepted photo by user"""
+		return Image.objects.create(user=user, challenge=challenge, description='desc',
+									img='picture/feed.jpg', gps_coordinates='(50.7366, -3.535)',
+									taken_date=timezone.now(), score=score, status=Image.ACCEPTED)
+
+	@staticmethod
+	def summary(entries):
+		"""(rank, username, score) for each entry"""
+		return [(entry.rank, entry.user.username, entry.score) for entry in entries]
+
+	def test_pages_share_ranks_for_ties(self):
+		"""users with the same score share a rank, even across pages"""
+		scores = rankings.leaderboard_scores()
+		entries, has_next = rankings.top_page(scores, 1, 2)
+		self.assertEqual([(1, 'rank_a', 50), (2, 'rank_b', 40)], self.summary(entries))
+		self.assertTrue(has_next)
+		entries, has_next = rankings.top_page(scores, 2, 2)
+		self.assertEqual([(2, 'rank_c', 40), (4, 'rank_d', 30)], self.summary(entries))
+		entries, has_next = rankings.top_page(scores, 3, 2)
+		self.assertEqual([(5, 'rank_e', 10)], self.summary(entries))
+		self.assertFalse(has_next)
+
+	def test_user_rank_and_neighbours(self):
+		"""a user's rank and the users either side are found without reading the whole
+		leaderboard"""
+		scores = rankings.leaderboard_scores()
+		self.assertEqual(2, rankings.user_rank(scores, self.users['c']).rank)
+		with CaptureQueriesContext(connection) as queries:
+			entries = rankings.around(scores, self.users['d'], 1)
+		# the user, ties and others either side, and the counts for the ranks
+		self.assertLessEqual(len(queries), 8)
+		self.assertEqual([(2, 'rank_c', 40), (4, 'rank_d', 30), (5, 'rank_e', 10)],
+						self.summary(entries))
+		self.assertEqual([(1, 'rank_a', 50), (2, 'rank_b', 40), (2, 'rank_c', 40)],
+						self.summary(rankings.around(scores, self.users['a'], 2)))
+		outsider = User.objects.create_user(username="rank_outsider")
+		self.assertIsNone(rankings.user_rank(scores, outsider))
+		self.assertEqual([], rankings.around(scores, outsider))
+
+	def test_challenge_leaderboards(self):
+		"""each challenge ranks only the points scored in it, and follows votes"""
+		scores = rankings.leaderboard_scores(self.second)
+		self.assertEqual([(1, 'rank_d', 10), (1, 'rank_e', 10)],
+						self.summary(rankings.top_page(scores)[0]))
+		photo = Image.objects.get(user=self.users['e'], challenge=self.second)
+		votes.cast_vote(self.users['a'], photo.id)
+		self.assertEqual([(1, 'rank_e', 20), (2, 'rank_d', 10)],
+						self.summary(rankings.top_page(scores)[0]))
+		self.assertEqual(5, rankings.user_rank(rankings.leaderboard_scores(self.first),
+												self.users['e']).rank)
+		self.assertEqual([('second', 1, 20), ('first', 5, 0)],
+						[(challenge.name, entry.rank, entry.score) for challenge, entry
+						in rankings.challenge_ranks(self.users['e'])])
+
+	def test_pages(self):
+		"""the leaderboard and profile pages show ranks"""
+		client = Client()
+		client.login(username="rank_d", password="Cheesytoenails@123")
+		with override_settings(LEADERBOARD_SIZE=2):
+			resp = client.get('/polls/leaderboards', {'page': 2})
+		self.assertEqual([(2, 'rank_c', 40), (4, 'rank_d', 30)], self.summary(resp.context['scores']))
+		self.assertContains(resp, 'Your rank')
+		resp = client.get('/polls/leaderboards', {'challenge': self.second.id})
+		self.assertEqual([(1, 'rank_d', 10), (1, 'rank_e', 10)],
+						self.summary(resp.context['scores']))
+		self.assertEqual(404, client.get('/polls/leaderboards', {'challenge': 'x'}).status_code)
+		resp = client.get('/polls/profile')
+		self.assertContains(resp, '#4 overall')
+		self.assertContains(resp, '#1 in second')
+		resp = client.get('/polls/viewprofile/rank_a')
+		self.assertContains(resp, '#1 overall')
+
+
+class TestVerification(TestCase):
+	"""test the background checks on pending photos"""
+	def setUp(self):
+		"""create a user and a pending photo"""
+		self.user = User.objects.create_user(username="test_verifier", password="Cheesytoenails@123")
+		self.challenge = Challenge.objects.create(name='test_challenge',
+												description='desc',
+												location='50.7366, -3.5350',
+												locationRadius=1,
+												subject='test',
+												startDate=timezone.now() - datetime.timedelta(days=1),
+												endDate=timezone.now() + datetime.timedelta(days=1))
+		self.img_obj = Image.objects.create(user=self.user, challenge=self.challenge,
+							description="desc", img='picture/pending.jpg',
+							gps_coordinates=(50.7366, -3.5350),
+							taken_date=timezone.now(), score=0, status=Image.PENDING)
+
+	def test_photo_without_subject_is_accepted(self):
+		"""a challenge without a subject accepts the photo without running the AI"""
+		self.assertEqual(Image.ACCEPTED, verification.verify_image(self.img_obj.id))
+		self.img_obj.refresh_from_db()
+		self.assertEqual(Image.ACCEPTED, self.img_obj.status)
+
+	def test_photo_failing_ai_is_rejected(self):
+		"""a photo the AI does not accept is rejected with a reason"""
+		self.challenge.subject = 'group'
+		self.challenge.save()
+		with mock.patch.object(verification, 'get_face_count', return_value=0), \
+				mock.patch.object(verification, 'content_hash', return_value='0' * 64), \
+				mock.patch.object(verification, 'DecodedImage'):
+			self.assertEqual(Image.REJECTED, verification.verify_image(self.img_obj.id))
+		self.img_obj.refresh_from_db()
+		self.assertEqual('AI did not find multiple faces', self.img_obj.rejection_reason)
+
+	def test_upload_status(self):
+		"""the status endpoint reports the state of the user's own photo"""
+		client = Client()
+		client.login(username="test_verifier", password="Cheesytoenails@123")
+		resp = client.get("/polls/uploadstatus/" + str(self.img_obj.id))
+		self.assertEqual({'status': Image.PENDING, 'message': ''}, resp.json())
+
+		other = User.objects.create_user(username="test_other", password="Cheesytoenails@123")
+		client.login(username=other.username, password="Cheesytoenails@123")
+		resp = client.get("/polls/uploadstatus/" + str(self.img_obj.id))
+		self.assertEqual(404, resp.status_code)
+		for photo_id in ('abc', '9' * 30):
+			self.assertEqual(404, client.get("/polls/uploadstatus/" + photo_id).status_code)
+
+	def test_upload_page_only_polls_photo_ids(self):
+		"""the upload page only polls for a photo id it was given"""
+		client = Client()
+		client.login(username="test_verifier", password="Cheesytoenails@123")
+		resp = client.get("/polls/successful_upload", {'photo': self.img_obj.id})
+		self.assertContains(resp, f"uploadstatus/{self.img_obj.id}")
+		for photo in ('");alert(1);("', '9' * 30, ''):
+			resp = client.get("/polls/successful_upload", {'photo': photo})
+			self.assertIsNone(resp.context['photo_id'])
+			self.assertNotContains(resp, "uploadstatus")
+
+class TestModelLoading(TestCase):
+	"""test that the image classifier is only loaded when it is needed"""
+	def test_model_not_loaded_by_pages(self):
+		"""visiting pages that do not classify photos should not load the model"""
+		User.objects.create_user(username="test_loader", password="Cheesytoenails@123")
+		client = Client()
+		client.login(username="test_loader", password="Cheesytoenails@123")
+		for page in ["/polls/", "/polls/feed", "/polls/uploadimage"]:
+			self.assertEqual(200, client.get(page).status_code)
+		self.assertIsNone(ml_ai_image_classification._model)
+
+class TestInferenceServer(TestCase):
+	"""test the micro batching used by the inference server"""
+	def test_requests_are_batched(self):
+		"""images queued together are predicted in one batch, each caller getting its own row"""
+		batch_sizes = []
+		def predict_batch(images):
+			batch_sizes.append(len(images))
+			return images.sum(axis=1)
+		batcher = MicroBatcher(predict_batch, batch_size=4, max_latency=1)
+		futures = [batcher.submit(np.full(3, i)) for i in range(4)]
+		threading.Thread(target=batcher.run, daemon=True).start()
+		self.assertEqual([0, 3, 6, 9], [future.result(timeout=5) for future in futures])
+		self.assertEqual([4], batch_sizes)
+
+	def test_parse_address(self):
+		"""host:port is a tcp address, anything else is a unix socket"""
+		self.assertEqual(('127.0.0.1', 8765), parse_address('127.0.0.1:8765'))
+		self.assertEqual('/tmp/inference.sock', parse_address('/tmp/inference.sock'))
+
+class TestAnalysisCache(TestCase):
+	"""test the cache of AI results"""
+	def setUp(self):
+		"""two photos with different content"""
+		self.first = SimpleUploadedFile(name='first.jpg', content=b'first photo')
+		self.second = SimpleUploadedFile(name='second.jpg', content=b'second photo')
+		self.predictions = [(0, 'tench', 0.9)]
+
+	def test_predictions_are_cached(self):
+		"""the classifier only runs once for the same photo content"""
+		with mock.patch.object(analysis_cache, 'classify_image',
+								return_value=self.predictions) as classify:
+			self.assertEqual(self.predictions, analysis_cache.get_predictions(self.first))
+			again = SimpleUploadedFile(name='again.jpg', content=b'first photo')
+			self.assertEqual(self.predictions, analysis_cache.get_predictions(again))
+		self.assertEqual(1, classify.call_count)
+
+	def test_face_count_is_cached(self):
+		"""the face detector only runs once for the same photo content"""
+		with mock.patch.object(analysis_cache, 'ai_face_recognition', return_value=3) as detect:
+			self.assertEqual(3, analysis_cache.get_face_count(self.first))
+			self.assertEqual(3, analysis_cache.get_face_count(self.first))
+		self.assertEqual(1, detect.call_count)
+
+	@override_settings(ANALYSIS_CACHE_MAX_ENTRIES=1)
+	def test_eviction(self):
+		"""the least recently used results are evicted"""
+		with mock.patch.object(analysis_cache, 'classify_image', return_value=self.predictions):
+			analysis_cache.get_predictions(self.first)
+			analysis_cache.get_predictions(self.second)
+		self.assertEqual([analysis_cache.content_hash(self.second)],
+						list(AnalysisResult.objects.values_list('content_hash', flat=True)))
+
+class TestSubjectMatching(TestCase):
+	"""test matching challenge subjects against the classifier's predictions"""
+	def setUp(self):
+		"""use a small set of labels instead of the imagenet ones"""
+		self.labels = ['tiger_cat', 'catamaran', 'church', 'sea_lion', 'daisy', 'greenhouse',
+			'barbershop', 'house_finch']
+		patcher = mock.patch.object(ml_ai_image_classification, '_class_labels', self.labels)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		ml_ai_image_classification.subject_class_indices.cache_clear()
+		self.addCleanup(ml_ai_image_classification.subject_class_indices.cache_clear)
+
+	def predictions(self, *labels):
+		"""build classify_image style predictions for some labels"""
+		return [(self.labels.index(label), label, 0.5) for label in labels]
+
+	def test_whole_words_match(self):
+		"""a subject matches whole words of a label, not parts of words"""
+		self.assertTrue(ml_ai_image_classification.matches_subject(
+			self.predictions('tiger_cat'), 'cat'))
+		self.assertFalse(ml_ai_image_classification.matches_subject(
+			self.predictions('catamaran'), 'cat'))
+
+	def test_related_subjects(self):
+		"""broad subjects include their related subjects"""
+		self.assertTrue(ml_ai_image_classification.matches_subject(
+			self.predictions('church'), 'building'))
+
+	def test_compound_labels(self):
+		"""compound labels are listed for the subjects they belong to"""
+		for label in ('greenhouse', 'barbershop'):
+			self.assertTrue(ml_ai_image_classification.matches_subject(
+				self.predictions(label), 'building'))
+
+	def test_false_matches(self):
+		"""a label that only shares a word with a subject is not that subject"""
+		self.assertFalse(ml_ai_image_classification.matches_subject(
+			self.predictions('house_finch'), 'building'))
+		self.assertFalse(ml_ai_image_classification.matches_subject(
+			self.predictions('house_finch'), 'house'))
+		self.assertTrue(ml_ai_image_classification.matches_subject(
+			self.predictions('house_finch'), 'finch'))
+
+	def test_challenge_synonyms(self):
+		"""synonyms set on a challenge are accepted too"""
+		self.assertFalse(ml_ai_image_classification.matches_subject(
+			self.predictions('daisy'), 'plant'))
+		self.assertTrue(ml_ai_image_classification.matches_subject(
+			self.predictions('daisy', 'catamaran'), 'plant', 'Daisy, sea lion'))
+		self.assertTrue(ml_ai_image_classification.matches_subject(
+			self.predictions('sea_lion'), 'plant', 'Daisy, sea lion'))
+
+class TestFaceDetection(TestCase):
+	"""test the face detection pipeline"""
+	def test_cascade_is_loaded_once(self):
+		"""the cascade is reused rather than loaded from its file on every call"""
+		self.assertIs(ml_ai_image_classification.get_face_cascade(),
+					ml_ai_image_classification.get_face_cascade())
+
+	def test_large_photo_is_shrunk(self):
+		"""a photo larger than the working resolution is shrunk before detection"""
+		image = np.zeros((4000, 3000), dtype=np.uint8)
+		with mock.patch.object(ml_ai_image_classification.cv, 'resize',
+								wraps=ml_ai_image_classification.cv.resize) as resize:
+			self.assertEqual([], ml_ai_image_classification.detect_faces(image, 1000))
+		self.assertEqual((750, 1000), resize.call_args[0][1])
+
+class TestImageDecoding(TestCase):
+	"""test decoding photos once for the classifier and face detector"""
+	def setUp(self):
+		"""read a test photo"""
+		with open('./media/feed/picture/Brennan_On_the_Side_of_the_Angels_2.jpg', 'rb') as image_file:
+			self.decoded = DecodedImage(image_file)
+
+	def test_for_classifier(self):
+		"""the classifier gets a 299x299 RGB array"""
+		pixels = self.decoded.for_classifier()
+		self.assertEqual((299, 299, 3), pixels.shape)
+		self.assertEqual(np.uint8, pixels.dtype)
+
+	def test_grayscale_is_reduced(self):
+		"""the face detector gets a grayscale array no bigger than it asked for"""
+		pixels, scale = self.decoded.grayscale(400)
+		self.assertEqual(2, pixels.ndim)
+		self.assertEqual(400, max(pixels.shape))
+		self.assertAlmostEqual(400 / max(self.decoded.size), scale)
+
+	def test_decode_is_reused(self):
+		"""a decode that is big enough is reused rather than decoding again"""
+		self.decoded.grayscale(800)
+		with mock.patch('polls.image_decoding.PilImage.open') as pil_open:
+			self.decoded.grayscale(400)
+		pil_open.assert_not_called()
@@ -0,0 +1,73 @@
+"""An upload handler for photos that checks the size limit and hashes the photo while it is
+being received, so an oversized upload is stopped instead of being written to disk first.
+It also keeps the start of the file, which holds the EXIF block, so the metadata can be
+read without reading the whole photo again."""
+import hashlib
+from collections import namedtuple
+
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from .validate import MAX_IMAGE_SIZE
+
+# a JPEG's EXIF block is at most 64KB and comes straight after the start of the file
+EXIF_HEAD_SIZE = 128 * 1024
+# room in the request for the form fields and multipart headers around the photo
+FORM_OVERHEAD = 64 * 1024
+
+UploadInfo = namedtuple('UploadInfo', ['content_hash', 'size', 'head'])
+
+
+class PhotoUploadHandler(FileUploadHandler):
+    """Sits in front of Django's own upload handlers, passing every chunk on to them.
+    Results are left on the request: upload_too_large is set if the limit was broken,
+    and upload_info maps each file field to an UploadInfo."""
+
+    def __init__(self, request=None, max_size=None, head_size=EXIF_HEAD_SIZE):
+        super().__init__(request)
+        self.max_size = max_size or MAX_IMAGE_SIZE
+        self.head_size = head_size
+        self.sha = None
+        self.head = None
+        self.received = 0
+        self.request.upload_too_large = False
+        self.request.upload_info = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        """Refuse a request that says it is too big before reading any of it."""
+        if content_length > self.max_size + FORM_OVERHEAD:
+            self.request.upload_too_large = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha = hashlib.sha256()
+        self.head = bytearray()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        """Count, hash and keep the start of each chunk, then pass it on."""
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.request.upload_too_large = True
+            # the photo so far is thrown away and the rest of the request is not read
+            raise StopUpload(connection_reset=True)
+        self.sha.update(raw_data)
+        if len(self.head) < self.head_size:
+            self.head += raw_data[:self.head_size - len(self.head)]
+        return raw_data
+
+    def file_complete(self, file_size):
+        """Record what was learnt about the file, the next handler returns the file itself."""
+        self.request.upload_info[self.field_name] = UploadInfo(
+            self.sha.hexdigest(), self.received, bytes(self.head))
+        return None
+
+
+def upload_too_large(request):
+    """Read the request through the upload handlers and say whether the photo was stopped
+    for being over the size limit."""
+    request.POST  # pylint: disable=pointless-statement
+    return getattr(request, 'upload_too_large', False)
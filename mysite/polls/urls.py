@@ -1,27 +1,32 @@
 """This is used to map between the URLs and views"""
-from django.urls import path
-from django.conf import settings
-from django.conf.urls.static import static
+from django.urls import path, re_path, register_converter
 
-from . import views
+from . import media, views
+from .converters import IdConverter
+
+register_converter(IdConverter, 'id')
 
 urlpatterns = [
                   path('uploadimage', views.upload_image, name='uploadimage'),
                   path('successful_upload', views.successful_upload, name='successful_upload'),
+                  path('uploadstatus/<id:photo_id>', views.upload_status, name='uploadstatus'),
                   path('login', views.login, name='login'),
                   path('signup', views.signup, name='signup'),
                   path('logout', views.logout, name='logout'),
                   path('feed', views.display_feed, name='feed'),
+                  path('feed.json', views.feed_api, name='feed_api'),
                   path('leaderboards', views.leaderboards, name='leaderboards'),
                   path('profile', views.profile, name='profile'),
                   path('', views.home, name='home'),
                   path('viewprofile/<username>', views.view_profile, name='viewprofile'),
-                  path('vote/<photo_id>', views.vote, name='vote'),
-                  path('unvote/<photo_id>', views.unvote, name='unvote'),
-                  path('deletephoto/<photo_id>', views.delete_photo, name='deletephoto'),
+                  path('vote/<id:photo_id>', views.vote, name='vote'),
+                  path('unvote/<id:photo_id>', views.unvote, name='unvote'),
+                  path('vote.json/<id:photo_id>', views.vote_api, name='vote_api'),
+                  path('unvote.json/<id:photo_id>', views.vote_api, {'voted': False},
+                       name='unvote_api'),
+                  path('votes.json', views.votes_api, name='votes_api'),
+                  path('deletephoto/<id:photo_id>', views.delete_photo, name='deletephoto'),
                   path('deleteuser/<username>', views.delete_account, name='deleteuser'),
-              ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
-# set the media roots
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+                  # the pages link to media relative to /polls/
+                  re_path(r'^media/(?P<path>.+)$', media.serve_media, name='media'),
+              ]
@@ -2,7 +2,9 @@
 import os
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from exif import Image
+from .image_metadata import PhotoMetadata, extract_metadata
+
+MAX_IMAGE_SIZE = 5242880*4  # 20mb
 
 
 def check_user_unique(username):
@@ -44,29 +46,20 @@ def check_image_type(image):
 
 
 def validate_image_size(fname):
-    """ensure that the image size is smaller than 20mb"""
-    size = os.path.getsize(fname)
-    if size > 5242880*4:
+    """ensure that the image size is smaller than 20mb.
+    fname can be a path or an uploaded file that has not been saved yet."""
+    if hasattr(fname, 'size'):
+        size = fname.size
+    else:
+        size = os.path.getsize(fname)
+    if size > MAX_IMAGE_SIZE:
         return "invalid"
     return "valid"
 
 
 def validate_metadata(fname):
-    """This function checks that gps and location metadata is included in the image."""
-    with open(fname, 'rb') as image_file:
-        my_image = Image(image_file)
-    if my_image.has_exif:
-        # Try and find metadata, if none then return error.
-        try:
-            if my_image.gps_latitude_ref is None or my_image.gps_latitude is None or\
-                    my_image.gps_longitude_ref is None or my_image.gps_longitude is None:
-                return "missing gps"
-        except AttributeError:
-            return "missing gps"
-        try:
-            if my_image.datetime_original is None:
-                return "missing datetime"
-        except AttributeError:
-            return "missing datetime"
-        return "valid"
-    return "missing metadata"
+    """This function checks that gps and location metadata is included in the image.
+    fname can be a path, an open file or an already extracted PhotoMetadata."""
+    if isinstance(fname, PhotoMetadata):
+        return fname.status
+    return extract_metadata(fname).status
@@ -0,0 +1,114 @@
+"""This is used to run the AI checks on uploaded photos in the background,
+so that an upload request does not have to wait for the classifiers."""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .analysis_cache import content_hash, get_face_count, get_predictions
+from .image_decoding import DecodedImage
+from .ml_ai_image_classification import matches_subject
+from .models import Image, image_storage
+from .renditions import IMAGE_WIDTHS, generate_renditions
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    """Return the worker pool used to verify photos, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'VERIFICATION_WORKERS', 2),
+                thread_name_prefix='verification')
+    return _executor
+
+
+def check_photo_subject(image_file, challenge, digest=None):
+    """Run the AI on a photo to see if it shows the subject of the challenge.
+    Returns None if it does, otherwise a message explaining why it does not.
+    digest is the photo's SHA-256 if it is already known."""
+    if challenge.subject == '' or challenge.subject is None or challenge.subject == 'test':
+        # if there is no subject it cannot be analysed by the ai
+        return None
+    # the photo is read once and its pixels decoded once for whichever model needs them,
+    # results are cached by the photo's content so a photo submitted again is not re-analysed
+    decoded = DecodedImage(image_file)
+    digest = digest or content_hash(decoded)
+    if challenge.subject == "group":
+        # a group is more than one person
+        if get_face_count(decoded, digest) <= 0:
+            return 'AI did not find multiple faces'
+    elif not matches_subject(get_predictions(decoded, digest), challenge.subject,
+                             challenge.synonyms):
+        return 'AI could not find a ' + str(challenge.subject)
+    return None
+
+
+def reject_image(image, reason):
+    """Reject a photo, removing its file and keeping the reason for the status page."""
+    image.img.delete(save=False)
+    image.status = Image.REJECTED
+    image.rejection_reason = reason
+    image.save(update_fields=['img', 'status', 'rejection_reason'])
+
+
+def make_renditions(image):
+    """Make the smaller copies of an accepted photo for the feed. The photo is still
+    accepted if they cannot be made, and the pages show the original instead."""
+    try:
+        # the copies have fixed names, so they are kept in the plain storage next to the photo.
+        # the names come from the photo's content hash, so copies that already exist belong
+        # to an identical upload and are kept rather than rewritten while they are served
+        return generate_renditions(image_storage, image.img.name, IMAGE_WIDTHS,
+                                   overwrite=False)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Could not make renditions of image %s", image.id)
+        return {}
+
+
+def verify_image(image_id):
+    """Run the AI checks on a pending photo, then promote it to the feed or reject it.
+    Returns the new status of the photo."""
+    image = Image.objects.select_related('challenge').get(id=image_id)
+    if image.status != Image.PENDING:
+        return image.status
+
+    reason = check_photo_subject(image.img, image.challenge, image.content_hash)
+    if reason is None:
+        image.renditions = make_renditions(image)
+        image.status = Image.ACCEPTED
+        image.save(update_fields=['status', 'renditions'])
+    else:
+        reject_image(image, reason)
+    return image.status
+
+
+def _run_verification(image_id):
+    """Verify a photo from a worker thread, which needs its own database connection."""
+    close_old_connections()
+    try:
+        verify_image(image_id)
+    except Exception:  # pylint: disable=broad-except
+        # a photo must never be left pending because the checks crashed
+        logger.exception("Verification of image %s failed", image_id)
+        image = Image.objects.filter(id=image_id, status=Image.PENDING).first()
+        if image is not None:
+            reject_image(image, 'Photo could not be checked, please try again')
+    finally:
+        connection.close()
+
+
+def submit_verification(image_id):
+    """Queue a pending photo to be checked once the upload has been committed.
+    With VERIFICATION_ASYNC turned off the photo is checked straight away."""
+    if not getattr(settings, 'VERIFICATION_ASYNC', True):
+        verify_image(image_id)
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run_verification, image_id))
@@ -1,67 +1,57 @@
 """This is to handle views, a function that takes a web request and returns a web response"""
-import datetime
-import operator
+import json
 import random
 import pytz
-from pathlib import Path
+from io import BytesIO
 
+from django.conf import settings
 from django.contrib.auth import login as auth_login, logout as auth_logout
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
 from django.contrib import messages
 from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 
-from .ml_ai_image_classification import ai_classify_image, ai_face_recognition
-from .models import Image, Vote, Badge, Challenge
+from .models import Image, Badge, Challenge
 from .forms import LoginForm, SignupForm, ImagefieldForm, ProfileUpdateForm
-from .image_metadata import get_gps, get_time, get_distance
+from .image_metadata import extract_metadata, get_gps, get_time
 from .validate import validate_metadata, validate_image_size
+from .verification import submit_verification
+from .challenge_index import find_challenge_ids
+from .converters import is_id, parse_id
+from .upload_handlers import PhotoUploadHandler, upload_too_large
+from .votes import MAX_VOTES_PER_REQUEST, cast_vote, remove_vote, vote_states
+from .rankings import around, challenge_ranks, leaderboard_scores, top_page, user_rank
+from .feed import feed_card, feed_page, get_seed, page_size_param, voted_ids
 
 
 def get_img_metadata(fname):
-    """A function to return location and date taken from metadata."""
+    """A function to return location and date taken from metadata.
+    fname can be a path or an already extracted PhotoMetadata."""
     return get_gps(fname), get_time(fname)
 
 
-def is_photo_valid_for_challenge(request, gps, date_taken, challenge, img_path):
-    """Checks to see if the photo metadata is valid for the challenge
-    raise ValidationError(gps)."""
-    if challenge.subject == "group":
-        # a group is more than one person
-        if ai_face_recognition(img_path) <= 0:
-            messages.info(request, 'AI did not find multiple faces')
-            return False
-    elif challenge.subject == '' or challenge.subject == None or challenge.subject == 'test':
-        # if there is no subject it cannot be analysed by the ai
-        pass
-    else:
-        if ai_classify_image(img_path, challenge.subject) == False:
-            messages.info(request, 'AI could not find a ' + str(challenge.subject))
-            return False
-
-    if get_distance((challenge.location), gps) <= challenge.locationRadius:
+def is_photo_valid_for_challenge(gps, date_taken, challenge):
+    """Checks to see if where and when the photo was taken are valid for the challenge.
+    The AI checks on the photo itself are run in the background by verification."""
+    if challenge.contains(*gps):
         # validate date
         utc = pytz.UTC
         date_taken = utc.localize(date_taken)
-        # challenge.startDate = utc.localize(challenge.startDate)
-        # challenge.endDate = utc.localize(challenge.endDate)
         if date_taken > challenge.startDate and date_taken < challenge.endDate:
             return True
     return False
 
 
-def delete_image_obj(obj):
-    """To fully delete an image object, delete the image, then the object"""
-    obj.img.delete()
-    obj.delete()
-
-
 def get_user_score_and_images(user):
     """This gets a users score, total number of photos and a list of the images"""
     score = 0
     total_photos = 0
-    user_images = Image.objects.filter(user=user)
+    user_images = Image.objects.filter(user=user).exclude(status=Image.REJECTED)
     for image in user_images:
         score += image.score
         total_photos += 1
@@ -84,6 +74,46 @@ def invalid_image_size_popup(request, size_status):
         messages.info(request, 'Photo must be less than 20mb')
 
 
+def validate_upload(request, challenge, img, info=None):
+    """Validate an uploaded photo before it is written to storage or the database.
+    Returns the photo's metadata if it is accepted, otherwise None once a popup
+    has explained to the user why it was rejected. info is the UploadInfo from
+    PhotoUploadHandler, whose head is read for the metadata instead of the whole photo."""
+    # validate size of image, must be less than 20mb
+    size_status = validate_image_size(img)
+    if size_status == "invalid":
+        invalid_image_size_popup(request, size_status)  # message tells user of size error
+        return None
+
+    # read the metadata once and validate it
+    metadata = extract_metadata(BytesIO(info.head) if info is not None else img)
+    meta_status = validate_metadata(metadata)
+    if meta_status != "valid":
+        invalid_metadata_popup(request, meta_status)  # message tells user what is missing
+        return None
+
+    if challenge is None:
+        # the challenge is matched from the metadata by the caller
+        return metadata
+    if not is_photo_valid_for_challenge(metadata.gps, metadata.taken_date, challenge):
+        messages.info(request, 'Photo is either too far from challenge'
+                               ' location or was taken outside the challenge timeframe')
+        suggestions = matching_challenges(metadata)
+        if suggestions:
+            messages.info(request, 'Your photo does fit: '
+                          + ', '.join(str(suggestion) for suggestion in suggestions))
+        return None
+    return metadata
+
+
+def matching_challenges(metadata):
+    """Return the running challenges a photo qualifies for by where and when it was taken,
+    the soonest to end first."""
+    ids = find_challenge_ids(metadata.gps[0], metadata.gps[1], metadata.taken_date)
+    challenges = Challenge.objects.in_bulk(ids)
+    return [challenges[challenge_id] for challenge_id in ids if challenge_id in challenges]
+
+
 def check_badge(user):
     """This is used to check if a new badge should be added for the current user"""
     score, total_images, _ = get_user_score_and_images(user)
@@ -148,15 +178,17 @@ def check_challenge_active():
     for challenge in Challenge.objects.all():
         # Checks if a challenge is active.
         if challenge.startDate < timezone.now() < challenge.endDate:
-            challenge.active = True
-            challenge.save()
+            if not challenge.active:
+                challenge.active = True
+                challenge.save(update_fields=['active'])
         # Checks if a challenge has expired and gives out badges
         elif challenge.active is True and \
                 challenge.startDate < timezone.now() and challenge.endDate < timezone.now():
             challenge.active = False
-            challenge.save()
+            challenge.save(update_fields=['active'])
             position = 1
-            for image in Image.objects.filter(challenge=challenge).order_by('score'):
+            for image in Image.objects.filter(challenge=challenge,
+                                              status=Image.ACCEPTED).order_by('score'):
                 user = image.user
                 if position == 1 and \
                         Badge.objects.filter(user=user, name="First Badge").first() is None:
@@ -194,19 +226,49 @@ def check_challenge_active():
                     )
                     badge.save()
                 position += 1
-        else:
+        elif challenge.active:
             challenge.active = False
-            challenge.save()
-
-
+            challenge.save(update_fields=['active'])
+
+
+def choose_challenge(request, form, metadata):
+    """Pick the challenge for a photo uploaded without one. If the photo fits more than one
+    challenge the form is narrowed to those for the user to choose from."""
+    matches = matching_challenges(metadata)
+    if not matches:
+        messages.info(request, 'No running challenge matches where and when this photo'
+                               ' was taken')
+        return None
+    if len(matches) > 1:
+        form.fields['challenge'].queryset = Challenge.objects.filter(
+            id__in=[match.id for match in matches])
+        messages.info(request, 'Your photo fits more than one challenge, please choose one')
+        return None
+    return matches[0]
+
+
+@csrf_exempt
 def upload_image(request):
     """This is used once the request has been made, process it.
-    To test this page without logging in, comment out the next two lines"""
-    context = {}
-
+    To test this page without logging in, comment out the next two lines.
+    The upload handler has to be added before anything reads the request, including the
+    csrf middleware, so the csrf check is made by _upload_image instead."""
     if not request.user.is_authenticated:
         return redirect('home')
 
+    request.upload_handlers.insert(0, PhotoUploadHandler(request))
+    if request.method == "POST" and upload_too_large(request):
+        # the photo was stopped while it was being received, so nothing was stored
+        invalid_image_size_popup(request, "invalid")
+        return render(request, "uploadfile.html", {'form': ImagefieldForm()})
+    return _upload_image(request)
+
+
+@csrf_protect
+def _upload_image(request):
+    """Check and store an upload that has been received within the size limit."""
+    context = {}
+
     check_challenge_active()
 
     if request.method == "POST":
@@ -218,49 +280,36 @@ def upload_image(request):
             challenge = form.cleaned_data["challenge"]
             desc = form.cleaned_data["description"]
             img = form.cleaned_data["image"]
-            # Create the table object
+            # every check runs against the upload before anything is saved
+            info = request.upload_info.get('image')
+            if info is not None:
+                # photo_storage names the file by this hash, so it does not hash it again
+                img.content_hash = info.content_hash
+            metadata = validate_upload(request, challenge, img, info)
+            if metadata is not None and challenge is None:
+                challenge = choose_challenge(request, form, metadata)
+            if metadata is None or challenge is None:
+                context['form'] = form
+                return render(request, "uploadfile.html", context)  # refresh page
+
+            # the photo has passed the quick checks, so create the table object and store
+            # the file, the AI checks then run in the background while it is pending
             obj = Image(
                 challenge=challenge,
                 description=desc,
                 img=img,
-                gps_coordinates=(0, 0),
-                taken_date=datetime.datetime.now(),
-                score=0
+                gps_coordinates=metadata.gps,
+                latitude=metadata.gps[0],
+                longitude=metadata.gps[1],
+                taken_date=metadata.taken_date,
+                score=0,
+                status=Image.PENDING,
+                content_hash=info.content_hash if info is not None else '',
             )
             obj.user = request.user
             obj.save()
-
-            # validate size of image, must be less than 5mb
-            size_status = validate_image_size(Path('.' + obj.img.url))
-            if size_status == "invalid":
-                delete_image_obj(obj)
-                context['form'] = form
-                invalid_image_size_popup(request, size_status)  # message tells user of size error
-                return render(request, "uploadfile.html", context)  # refresh page
-            # validate metadata
-            meta_status = validate_metadata(Path('.' + obj.img.url))
-            # add image metadata to database
-            if meta_status == "valid":
-                gps, date_taken = get_img_metadata(Path('.' + obj.img.url))
-                obj.gps_coordinates = gps
-                obj.taken_date = datetime.datetime.strptime(date_taken, '%Y:%m:%d %H:%M:%S')
-            # if metadata is invalid then reject the submission
-            else:
-                delete_image_obj(obj)  # image is invalid so is deleted
-                context['form'] = form
-                invalid_metadata_popup(request, meta_status)
-                # message tells user what metadata is missing
-                return render(request, "uploadfile.html", context)  # refresh page
-
-            if is_photo_valid_for_challenge(request, gps, obj.taken_date, challenge, obj.img):
-                obj.save()
-                return redirect('successful_upload')
-            messages.info(request, 'Photo is either too far from challenge'
-                                   ' location or was taken outside the challenge timeframe')
-            obj.img.delete()
-            obj.delete()  # image is invalid, so deleted.
-            context['form'] = form
-            return render(request, "uploadfile.html", context)
+            submit_verification(obj.id)
+            return redirect(reverse('successful_upload') + '?photo=' + str(obj.id))
 
     else:
         # display the image upload form
@@ -271,8 +320,20 @@ def upload_image(request):
 
 
 def successful_upload(request):
-    """Displayed on a successful upload of an image."""
-    return render(request, "imagesuccess.html")
+    """Displayed on a successful upload of an image, while the AI checks it."""
+    # the id is put into the url the page polls, so anything else is ignored
+    return render(request, "imagesuccess.html", {'photo_id': parse_id(request.GET.get('photo'))})
+
+
+def upload_status(request, photo_id):
+    """Reports whether an uploaded photo has been checked yet, polled by the upload page."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'login required'}, status=403)
+    photo = Image.objects.filter(id=photo_id, user=request.user) \
+        .values('status', 'rejection_reason').first()
+    if photo is None:
+        return JsonResponse({'error': 'photo not found'}, status=404)
+    return JsonResponse({'status': photo['status'], 'message': photo['rejection_reason']})
 
 
 def signup(request):
@@ -318,32 +379,52 @@ def display_feed(request):
     """A view to display the photo feed to users"""
     if not request.user.is_authenticated:
         return redirect('home')
-    # images are displayed in a random order to keep the feed fresh every time
-    challenge_images = Image.objects.filter(challenge__active=True).order_by('?')
+    # images are displayed in a random order for each session, a page at a time
+    images, next_cursor = feed_page(get_seed(request.session), request.GET.get('cursor'))
 
-    return render(request, 'feed.html', {'images': challenge_images})
+    return render(request, 'feed.html', {
+        'images': images, 'next_cursor': next_cursor,
+        'voted_ids': voted_ids(request.user, images),
+        'card_cache_timeout': getattr(settings, 'FEED_CARD_CACHE_TIMEOUT', 86400)})
+
+
+def feed_api(request):
+    """The photo feed as JSON a page at a time, which the feed page loads as it is scrolled.
+    The cursor from each page asks for the page after it."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'login required'}, status=403)
+    images, next_cursor = feed_page(get_seed(request.session), request.GET.get('cursor'),
+                                    page_size_param(request.GET.get('limit')))
+    voted = voted_ids(request.user, images)
+    cards = [feed_card(image, request.user, image.id in voted) for image in images]
+    return JsonResponse({'cards': cards, 'next_cursor': next_cursor})
 
 
 def leaderboards(request):
-    """A view to display the leaderboards"""
+    """A view to display the leaderboards, overall or for one challenge, a page at a time,
+    with the user's own rank and the users either side of them"""
     if not request.user.is_authenticated:
         return redirect('home')
-    all_images = Image.objects.all()
-    score_d = {}
-    for image in all_images:
-        user_in_directory = False
-        for user in list(score_d):
-            if user == image.user:
-                user_in_directory = True
-        if user_in_directory:
-            score_d[image.user] = score_d[image.user] + image.score
-            # User in directory, the new score is added to the existing score for the user.
-        else:
-            score_d[image.user] = image.score
-    sorted_d = dict(sorted(score_d.items(), key=operator.itemgetter(1), reverse=True))
-    # Sorting the dictionary from the highest value to the lowest value
-
-    return render(request, 'leaderboards.html', {'scores': sorted_d})
+    challenge = None
+    if request.GET.get('challenge'):
+        challenge = Challenge.objects.filter(id=request.GET['challenge']).first() \
+            if request.GET['challenge'].isdigit() else None
+        if challenge is None:
+            raise Http404("Challenge not found")
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    scores = leaderboard_scores(challenge)
+    entries, has_next = top_page(scores, page)
+    return render(request, 'leaderboards.html', {
+        'scores': entries,
+        'challenge': challenge,
+        'challenges': Challenge.objects.filter(active=True).order_by('name'),
+        'page': page,
+        'has_next': has_next,
+        'around': around(scores, request.user),
+    })
 
 
 def profile(request):
@@ -374,6 +455,8 @@ def profile(request):
         'score': score,
         'total_photos': total_photos,
         'badges': badges,
+        'rank': user_rank(leaderboard_scores(), request.user),
+        'challenge_ranks': challenge_ranks(request.user),
     }
 
     return render(request, 'profile.html', context)
@@ -397,18 +480,25 @@ def view_profile(request, username=None):
         'total_photos': total_photos,
         'view_user': user,
         'badges': badges,
+        'rank': user_rank(leaderboard_scores(), user),
+        'challenge_ranks': challenge_ranks(user),
     }
 
     return render(request, 'viewprofile.html', context)
 
 
 def delete_photo(request, photo_id=None):
-    """delete a user's photo by replacing it with a placeholder"""
-    photo_to_delete = Image.objects.get(id=photo_id)
-    photo_to_delete.img = str(Path('./picture/error.jpg'))
+    """delete a user's photo by replacing it with a placeholder. The stored file is
+    released, so only the photo's owner or a member of staff may do this"""
+    if not request.user.is_authenticated:
+        return redirect('home')
+    photo_to_delete = Image.objects.filter(id=photo_id).first()
+    if photo_to_delete is None:
+        raise Http404("Photo not found")
+    if photo_to_delete.user_id != request.user.id and not request.user.is_staff:
+        raise PermissionDenied
     photo_to_delete.title = "This photo was removed"
-    photo_to_delete.description = "User deleted the photo"
-    photo_to_delete.save()
+    photo_to_delete.remove_photo("User deleted the photo")
 
     return redirect('profile')
 
@@ -426,40 +516,74 @@ def delete_account(request, username=None):
 
 def vote(request, photo_id):
     """user votes for a photo"""
+    if not request.user.is_authenticated:
+        return redirect('home')
     if request.method == "POST":
-        # make sure user can't like the photo more than once.
-        user = User.objects.get(username=request.user.username)
-        # find whatever photo is associated with vote
-        photo = Image.objects.get(id=photo_id)
-
-        new_vote = Vote(user=user, image=photo)
-        new_vote.already_voted = True
-
-        photo.score += 10
-        # adds user to photoS
-        photo.user_votes.add(user)
-        photo.save()
-        new_vote.save()
-        return redirect('feed')
+        # a second vote for the same photo is ignored
+        try:
+            cast_vote(request.user, photo_id)
+        except Image.DoesNotExist as error:
+            raise Http404("Photo not found") from error
     return redirect('feed')
 
 
 def unvote(request, photo_id):
     """user revokes their vote for a photo"""
+    if not request.user.is_authenticated:
+        return redirect('home')
     if request.method == "POST":
-        # make sure user can't like the photo more than once.
-        user = User.objects.get(username=request.user.username)
-        # find whatever post is associated with vote
-        photo = Image.objects.get(id=photo_id)
+        remove_vote(request.user, photo_id)
+    return redirect('feed')
 
-        revoke_vote = Vote.objects.get(user=user, image=photo)
-        # delete the vote
-        revoke_vote.delete()
 
-        photo.score -= 10
-        # remove user from photo
-        photo.user_votes.remove(user)
-        photo.save()
+def change_vote(user, photo_id, voted):
+    """Vote for a photo or take the vote back. Returns the error for the client, or None."""
+    try:
+        if voted:
+            cast_vote(user, photo_id)
+        else:
+            remove_vote(user, photo_id)
+    except Image.DoesNotExist:
+        return 'photo not found'
+    return None
 
-        return redirect('feed')
-    return redirect('feed')
+
+@require_POST
+def vote_api(request, photo_id, voted=True):
+    """Vote for a photo or take the vote back without reloading the feed, answering with
+    the photo's new score and whether the user has voted for it."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'login required'}, status=403)
+    if change_vote(request.user, photo_id, voted) is None:
+        state = vote_states(request.user, [photo_id]).get(photo_id)
+        if state:
+            return JsonResponse(state)
+    return JsonResponse({'error': 'photo not found'}, status=404)
+
+
+@require_POST
+def votes_api(request):
+    """Apply several votes at once, posted as JSON like
+    {"votes": [{"id": 12, "vote": true}, {"id": 15, "vote": false}]}, answering with the
+    score and vote of each photo in the same order, or an error for that vote."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'login required'}, status=403)
+    try:
+        operations = json.loads(request.body)['votes']
+        changes = [(operation['id'], operation['vote']) for operation in operations]
+    except (ValueError, TypeError, KeyError):
+        changes = None
+    # ids and votes are taken as they are sent rather than converted, so "false" is no vote
+    if changes is None or not all(is_id(photo_id) and isinstance(voted, bool)
+                                  for photo_id, voted in changes):
+        return JsonResponse({'error': 'expected {"votes": [{"id": ..., "vote": ...}]}'},
+                            status=400)
+    if len(changes) > MAX_VOTES_PER_REQUEST:
+        return JsonResponse({'error': f'at most {MAX_VOTES_PER_REQUEST} votes at once'},
+                            status=400)
+    errors = [change_vote(request.user, photo_id, voted) for photo_id, voted in changes]
+    states = vote_states(request.user, [photo_id for photo_id, _ in changes])
+    results = [states.get(photo_id, {'id': photo_id, 'error': 'photo not found'})
+               if error is None else {'id': photo_id, 'error': error}
+               for (photo_id, _), error in zip(changes, errors)]
+    return JsonResponse({'votes': results})
@@ -0,0 +1,79 @@
+"""A write-behind buffer for photo scores, used when VOTE_WRITE_BEHIND is set. Near the end
+of a challenge most votes go to a few photos, and every vote was an UPDATE of the same row,
+so the votes queued behind each other on its row lock. With the buffer, a vote only inserts
+its Vote row and adds its points to a total for the photo in memory. Every
+VOTE_FLUSH_INTERVAL seconds the photos with waiting votes are written in one UPDATE.
+
+The flush sets each score from the photo's votes instead of adding the totals to it, so
+writing a photo twice does no harm, and a flush after a crash or a missed vote puts the
+score right. Scores read through merge_pending include the totals waiting in this process,
+other processes see them after the next flush."""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """The change to each photo's score that has not been written yet. write is called
+    with the ids of the photos to write and sets their scores from their votes."""
+
+    def __init__(self, write, interval=1.0):
+        self.write = write
+        self.interval = interval
+        self.deltas = Counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, image_id, delta):
+        """Add delta to the score of a photo until the next flush."""
+        with self.lock:
+            self.deltas[image_id] += delta
+
+    def pending(self, image_id):
+        """The change to a photo's score waiting to be written."""
+        with self.lock:
+            return self.deltas.get(image_id, 0)
+
+    def flush(self):
+        """Write the photos with waiting votes, returning how many there were."""
+        with self.lock:
+            deltas, self.deltas = self.deltas, Counter()
+        if not deltas:
+            return 0
+        try:
+            self.write(list(deltas))
+        except Exception:
+            # keep the votes for the next flush
+            with self.lock:
+                self.deltas.update(deltas)
+            raise
+        return len(deltas)
+
+    def run(self):
+        """Flush every interval seconds until stopped."""
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not write buffered votes")
+            finally:
+                close_old_connections()
+
+    def start(self):
+        """Flush in a background thread, and once more when the process exits."""
+        self.thread = threading.Thread(target=self.run, name='vote-buffer', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread and write what is left."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
@@ -0,0 +1,129 @@
+"""Votes for photos. The Vote table is the only record of who voted for what, a user can
+hold one vote per photo, and a photo's score is kept equal to VOTE_POINTS for each of
+its votes. Each vote or unvote is one short transaction: the Vote row is inserted or
+deleted, and the score is changed by the database in the same transaction, so votes
+made at the same moment are all counted and the rest of the photo's row is left alone.
+With VOTE_WRITE_BEHIND set, only the Vote row is written straight away and the scores
+are written a moment later by a vote_buffer.VoteBuffer."""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .leaderboard import add_points, rebuild_user_scores
+from .models import Image, Vote
+from .vote_buffer import VoteBuffer
+
+VOTE_POINTS = 10
+# the most votes that can be sent to the votes.json endpoint at once
+MAX_VOTES_PER_REQUEST = 50
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Return the process's vote buffer, starting it on first use, or None when scores
+    are written with each vote."""
+    global _buffer
+    if not getattr(settings, 'VOTE_WRITE_BEHIND', False):
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = VoteBuffer(lambda image_ids: recount_scores(Image.objects.filter(
+                id__in=image_ids)), getattr(settings, 'VOTE_FLUSH_INTERVAL', 1.0))
+            _buffer.start()
+    return _buffer
+
+
+def merge_pending(images):
+    """Add the votes waiting in this process's buffer to the scores of loaded images."""
+    buffer = get_buffer()
+    if buffer is not None:
+        for image in images:
+            image.score += buffer.pending(image.id)
+    return images
+
+
+def votable_images(user):
+    """The photos user may vote for, which are other people's accepted photos."""
+    return Image.objects.filter(status=Image.ACCEPTED).exclude(user_id=user.id)
+
+
+def cast_vote(user, image_id):
+    """Record user's vote for a photo. Returns False if they had already voted for it,
+    raises Image.DoesNotExist if it is not a photo they may vote for."""
+    buffer = get_buffer()
+    try:
+        with transaction.atomic():
+            if buffer is not None:
+                if not votable_images(user).filter(id=image_id).exists():
+                    raise Image.DoesNotExist(image_id)
+                Vote.objects.create(user=user, image_id=image_id)
+                # the score is written by the buffer once the vote is stored
+                transaction.on_commit(lambda: buffer.add(int(image_id), VOTE_POINTS))
+                return True
+            Vote.objects.create(user=user, image_id=image_id)
+            changed = votable_images(user).filter(id=image_id).update(
+                score=F('score') + VOTE_POINTS, card_version=F('card_version') + 1)
+            if not changed:
+                raise Image.DoesNotExist(image_id)
+            add_points(image_id, VOTE_POINTS)
+    except IntegrityError:
+        # the unique constraint already holds a vote by this user for this photo
+        if not votable_images(user).filter(id=image_id).exists():
+            raise Image.DoesNotExist(image_id) from None
+        return False
+    return True
+
+
+def remove_vote(user, image_id):
+    """Take back user's vote for a photo. Returns False if they had not voted for it."""
+    buffer = get_buffer()
+    with transaction.atomic():
+        deleted, _ = Vote.objects.filter(user=user, image_id=image_id).delete()
+        if not deleted:
+            return False
+        if buffer is not None:
+            transaction.on_commit(lambda: buffer.add(int(image_id), -VOTE_POINTS))
+        else:
+            Image.objects.filter(id=image_id).update(
+                score=F('score') - VOTE_POINTS, card_version=F('card_version') + 1)
+            add_points(image_id, -VOTE_POINTS)
+    return True
+
+
+def has_voted(user, image_id):
+    """See if user has voted for a photo."""
+    return Vote.objects.filter(user_id=user.id, image_id=image_id).exists()
+
+
+def vote_states(user, image_ids):
+    """The score, including votes waiting in the buffer, and whether user has voted, for
+    each of the photos in image_ids that exists, found in two queries."""
+    images = list(Image.objects.filter(id__in=image_ids).only('id', 'score'))
+    voted = set(Vote.objects.filter(user_id=user.id, image_id__in=image_ids)
+                .values_list('image_id', flat=True))
+    return {image.id: {'id': image.id, 'score': image.score, 'voted': image.id in voted}
+            for image in merge_pending(images)}
+
+
+def recount_scores(images=None):
+    """Set the score of each photo from its votes, and the totals of their owners,
+    returning how many photos were wrong. Scores are kept up to date by cast_vote and
+    remove_vote, this puts them right after votes have been changed some other way, and
+    writes the photos in the vote buffer. Recounting every photo also rebuilds every total."""
+    everyone = images is None
+    images = Image.objects.all() if everyone else images
+    votes = Vote.objects.filter(image=OuterRef('pk')).order_by().values('image') \
+        .annotate(count=Count('id')).values('count')
+    expected = Coalesce(Subquery(votes), Value(0)) * VOTE_POINTS
+    wrong = images.alias(expected=expected).exclude(score=F('expected'))
+    with transaction.atomic():
+        owners = set(wrong.values_list('user_id', flat=True))
+        corrected = wrong.update(score=expected, card_version=F('card_version') + 1)
+        if everyone or owners:
+            rebuild_user_scores(None if everyone else owners)
+    return corrected